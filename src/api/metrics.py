@@ -0,0 +1,17 @@
+from http import HTTPStatus
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+
+from core.metrics import CONTENT_TYPE_LATEST, metrics_available, render_metrics
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics() -> Response:
+    # Формат экспозиции Prometheus, в multiprocess режиме - сумма по всем воркерам
+    if not metrics_available():
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail='prometheus_client is not installed')
+
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,34 @@
+from http import HTTPStatus
+from typing import Any, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+# Ограничиваем размер пачки, чтобы один запрос не превращался в выгрузку всего индекса
+BATCH_MAX_IDS = 100
+
+
+class BatchRequest(BaseModel):
+    ids: list[str]
+
+
+class BatchItem(BaseModel):
+    id: str
+    found: bool
+    item: Optional[Any] = None
+
+
+def validate_batch(request: BatchRequest):
+    if not request.ids:
+        raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY, detail='ids must not be empty')
+
+    if len(request.ids) > BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f'no more than {BATCH_MAX_IDS} ids per request',
+        )
+
+
+def build_batch_response(ids: list[str], docs: list) -> list[BatchItem]:
+    # Ответ в порядке запроса, ненайденные документы явно помечены found = False
+    return [BatchItem(id=doc_id, found=doc is not None, item=doc) for doc_id, doc in zip(ids, docs)]
@@ -0,0 +1,62 @@
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+
+from core.http_cache import etag_matches, make_etag
+from services.base import BaseService
+
+
+def cache_control(policy: str) -> Callable[[Response], None]:
+    """Зависимость FastAPI: заголовок Cache-Control ответа, например public, max-age=60 для CDN."""
+
+    def dependency(response: Response):
+        response.headers['Cache-Control'] = policy
+
+    return dependency
+
+
+def representation_etag(etag: str, fields: Optional[tuple[str, ...]]) -> str:
+    # У проекции по fields своё тело, поэтому и свой ETag
+    if fields is None:
+        return etag
+    return make_etag(f'{etag}:{",".join(fields)}'.encode())
+
+
+def not_modified(etag: str, policy: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': policy})
+
+
+async def check_not_modified(request: Request, service: BaseService, doc_id: str,
+                             fields: Optional[tuple[str, ...]], policy: str) -> Optional[Response]:
+    """
+    Ответ 304 по ETag документа из кеша, не загружая документ из Elasticsearch и не собирая тело ответа.
+
+    None - клиент не прислал If-None-Match, ETag изменился или документа нет в кеше: нужен полный ответ.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return None
+
+    etag = await service.get_etag(doc_id)
+    if etag is None:
+        return None
+
+    etag = representation_etag(etag, fields)
+    if not etag_matches(if_none_match, etag):
+        return None
+    # Как и полный ответ, 304 обновляет устаревший документ в фоне и засчитывает обращение в популярность
+    if not await service.revalidate(doc_id):
+        return None
+    return not_modified(etag, policy)
+
+
+def set_validators(request: Request, response: Response, etag: str,
+                   fields: Optional[tuple[str, ...]], policy: str) -> Optional[Response]:
+    """Выставляет ответу ETag и Cache-Control; 304, если клиент уже знает этот ETag."""
+    etag = representation_etag(etag, fields)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag, policy)
+
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = policy
+    return None
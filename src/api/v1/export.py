@@ -0,0 +1,52 @@
+import zlib
+from typing import AsyncIterator
+
+import orjson
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from core.compression import negotiate_encoding
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+# Строки копятся в буфер и уходят клиенту кусками такого размера, а не по одной строке на документ
+EXPORT_CHUNK_SIZE = 64 * 1024  # 64 Кб
+
+# Быстрый уровень сжатия: выгрузка упирается в процессор раньше, чем в сеть, а JSON и так хорошо жмётся
+EXPORT_GZIP_LEVEL = 1
+
+
+async def ndjson_chunks(docs: AsyncIterator[dict], compress: bool) -> AsyncIterator[bytes]:
+    # wbits=31 - формат gzip, а не голый deflate
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray()
+    async for doc in docs:
+        buffer += orjson.dumps(doc)
+        buffer += b'\n'
+        if len(buffer) < EXPORT_CHUNK_SIZE:
+            continue
+
+        chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+        buffer.clear()
+        if chunk:
+            yield chunk
+
+    tail = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if tail:
+        yield tail
+
+
+def export_response(request: Request, docs: AsyncIterator[dict], filename: str) -> StreamingResponse:
+    """
+    Потоковый ответ NDJSON, со сжатием gzip, если клиент его принимает.
+
+    StreamingResponse берёт следующий кусок только после отправки предыдущего, поэтому медленный клиент
+    сдерживает чтение из Elasticsearch, а память не растёт с размером индекса.
+    """
+    # gzip;q=0 - клиент сжатие не принимает
+    compress = negotiate_encoding(request.headers.get('accept-encoding'), ('gzip',)) == 'gzip'
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.ndjson"', 'Vary': 'Accept-Encoding'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+
+    return StreamingResponse(ndjson_chunks(docs, compress), media_type=NDJSON_MEDIA_TYPE, headers=headers)
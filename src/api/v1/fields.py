@@ -0,0 +1,21 @@
+from http import HTTPStatus
+from typing import Annotated, Callable, Optional
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+from models.projection import parse_fields
+
+
+def fields_query(model: type[BaseModel]) -> Callable[..., Optional[tuple[str, ...]]]:
+    """Зависимость FastAPI: параметр fields=id,title,rating, разобранный для модели model (см. models.projection)."""
+
+    def dependency(
+            fields: Annotated[Optional[str], Query(description='Comma separated fields to return, e.g. id,title')] = None,
+    ) -> Optional[tuple[str, ...]]:
+        try:
+            return parse_fields(fields, model)
+        except ValueError as exc:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(exc))
+
+    return dependency
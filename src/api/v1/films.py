@@ -1,16 +1,68 @@
 from http import HTTPStatus
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, FastAPI, Path, Query
+from fastapi import APIRouter, Depends, HTTPException, FastAPI, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from operator import attrgetter
+from api.v1.batch import BatchItem, BatchRequest, build_batch_response, validate_batch
+from api.v1.caching import cache_control, check_not_modified, set_validators
+from api.v1.export import export_response
+from api.v1.fields import fields_query
+from core.response_cache import CachedRoute
+from models.facets import FilmFacets
+from models.film import Film
+from models.projection import project
+from services.film import FILM_FACETS_CACHE_EXPIRE_IN_SECONDS, FilmFilters, FilmService, get_film_service
 
-from services.film import FilmService, get_film_service
+router = APIRouter()
 
-import json
+# Время жизни закешированных ответов списочных ручек, см. core.response_cache
+FILMS_LIST_CACHE_EXPIRE_IN_SECONDS = 60  # 1 минута
+FILMS_SEARCH_CACHE_EXPIRE_IN_SECONDS = 30  # 30 секунд
+
+# Cache-Control для CDN и браузеров: каталог публичный, списки живут столько же, сколько в кеше ответов
+FILMS_LIST_CACHE_CONTROL = f'public, max-age={FILMS_LIST_CACHE_EXPIRE_IN_SECONDS}'
+FILMS_SEARCH_CACHE_CONTROL = f'public, max-age={FILMS_SEARCH_CACHE_EXPIRE_IN_SECONDS}'
+FILM_DETAILS_CACHE_CONTROL = 'public, max-age=60'
+FILM_FACETS_CACHE_CONTROL = f'public, max-age={FILM_FACETS_CACHE_EXPIRE_IN_SECONDS}'
+
+# Ключи кеша ответов: значения по умолчанию параметров ручек. Полнотекстовый поиск Elasticsearch
+# не различает регистр, поэтому ?query=Star и ?query=star - один ответ
+FILMS_LIST_CACHED_ROUTE = CachedRoute(
+    FILMS_LIST_CACHE_EXPIRE_IN_SECONDS,
+    defaults={'sort': 'id', 'page_size': '10', 'page_number': '1'},
+    int_params=('page_size', 'page_number'),
+)
+FILMS_SEARCH_CACHED_ROUTE = CachedRoute(
+    FILMS_SEARCH_CACHE_EXPIRE_IN_SECONDS,
+    defaults={'query': '', 'page_size': '10', 'page_number': '1'},
+    int_params=('page_size', 'page_number'),
+    text_params=('query',),
+    case_insensitive=True,
+)
+
+FILMS_MAX_PAGE_SIZE = 100
+
+# Курсор следующей страницы отдаём заголовком, чтобы тело ответа оставалось списком фильмов
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+# Параметр fields: только перечисленные поля фильма, например fields=id,title,rating
+film_fields = fields_query(Film)
+
+
+def film_filters(
+        genre: Annotated[list[str], Query(description='Films of any of these genres, repeat for several')] = [],
+        type: Annotated[Optional[str], Query(description='Film type, e.g. movie')] = None,
+        rating_min: Annotated[Optional[float], Query(description='Minimum rating, inclusive', ge=0)] = None,
+        rating_max: Annotated[Optional[float], Query(description='Maximum rating, inclusive', ge=0)] = None,
+) -> FilmFilters:
+    """Зависимость FastAPI: общие фильтры списка фильмов, поиска и фасетов."""
+    if rating_min is not None and rating_max is not None and rating_min > rating_max:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail='rating_min is greater than rating_max')
+    # Пустой genre= не фильтрует, как и отсутствующий
+    return FilmFilters(tuple(name for name in genre if name), type or None, rating_min, rating_max)
 
-router = APIRouter()
 
 class FilmResponse(BaseModel):
     pass 
@@ -18,10 +70,15 @@ class FilmResponse(BaseModel):
 @router.get('/films', 
             response_model=list, 
             summary="Вернуть все фильмы из базы", 
-            response_description="Лист фильмов из базы")
-async def film_all(sort: str = "id", 
-                   page_size: Annotated[int, Query(description='Pagination page size', ge=1)] = 10,
+            response_description="Лист фильмов из базы",
+            dependencies=[Depends(cache_control(FILMS_LIST_CACHE_CONTROL))])
+async def film_all(response: Response,
+                   sort: Annotated[str, Query(description='Sort field, "-" prefix for descending order')] = "id",
+                   page_size: Annotated[int, Query(description='Pagination page size', ge=1, le=FILMS_MAX_PAGE_SIZE)] = 10,
                    page_number: Annotated[int, Query(description='Pagination page number', ge=1)] = 1, 
+                   cursor: Annotated[Optional[str], Query(description='Cursor from X-Next-Cursor of the previous page')] = None,
+                   fields: Optional[tuple[str, ...]] = Depends(film_fields),
+                   filters: FilmFilters = Depends(film_filters),
                    film_service: FilmService = Depends(get_film_service)) -> list:
     """
     Получить все фильмы из базы:
@@ -35,39 +92,37 @@ async def film_all(sort: str = "id",
     - **actors**: Актеры фильма
     - **directors**: Режиссеры фильма
     - **screenwriters**: Сценаристы фильма
-    """
-
-    films= await film_service.get_all(page_size, page_number)
-    if not films:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
-
-    sorted_list = list 
-    if sort == "id":
-        sorted_list = sorted(films, key=attrgetter('film.id'))
 
-    if sort == "title":
-        sorted_list = sorted(films, key=attrgetter('film.title'))
-
-    if sort == "description":
-        sorted_list = sorted(films, key=attrgetter('film.description'))
+    Сортировка (sort): id, title, rating, type, creation_date, для обратного порядка - префикс "-".
+    page_number подходит только для первых страниц, дальше листаем курсором из заголовка X-Next-Cursor.
+    fields=id,title,rating оставляет в ответе только перечисленные поля (id есть всегда).
+    Фильтры genre (можно несколько), type, rating_min и rating_max; курсор продолжает обход с теми же фильтрами.
+    """
 
-    if sort == "rating":
-        sorted_list = sorted(films, key=attrgetter('film.rating'))
+    try:
+        page = await film_service.get_all(page_size, page_number, sort=sort, cursor=cursor, fields=fields,
+                                          filters=filters)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(exc))
 
-    if sort == "type":
-        sorted_list = sorted(films, key=attrgetter('film.type'))
+    if not page:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
 
-    json_string = json.dumps([ob.__dict__ for ob in sorted_list])
+    if page.cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.cursor
 
-    return json_string
+    return page.films
 
 @router.get('/films/search', 
             response_model=list, 
             summary="Вернуть все фильмы из базы", 
-            response_description="Лист фильмов из базы")
+            response_description="Лист фильмов из базы",
+            dependencies=[Depends(cache_control(FILMS_SEARCH_CACHE_CONTROL))])
 async def film_all(query = "", 
-                   page_size: Annotated[int, Query(description='Pagination page size', ge=1)] = 10,
+                   page_size: Annotated[int, Query(description='Pagination page size', ge=1, le=FILMS_MAX_PAGE_SIZE)] = 10,
                    page_number: Annotated[int, Query(description='Pagination page number', ge=1)] = 1,
+                   fields: Optional[tuple[str, ...]] = Depends(film_fields),
+                   filters: FilmFilters = Depends(film_filters),
                    film_service: FilmService = Depends(get_film_service)) -> list:
     """
     Получить все фильмы из базы:
@@ -84,20 +139,79 @@ async def film_all(query = "",
     - **screenwriters**: Сценаристы фильма
     """
 
-    films= await film_service.get_all(page_size, page_number, query)
-    if not films:
+    try:
+        page = await film_service.get_all(page_size, page_number, query, fields=fields, filters=filters)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(exc))
+
+    if not page:
         # Если фильмы не найден, отдаём 404 статус
         # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum  
                 # Такой код будет более поддерживаемым
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
 
-    #queried_list = filter(lambda film: query in film.title or query in film.description, films)  
-    json_string = json.dumps([ob.__dict__ for ob in films])
+    return page.films
 
-    return HttpResponse(json_string)
+@router.get('/films/facets',
+            response_model=FilmFacets,
+            summary="Вернуть фасеты фильмов",
+            response_description="Число фильмов по жанрам, типам, рейтингу и годам",
+            dependencies=[Depends(cache_control(FILM_FACETS_CACHE_CONTROL))])
+async def films_facets(query: Annotated[str, Query(description='Search query, as in /films/search')] = "",
+                       filters: FilmFilters = Depends(film_filters),
+                       film_service: FilmService = Depends(get_film_service)) -> FilmFacets:
+    """
+    Фасеты фильмов, подходящих под query и фильтры списка (genre, type, rating_min, rating_max):
 
-@router.get('/films/{film_id}', response_model=FilmResponse, summary="Найти фильм по ID и вернуть его", response_description="Фильм из базы")
-async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> FilmResponse:
+    - **total**: Число подходящих фильмов
+    - **genres**: Число фильмов каждого жанра
+    - **types**: Число фильмов каждого типа
+    - **ratings**: Число фильмов по рейтингу с шагом 1, rating - начало шага
+    - **years**: Число фильмов по году создания
+    """
+
+    return await film_service.get_facets(query, filters)
+
+@router.get('/films/export',
+            response_class=StreamingResponse,
+            summary="Выгрузить все фильмы в NDJSON",
+            response_description="По документу на строку")
+async def films_export(request: Request,
+                       film_service: FilmService = Depends(get_film_service)) -> StreamingResponse:
+    """
+    Выгрузить все фильмы целиком потоком NDJSON: один документ индекса на строку.
+
+    Выгрузки изменений (modified_since) у фильмов нет: в документах индекса movies нет поля modified.
+    Клиентам с Accept-Encoding: gzip ответ отдаётся сжатым.
+    """
+
+    return export_response(request, film_service.export(), 'films')
+
+@router.post('/films/batch',
+             response_model=list[BatchItem],
+             summary="Вернуть несколько фильмов по списку ID",
+             response_description="Фильмы в порядке запроса")
+async def films_batch(request: BatchRequest, film_service: FilmService = Depends(get_film_service)) -> list[BatchItem]:
+    """
+    Получить фильмы из базы по списку ID одним запросом:
+
+    - **id**: ID из запроса
+    - **found**: Найден ли фильм
+    - **item**: Фильм, если он найден
+    """
+
+    validate_batch(request)
+    films = await film_service.get_many(request.ids)
+
+    return build_batch_response(request.ids, films)
+
+# response_model не задаём: ответом может быть и фильм целиком, и проекция по fields
+@router.get('/films/{film_id}', response_model=None, summary="Найти фильм по ID и вернуть его", response_description="Фильм из базы")
+async def film_details(request: Request,
+                       response: Response,
+                       film_id: str,
+                       fields: Optional[tuple[str, ...]] = Depends(film_fields),
+                       film_service: FilmService = Depends(get_film_service)) -> FilmResponse:
     """
     Получить фильм из базы по ID:
 
@@ -111,12 +225,21 @@ async def film_details(film_id: str, film_service: FilmService = Depends(get_fil
     - **actors**: Актеры фильма
     - **directors**: Режиссеры фильма
     - **screenwriters**: Сценаристы фильма
+
+    На If-None-Match с актуальным ETag отвечает 304 без тела.
     """
+
+    # ETag сверяем по кешу до загрузки самого фильма
+    not_modified = await check_not_modified(request, film_service, film_id, fields, FILM_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
         
     film = await film_service.get_by_id(film_id)
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
-    
-    json_string = json.dumps(film.__dict__)
 
-    return HttpResponse(json_string) 
\ No newline at end of file
+    not_modified = set_validators(request, response, await film_service.get_etag(film_id, film), fields, FILM_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    
+    return project(film, fields)
@@ -1,25 +1,42 @@
+import datetime
 from http import HTTPStatus
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from django.core.paginator import Paginator
-from django.http import JsonResponse
-from django.core import serializers
-
 from operator import attrgetter
 
+from api.v1.batch import BatchItem, BatchRequest, build_batch_response, validate_batch
+from api.v1.caching import cache_control, check_not_modified, set_validators
+from api.v1.export import export_response
+from api.v1.fields import fields_query
+from models.genre import Genre
+from models.projection import project
 from services.person import PersonService, get_person_service
 from services.genre import GenreService, get_genre_service
 
 router = APIRouter()
 
+# Время жизни закешированного ответа со списком жанров, см. core.response_cache
+GENRES_LIST_CACHE_EXPIRE_IN_SECONDS = 60 * 10  # 10 минут
+
+# Cache-Control для CDN и браузеров: жанры меняются редко
+GENRES_LIST_CACHE_CONTROL = f'public, max-age={GENRES_LIST_CACHE_EXPIRE_IN_SECONDS}'
+GENRE_DETAILS_CACHE_CONTROL = 'public, max-age=600'
+
+# Параметр fields: только перечисленные поля жанра
+genre_fields = fields_query(Genre)
+
 class GenreResponse(BaseModel):
     pass 
 
 # Внедряем GenreService с помощью Depends(get_film_service)
-@router.get('/genres', response_model=list, summary="Вернуть все жанры из базы", response_description="Лист жанры из базы")
-async def film_all(genre_service: GenreService = Depends(get_genre_service)) -> list:
+@router.get('/genres', response_model=list, summary="Вернуть все жанры из базы", response_description="Лист жанры из базы",
+            dependencies=[Depends(cache_control(GENRES_LIST_CACHE_CONTROL))])
+async def film_all(fields: Optional[tuple[str, ...]] = Depends(genre_fields),
+                   genre_service: GenreService = Depends(get_genre_service)) -> list:
     """
     Получить все фильмы из базы:
 
@@ -44,19 +61,61 @@ async def film_all(genre_service: GenreService = Depends(get_genre_service)) ->
         # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
         # вы бы предоставляли клиентам данные, которые им не нужны 
         # и, возможно, данные, которые опасно возвращать
-    return genres
+    return [project(genre, fields) for genre in genres]
+
+@router.get('/genres/export',
+            response_class=StreamingResponse,
+            summary="Выгрузить все жанры в NDJSON",
+            response_description="По документу на строку")
+async def genres_export(request: Request,
+                        modified_since: Annotated[Optional[datetime.datetime], Query(description='Only documents modified since this time')] = None,
+                        genre_service: GenreService = Depends(get_genre_service)) -> StreamingResponse:
+    """
+    Выгрузить все жанры целиком потоком NDJSON: один документ индекса на строку.
+
+    - **modified_since**: Только документы, изменённые начиная с этого времени, для выгрузки изменений
+
+    Клиентам с Accept-Encoding: gzip ответ отдаётся сжатым.
+    """
+
+    return export_response(request, genre_service.export(modified_since), 'genres')
 
-@router.get('/genres/{genre_id}', response_model=GenreResponse, summary="Вернуть жанр по ID из базы")
-async def get_genre(genre_id: str, genre_service: GenreService = Depends(get_person_service)) -> GenreResponse:
+@router.post('/genres/batch', response_model=list[BatchItem], summary="Вернуть несколько жанров по списку ID")
+async def genres_batch(request: BatchRequest, genre_service: GenreService = Depends(get_genre_service)) -> list[BatchItem]:
+    """
+    Получить жанры из базы по списку ID одним запросом:
+
+    - **id**: ID из запроса
+    - **found**: Найден ли жанр
+    - **item**: Жанр, если он найден
+    """
+
+    validate_batch(request)
+    genres = await genre_service.get_many(request.ids)
+
+    return build_batch_response(request.ids, genres)
+
+# response_model не задаём: ответом может быть и жанр целиком, и проекция по fields
+@router.get('/genres/{genre_id}', response_model=None, summary="Вернуть жанр по ID из базы")
+async def get_genre(request: Request,
+                    response: Response,
+                    genre_id: str,
+                    fields: Optional[tuple[str, ...]] = Depends(genre_fields),
+                    genre_service: GenreService = Depends(get_genre_service)) -> GenreResponse:
 
     """
     Получить жанр по ID: 
 
     - **id**: Каждый жанр имеет ID
     - **name**: Каждый жанр имеет имя
-     
+
+    На If-None-Match с актуальным ETag отвечает 304 без тела.
     """
 
+    not_modified = await check_not_modified(request, genre_service, genre_id, fields, GENRE_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+
     genre = await genre_service.get_by_id(genre_id)
     if not genre:
         # Если Person не найден, отдаём 404 статус
@@ -64,10 +123,14 @@ async def get_genre(genre_id: str, genre_service: GenreService = Depends(get_per
                 # Такой код будет более поддерживаемым
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='genre not found')
 
+    not_modified = set_validators(request, response, await genre_service.get_etag(genre_id, genre), fields, GENRE_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+
     # Перекладываем данные из models.Person в Person
     # Обратите внимание, что у модели бизнес-логики есть поле description 
         # Которое отсутствует в модели ответа API. 
         # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
         # вы бы предоставляли клиентам данные, которые им не нужны 
         # и, возможно, данные, которые опасно возвращать
-    return GenreResponse(genre) 
\ No newline at end of file
+    return project(genre, fields)
@@ -1,29 +1,69 @@
+import datetime
 from http import HTTPStatus
+from typing import Annotated, Optional
 from api.v1.films import FilmResponse
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from services.film import FilmService
 
+from api.v1.batch import BatchItem, BatchRequest, build_batch_response, validate_batch
+from api.v1.caching import cache_control, check_not_modified, set_validators
+from api.v1.export import export_response
+from api.v1.fields import fields_query
+from core.response_cache import CachedRoute
+from models.projection import project
+from models.film import Film
+from models.person import Person
 from services.person import PersonService, get_person_service
 from services.film import FilmService, get_film_service
 
-from django.core.paginator import Paginator
-from django.http import JsonResponse
-from django.core import serializers
-
 from operator import attrgetter
 
 router = APIRouter()
 
+# Параметр fields: только перечисленные поля персоны или фильма
+person_fields = fields_query(Person)
+film_fields = fields_query(Film)
+
+# Время жизни закешированных ответов списочных ручек, см. core.response_cache
+PERSONS_LIST_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+PERSONS_SEARCH_CACHE_EXPIRE_IN_SECONDS = 60  # 1 минута
+
+# Cache-Control для CDN и браузеров: списки живут столько же, сколько в кеше ответов
+PERSONS_LIST_CACHE_CONTROL = f'public, max-age={PERSONS_LIST_CACHE_EXPIRE_IN_SECONDS}'
+PERSONS_SEARCH_CACHE_CONTROL = f'public, max-age={PERSONS_SEARCH_CACHE_EXPIRE_IN_SECONDS}'
+PERSON_DETAILS_CACHE_CONTROL = 'public, max-age=60'
+
+# Ключи кеша ответов: значения по умолчанию параметров ручек. Поиск персон сравнивает подстроку
+# с учётом регистра, поэтому ?query=Star и ?query=star - разные ответы
+PERSONS_LIST_CACHED_ROUTE = CachedRoute(
+    PERSONS_LIST_CACHE_EXPIRE_IN_SECONDS,
+    defaults={'sort': 'id', 'pageSize': '5', 'pageNumber': '1'},
+    int_params=('pageSize', 'pageNumber'),
+)
+PERSONS_SEARCH_CACHED_ROUTE = CachedRoute(
+    PERSONS_SEARCH_CACHE_EXPIRE_IN_SECONDS,
+    defaults={'query': '', 'pageSize': '5', 'pageNumber': '1'},
+    int_params=('pageSize', 'pageNumber'),
+    text_params=('query',),
+)
+
+# Поля, по которым сортируется список персон
+PERSON_SORT_FIELDS = ('id', 'full_name', 'gender')
+
 class PersonResponse(BaseModel):
     pass 
 
 class PersonRequest(BaseModel):
     pass 
 
-@router.get('/persons', response_model=list, summary="Вернуть всех персон из базы")
-async def person_all(sort: str = "id", pageSize = 5, pageNumber = 1, person_service: PersonService = Depends(get_person_service)) -> list:
+@router.get('/persons', response_model=list, summary="Вернуть всех персон из базы",
+            dependencies=[Depends(cache_control(PERSONS_LIST_CACHE_CONTROL))])
+async def person_all(sort: str = "id", pageSize = 5, pageNumber = 1,
+                     fields: Optional[tuple[str, ...]] = Depends(person_fields),
+                     person_service: PersonService = Depends(get_person_service)) -> list:
     """
     Получить все персоны из базы:
 
@@ -35,25 +75,27 @@ async def person_all(sort: str = "id", pageSize = 5, pageNumber = 1, person_serv
 
     """
 
-    persons= await person_service.get_all()
+    # Поле сортировки загружаем вместе с запрошенными, в ответ оно попадёт, только если его запросили
+    source = tuple(sorted({*fields, sort})) if fields and sort in PERSON_SORT_FIELDS else fields
+    persons= await person_service.get_all_persons(source)
     if not persons:
         # Если фильмы не найден, отдаём 404 статус
         # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum  
                 # Такой код будет более поддерживаемым
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='persons not found')
 
-    sorted_list = list 
+    sorted_list = persons
     if sort == "id":
-        sorted_list = sorted(persons, key=attrgetter('person.id'))
+        sorted_list = sorted(persons, key=attrgetter('id'))
 
     if sort == "full_name":
-        sorted_list = sorted(persons, key=attrgetter('person.full_name'))
+        sorted_list = sorted(persons, key=attrgetter('full_name'))
 
     if sort == "gender":
-        sorted_list = sorted(persons, key=attrgetter('person.gender'))
+        sorted_list = sorted(persons, key=attrgetter('gender'))
 
-    paginator = Paginator(sorted_list, pageSize)
-    page = paginator.page(pageNumber)
+    start_index = (int(pageNumber) - 1) * int(pageSize)
+    page = [project(person, fields) for person in sorted_list[start_index:start_index + int(pageSize)]]
 
     # Не Перекладываем данные из models.Person в Person, просто отдаем колекцию данных
     # Обратите внимание, что у модели бизнес-логики есть поле description 
@@ -61,12 +103,13 @@ async def person_all(sort: str = "id", pageSize = 5, pageNumber = 1, person_serv
         # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
         # вы бы предоставляли клиентам данные, которые им не нужны 
         # и, возможно, данные, которые опасно возвращать
-    data_serialized = serializers.serialize("json", page.object_list)
+    return page
 
-    return JsonResponse(data_serialized, safe=False)
-
-@router.get('/persons/search', response_model=list, summary="Вернуть всех персон из базы и используя запрос / query")
-async def person_all(query: str = "", pageSize = 5, pageNumber = 1, person_service: PersonService = Depends(get_person_service)) -> list:
+@router.get('/persons/search', response_model=list, summary="Вернуть всех персон из базы и используя запрос / query",
+            dependencies=[Depends(cache_control(PERSONS_SEARCH_CACHE_CONTROL))])
+async def person_all(query: str = "", pageSize = 5, pageNumber = 1,
+                     fields: Optional[tuple[str, ...]] = Depends(person_fields),
+                     person_service: PersonService = Depends(get_person_service)) -> list:
     """
     Получить все персоны из базы:
 
@@ -78,7 +121,8 @@ async def person_all(query: str = "", pageSize = 5, pageNumber = 1, person_servi
 
     """
 
-    persons= await person_service.get_all()
+    # Имя нужно для фильтрации по запросу, даже если его нет среди запрошенных полей
+    persons= await person_service.get_all_persons(tuple(sorted({*fields, 'full_name'})) if fields else None)
     if not persons:
         # Если фильмы не найден, отдаём 404 статус
         # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum  
@@ -86,10 +130,10 @@ async def person_all(query: str = "", pageSize = 5, pageNumber = 1, person_servi
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='persons not found')
 
     # Запрос и фильтрацию можно выполнить на стороне БД
-    queried_list = filter(lambda person: query in person.full_name, persons) 
+    queried_list = [person for person in persons if query in person.full_name]
 
-    paginator = Paginator(queried_list, pageSize)
-    page = paginator.page(pageNumber)   
+    start_index = (int(pageNumber) - 1) * int(pageSize)
+    page = [project(person, fields) for person in queried_list[start_index:start_index + int(pageSize)]]
 
     # Не Перекладываем данные из models.Person в Person, просто отдаем колекцию данных
     # Обратите внимание, что у модели бизнес-логики есть поле description 
@@ -97,13 +141,48 @@ async def person_all(query: str = "", pageSize = 5, pageNumber = 1, person_servi
         # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
         # вы бы предоставляли клиентам данные, которые им не нужны 
         # и, возможно, данные, которые опасно возвращать
-    data_serialized = serializers.serialize("json", page.object_list)
+    return page
+
+@router.get('/persons/export',
+            response_class=StreamingResponse,
+            summary="Выгрузить всех персон в NDJSON",
+            response_description="По документу на строку")
+async def persons_export(request: Request,
+                         modified_since: Annotated[Optional[datetime.datetime], Query(description='Only documents modified since this time')] = None,
+                         person_service: PersonService = Depends(get_person_service)) -> StreamingResponse:
+    """
+    Выгрузить всех персон целиком потоком NDJSON: один документ индекса на строку.
+
+    - **modified_since**: Только документы, изменённые начиная с этого времени, для выгрузки изменений
+
+    Клиентам с Accept-Encoding: gzip ответ отдаётся сжатым.
+    """
+
+    return export_response(request, person_service.export(modified_since), 'persons')
 
-    return JsonResponse(data_serialized, safe=False)
+@router.post('/persons/batch', response_model=list[BatchItem], summary="Вернуть несколько персон по списку ID")
+async def persons_batch(request: BatchRequest, person_service: PersonService = Depends(get_person_service)) -> list[BatchItem]:
+    """
+    Получить персоны из базы по списку ID одним запросом:
+
+    - **id**: ID из запроса
+    - **found**: Найдена ли персона
+    - **item**: Персона, если она найдена
+    """
+
+    validate_batch(request)
+    persons = await person_service.get_many(request.ids)
+
+    return build_batch_response(request.ids, persons)
 
 # Внедряем FilmService с помощью Depends(get_film_service)
-@router.get('/persons/{person_id}', response_model=PersonService, summary="Вернуть персону по ID из базы")
-async def person_details(person_id: str, person_service: PersonService = Depends(get_person_service)) -> PersonService:
+# response_model не задаём: ответом может быть и персона целиком, и проекция по fields
+@router.get('/persons/{person_id}', response_model=None, summary="Вернуть персону по ID из базы")
+async def person_details(request: Request,
+                         response: Response,
+                         person_id: str,
+                         fields: Optional[tuple[str, ...]] = Depends(person_fields),
+                         person_service: PersonService = Depends(get_person_service)) -> Person:
     """
     Получить персону по ID: 
 
@@ -112,9 +191,14 @@ async def person_details(person_id: str, person_service: PersonService = Depends
     - **created*: Дата когда прерсона была добавлена в базу
     - **modified**: Дата когда прерсона была модифицирована в базе
     - **gender* Пол персоны муж или жен
-    
+
+    На If-None-Match с актуальным ETag отвечает 304 без тела.
     """
 
+    not_modified = await check_not_modified(request, person_service, person_id, fields, PERSON_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+
     person = await person_service.get_by_id(person_id)
     if not person:
         # Если Person не найден, отдаём 404 статус
@@ -122,18 +206,28 @@ async def person_details(person_id: str, person_service: PersonService = Depends
                 # Такой код будет более поддерживаемым
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='person not found')
 
+    not_modified = set_validators(request, response, await person_service.get_etag(person_id, person), fields, PERSON_DETAILS_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+
     # Перекладываем данные из models.Person в Person
     # Обратите внимание, что у модели бизнес-логики есть поле description 
         # Которое отсутствует в модели ответа API. 
         # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
         # вы бы предоставляли клиентам данные, которые им не нужны 
         # и, возможно, данные, которые опасно возвращать
-    return PersonResponse(person) 
-
-@router.get('/persons/{person_id}/film', response_model=FilmResponse, summary="Вернуть фильмы по персоне ID из базы")
-async def film_by_person_id(person_id: str, pageSize = 5, pageNumber = 1, film_service: FilmService = Depends(get_film_service)) -> list:
+    return project(person, fields)
+
+@router.get('/persons/{person_id}/film', response_model=list, summary="Вернуть фильмы по персоне ID из базы",
+            dependencies=[Depends(cache_control(PERSON_DETAILS_CACHE_CONTROL))])
+async def film_by_person_id(person_id: str,
+                            role: Annotated[Optional[list[str]], Query(description='Roles filter: actor, director, screenwriter')] = None,
+                            pageSize: Annotated[int, Query(ge=1, le=100)] = 5,
+                            pageNumber: Annotated[int, Query(ge=1)] = 1,
+                            fields: Optional[tuple[str, ...]] = Depends(film_fields),
+                            film_service: FilmService = Depends(get_film_service)) -> list[Film]:
     """
-    Получить фильм из базы по ID:
+    Получить фильмы персоны по ID персоны:
 
     - **id**: Каждый фильм имеет ID
     - **title**: Название фильма
@@ -145,45 +239,18 @@ async def film_by_person_id(person_id: str, pageSize = 5, pageNumber = 1, film_s
     - **actors**: Актеры фильма
     - **directors**: Режиссеры фильма
     - **screenwriters**: Сценаристы фильма
-    """
-
-    films = await film_service.get_all()
-    if not films:
-        # Если Person не найден, отдаём 404 статус
-        # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum  
-                # Такой код будет более поддерживаемым
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='No films in database')
-
-    films_by_person_id = list
-
-    # На заметку НИКОГДА не писать BLL логику в контролере и ВСЕГДА делать конретный запрос к БД чтобы не писать лишнюю логику. Ушел в магазин =) 
-    for film in films:
-        found = False
-        for actor in film.actors:
-            if actor.id == person_id:
-                found = True
 
-        if found != True:
-            for director in film.directors:
-                if director.id == person_id:
-                    found = True
-
-        if found != True:
-            for screenwriter in film.screenwriters:
-                if screenwriter.id == person_id:
-                    found = True
+    Фильтр по ролям (role) можно передать несколько раз, без него ищем во всех ролях.
+    """
 
-        if found == True:
-            film_by_person_id.append(film)                
-    # На заметку НИКОГДА не писать BLL логику в контролере и ВСЕГДА делать конретный запрос к БД чтобы не писать лишнюю логику. Ушел в магазин =) 
+    # Поиск по ролям выполняет Elasticsearch, контроллер только отдаёт результат
+    try:
+        films = await film_service.get_by_person(person_id, pageSize, pageNumber, role)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(exc))
 
-    # Перекладываем данные из models.Person в Person
-    # Обратите внимание, что у модели бизнес-логики есть поле description 
-        # Которое отсутствует в модели ответа API. 
-        # Если бы использовалась общая модель для бизнес-логики и формирования ответов API
-        # вы бы предоставляли клиентам данные, которые им не нужны 
-        # и, возможно, данные, которые опасно возвращать
-    return films_by_person_id
+    # У персоны может не быть фильмов - это пустой список, а не 404
+    return [project(film, fields) for film in films]
 
 @router.post('/persons/create}', response_model=PersonRequest, summary="Добавить новую персону в базу")
 async def person_details(person: PersonRequest, person_service: PersonService = Depends(get_person_service)) -> PersonRequest:
@@ -0,0 +1,31 @@
+import hmac
+from http import HTTPStatus
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from core.config import get_settings
+from core.stats import collect_stats
+
+router = APIRouter()
+
+# Счётчики раскрывают устройство сервиса, поэтому отдаём их только с секретом stats_token в этом заголовке
+STATS_TOKEN_HEADER = 'X-Stats-Token'
+
+
+def require_stats_token(token: Annotated[Optional[str], Header(alias=STATS_TOKEN_HEADER)] = None):
+    expected = get_settings().stats_token
+    # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по времени ответа
+    if not expected or token is None or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail='stats token required')
+
+
+@router.get('/stats', response_model=dict, include_in_schema=False, dependencies=[Depends(require_stats_token)])
+async def service_stats() -> dict:
+    """
+    Получить счётчики компонентов сервиса:
+
+    - **single_flight**: Сколько промахов кеша загрузили данные сами (leaders), а сколько дождались чужой загрузки (coalesced)
+    """
+
+    return collect_stats()
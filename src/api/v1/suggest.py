@@ -0,0 +1,42 @@
+from http import HTTPStatus
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from api.v1.caching import cache_control
+from db.implementation.suggest_index import SUGGEST_MAX_LIMIT
+from models.suggest import Suggestions
+from services.suggest import SuggestService, get_suggest_service
+
+router = APIRouter()
+
+# Подсказки меняются только при обновлении индекса префиксов, CDN и браузер могут держать их минуту
+SUGGEST_CACHE_CONTROL = 'public, max-age=60'
+
+# Пока индекс префиксов загружается, просим клиента повторить через секунду
+SUGGEST_NOT_READY_RETRY_AFTER = '1'
+
+
+@router.get('/suggest',
+            response_model=Suggestions,
+            summary="Подсказки по началу названия фильма и имени персоны",
+            response_description="Фильмы и персоны, начинающиеся с запроса",
+            dependencies=[Depends(cache_control(SUGGEST_CACHE_CONTROL))])
+async def suggest(q: Annotated[str, Query(description='Beginning of a film title or a person name', max_length=100)],
+                  limit: Annotated[int, Query(description='Suggestions of each kind', ge=1, le=SUGGEST_MAX_LIMIT)] = 10,
+                  suggest_service: SuggestService = Depends(get_suggest_service)) -> Suggestions:
+    """
+    Подсказки для поисковой строки на каждый введённый символ:
+
+    - **films**: Фильмы, название которых или одно из его слов начинается с q, по убыванию рейтинга
+    - **persons**: Персоны, имя или фамилия которых начинается с q, по убыванию числа фильмов
+
+    Регистр, диакритика и знаки препинания не учитываются. Ответ строится из памяти сервиса, без Elasticsearch.
+    """
+
+    suggestions = suggest_service.suggest(q, limit)
+    if suggestions is None:
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail='suggest index is loading',
+                            headers={'Retry-After': SUGGEST_NOT_READY_RETRY_AFTER})
+
+    return suggestions
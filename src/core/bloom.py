@@ -0,0 +1,62 @@
+import hashlib
+import math
+import struct
+
+# Заголовок снимка фильтра: число бит, число хеш-функций и число добавленных элементов
+SNAPSHOT_HEADER = struct.Struct('>QIQ')
+
+
+class BloomFilter:
+    """
+    Фильтр Блума: отвечает «точно нет» или «возможно есть» без хранения самих ID.
+
+    Позиции бит считаются двойным хешированием одного blake2b дайджеста:
+    https://www.eecs.harvard.edu/~michaelm/postscripts/rsa2008.pdf
+    """
+
+    def __init__(self, size_in_bits: int, hash_count: int, bits: bytearray | None = None, count: int = 0):
+        self.size_in_bits = size_in_bits
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size_in_bits + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        size_in_bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(size_in_bits / capacity * math.log(2)))
+        return cls(size_in_bits, hash_count)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = struct.unpack('>QQ', digest)
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size_in_bits
+
+    def add(self, item: str):
+        changed = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                changed = True
+
+        # Повторное добавление того же элемента не увеличивает счётчик
+        if changed:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def false_positive_rate(self) -> float:
+        # Оценка вероятности ложного срабатывания для текущего числа элементов
+        return (1 - math.exp(-self.hash_count * self.count / self.size_in_bits)) ** self.hash_count
+
+    def to_bytes(self) -> bytes:
+        return SNAPSHOT_HEADER.pack(self.size_in_bits, self.hash_count, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        size_in_bits, hash_count, count = SNAPSHOT_HEADER.unpack_from(data)
+        return cls(size_in_bits, hash_count, bytearray(data[SNAPSHOT_HEADER.size:]), count)
@@ -0,0 +1,184 @@
+"""
+Circuit breaker вокруг запросов к медленному или недоступному хранилищу.
+
+CLOSED - запросы идут как обычно, результаты последних window_size запросов копятся в окне. Как только в окне
+не меньше minimum_calls запросов, а доля ошибок или медленных (дольше slow_call_duration) запросов дошла до порога,
+breaker переходит в OPEN: запросы сразу получают CircuitOpenError и не ждут хранилище, занимая event loop.
+Через open_duration секунд - HALF_OPEN: пропускаем до half_open_calls пробных запросов. Все прошли быстро и без
+ошибок - снова CLOSED, хотя бы один не прошёл - снова OPEN.
+
+Сервисы на CircuitOpenError отдают последнюю известную копию из кеша, а если её нет - 503 с Retry-After.
+"""
+import math
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable
+
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+
+from core.metrics import CIRCUIT_BREAKER_REJECTED, CIRCUIT_BREAKER_STATE
+
+
+class CircuitState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+# Последние известные копии (last known good) документов и ответов, которые отдаём, пока breaker открыт.
+# Живут намного дольше основных ключей кеша
+LAST_KNOWN_GOOD_KEY_PREFIX = 'lkg'
+
+
+def last_known_good_key(key: str) -> str:
+    return f'{LAST_KNOWN_GOOD_KEY_PREFIX}:{key}'
+
+
+# Значения метрики circuit_breaker_state
+STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Хранилище признано недоступным, запрос в него не отправлялся; retry_after - через сколько секунд повторить."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f'{name} circuit is open, retry after {retry_after:.1f}s')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+            self,
+            name: str,
+            window_size: int = 50,
+            minimum_calls: int = 10,
+            failure_rate_threshold: float = 0.5,
+            slow_call_duration: float = 2.0,
+            slow_call_rate_threshold: float = 0.8,
+            open_duration: float = 10.0,
+            half_open_calls: int = 3,
+            is_failure: Callable[[BaseException], bool] = lambda error: True,
+    ):
+        self.name = name
+        self.minimum_calls = minimum_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        # Какие исключения считать отказом хранилища: например, отсутствующий документ - это не отказ
+        self.is_failure = is_failure
+
+        self.state = CircuitState.CLOSED
+        # Окно последних запросов: (ошибка, медленный)
+        self._window: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self.opened = 0
+        self.rejected = 0
+        self._state_gauge = CIRCUIT_BREAKER_STATE.labels(name)
+        self._rejected_counter = CIRCUIT_BREAKER_REJECTED.labels(name)
+        self._state_gauge.set(STATE_VALUES[self.state])
+
+    def before_call(self):
+        """Разрешает запрос или бросает CircuitOpenError; после разрешённого запроса - on_success или on_failure."""
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.open_duration:
+                self._reject()
+            self._transition(CircuitState.HALF_OPEN)
+
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_calls:
+                self._reject()
+            self._probes_in_flight += 1
+
+    def on_success(self, duration: float):
+        self._record(False, duration >= self.slow_call_duration)
+
+    def on_failure(self, error: BaseException, duration: float):
+        # Не отказ хранилища (например, документ не найден) - обычный ответ, оцениваем только по времени
+        self._record(self.is_failure(error), duration >= self.slow_call_duration)
+
+    def on_cancel(self):
+        # Отменённый запрос ничего не говорит о хранилище, но место пробного запроса нужно освободить
+        if self.state == CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def retry_after(self) -> float:
+        if self.state == CircuitState.OPEN:
+            return max(self.open_duration - (time.monotonic() - self._opened_at), 0.0)
+        return 0.0
+
+    def _record(self, failed: bool, slow: bool):
+        if self.state == CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+            if failed or slow:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CircuitState.CLOSED)
+            return
+
+        if self.state == CircuitState.OPEN:
+            # Запрос начался до открытия breaker, в окно его уже не пишем
+            return
+
+        self._window.append((failed, slow))
+        if len(self._window) < self.minimum_calls:
+            return
+        failures = sum(failed for failed, _ in self._window)
+        slow_calls = sum(slow for _, slow in self._window)
+        if (failures / len(self._window) >= self.failure_rate_threshold
+                or slow_calls / len(self._window) >= self.slow_call_rate_threshold):
+            self._open()
+
+    def _open(self):
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState):
+        self.state = state
+        self._window.clear()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._state_gauge.set(STATE_VALUES[state])
+
+    def _reject(self):
+        self.rejected += 1
+        self._rejected_counter.inc()
+        # В HALF_OPEN, пока идут пробные запросы, повторить можно уже через open_duration
+        raise CircuitOpenError(self.name, self.retry_after() or self.open_duration)
+
+    def stats(self) -> dict:
+        failures = sum(failed for failed, _ in self._window)
+        slow_calls = sum(slow for _, slow in self._window)
+        return {
+            'state': self.state.value,
+            'window_calls': len(self._window),
+            'window_failures': failures,
+            'window_slow_calls': slow_calls,
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'retry_after': round(self.retry_after(), 3),
+        }
+
+
+def circuit_open_handler(request: Request, exc: CircuitOpenError) -> ORJSONResponse:
+    """Обработчик исключения для FastAPI: 503 с Retry-After вместо ожидания недоступного хранилища."""
+    return ORJSONResponse(
+        status_code=503,
+        content={'detail': f'{exc.name} is temporarily unavailable'},
+        headers={'Retry-After': str(max(math.ceil(exc.retry_after), 1))},
+    )
+
+
+def is_circuit_open_response(status_code: int, headers) -> bool:
+    # Ответ circuit_open_handler: по нему кеш ответов решает, отдать ли последнюю известную копию
+    return status_code == 503 and 'retry-after' in headers
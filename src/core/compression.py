@@ -0,0 +1,206 @@
+"""
+Сжатие ответов по Accept-Encoding: zstd, br (если установлен brotli) и gzip.
+
+Сжимаются только json и текстовые ответы не меньше minimum_size байт. Ответ известной длины сжимается целиком,
+потоковый ответ без Content-Length - по кускам, ответы с уже выставленным Content-Encoding отдаются как есть.
+Кеш ответов хранит сжатые варианты рядом с исходными байтами и отдаёт их без повторного сжатия.
+Сравнение уровней сжатия по CPU и объёму - tests/benchmarks/response_compression.py.
+"""
+import gzip
+import zlib
+from typing import Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from core.http_cache import encoded_etag
+
+# brotli и zstandard нужны только для соответствующих кодировок
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Средние уровни: на страницах /films дальнейший рост CPU почти не уменьшает ответ (см. бенчмарк)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Кодировки в порядке предпочтения сервера при одинаковом q у клиента
+ENCODINGS = ('zstd', 'br', 'gzip')
+
+COMPRESSIBLE_MEDIA_TYPES = ('application/json', 'text/')
+
+
+def available_encodings() -> tuple[str, ...]:
+    installed = {'zstd': zstandard is not None, 'br': brotli is not None, 'gzip': True}
+    return tuple(encoding for encoding in ENCODINGS if installed[encoding])
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        # Размер в заголовке кадра позволяет клиенту выделить буфер под ответ сразу
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, write_content_size=True).compress(body)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 - одинаковое тело даёт одинаковые байты, что важно для кеша и ETag
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f'unsupported encoding: {encoding}')
+
+
+class StreamCompressor:
+    """Сжатие потокового ответа: каждый кусок сбрасывается сразу, чтобы клиент не ждал конца потока."""
+
+    def __init__(self, encoding: str):
+        if encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            # wbits=31 - формат gzip вместо "голого" zlib
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+        else:
+            raise ValueError(f'unsupported encoding: {encoding}')
+        self.encoding = encoding
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(self._flush_mode)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def negotiate_encoding(accept_encoding: Optional[str], encodings: Iterable[str]) -> Optional[str]:
+    """
+    Выбирает кодировку из encodings по заголовку Accept-Encoding: gzip;q=0.8, br, *;q=0.1
+
+    Побеждает наибольший q, при равных - порядок encodings. None - ответ отдаётся без сжатия.
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if name:
+            weights[name] = weight
+
+    wildcard = weights.get('*', 0.0)
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, wildcard)
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return bool(media_type) and media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжимает ответы не меньше minimum_size байт кодировкой, которую принимает клиент."""
+
+    def __init__(self, app, minimum_size: int, encodings: Optional[tuple[str, ...]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings() if encodings is None else encodings
+
+    async def __call__(self, scope, receive, send):
+        # У ответа на HEAD нет тела, которое можно сжать, а Content-Length исходного тела менять нельзя
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding'), self.encodings)
+        start_message = None
+        # Режим после первого куска тела: passthrough, buffer (длина известна) или stream (длина неизвестна)
+        mode = None
+        chunks = []
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start_message, mode, compressor
+            if message['type'] == 'http.response.start':
+                # Заголовки придержим до первого куска тела: от него зависят Content-Encoding и Content-Length
+                start_message = message
+                return
+
+            if message['type'] != 'http.response.body':
+                return await send(message)
+
+            if mode is None:
+                mode = self._choose_mode(start_message, message, encoding)
+                if mode == 'stream':
+                    compressor = StreamCompressor(encoding)
+                    headers = MutableHeaders(scope=start_message)
+                    del headers['Content-Length']
+                    self._set_encoding(headers, encoding)
+                if mode != 'buffer':
+                    await send(start_message)
+
+            if mode == 'passthrough':
+                return await send(message)
+
+            more_body = message.get('more_body', False)
+            if mode == 'stream':
+                body = compressor.compress(message.get('body', b''))
+                if not more_body:
+                    body += compressor.finish()
+                return await send({**message, 'body': body})
+
+            chunks.append(message.get('body', b''))
+            if more_body:
+                return
+
+            body = compress(b''.join(chunks), encoding)
+            headers = MutableHeaders(scope=start_message)
+            self._set_encoding(headers, encoding)
+            headers['Content-Length'] = str(len(body))
+            await send(start_message)
+            await send({**message, 'body': body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _set_encoding(headers: MutableHeaders, encoding: str):
+        headers['Content-Encoding'] = encoding
+        # У сжатого тела свой сильный ETag
+        if 'etag' in headers:
+            headers['ETag'] = encoded_etag(headers['etag'], encoding)
+
+    def _choose_mode(self, start: dict, message: dict, encoding: Optional[str]) -> str:
+        headers = MutableHeaders(scope=start)
+        if 'content-encoding' in headers or not is_compressible(headers.get('content-type')):
+            return 'passthrough'
+
+        # Ответ зависит от Accept-Encoding, даже если именно этот клиент получит его без сжатия
+        headers.add_vary_header('Accept-Encoding')
+        if encoding is None:
+            return 'passthrough'
+
+        # Тело может прийти несколькими кусками (например, через BaseHTTPMiddleware), длину берём из заголовка
+        content_length = headers.get('content-length')
+        if content_length is None and not message.get('more_body', False):
+            content_length = len(message.get('body', b''))
+        if content_length is None:
+            return 'stream'
+        return 'buffer' if int(content_length) >= self.minimum_size else 'passthrough'
@@ -1,7 +1,7 @@
 import os
+from functools import lru_cache
 from logging import config as logging_config
 
-from pydantic import BaseSettings
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from core.logger import LOGGING
@@ -18,12 +18,130 @@ class Settings(BaseSettings):
     redis_host: str
     redis_port: int
 
+     # Пул соединений Redis: размер и сколько секунд ждать свободное соединение, таймауты сокета и keep-alive,
+    # проверка простаивающих соединений PING-ом и повтор команды после таймаута
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 5.0
+    redis_socket_timeout: float = 5.0
+    redis_socket_connect_timeout: float = 2.0
+    redis_socket_keepalive: bool = True
+    redis_health_check_interval: int = 30  # 30 секунд
+    redis_retry_on_timeout: bool = True
+
      # Настройки Elasticsearch
     elastic_host: str
     elastic_port: int
 
+     # Пул соединений Elasticsearch: соединений на узел, таймаут запроса, keep-alive простаивающих соединений,
+    # повторы и поиск узлов кластера (sniffing) при старте, после ошибки соединения и раз в elastic_sniffer_timeout
+    elastic_connections_per_node: int = 25
+    elastic_timeout: float = 10.0
+    elastic_keepalive_timeout: float = 60.0  # 1 минута
+    elastic_max_retries: int = 3
+    elastic_retry_on_timeout: bool = True
+    elastic_sniff_on_start: bool = False
+    elastic_sniff_on_connection_fail: bool = False
+    elastic_sniffer_timeout: float | None = None
+
+     # Сколько соединений к Redis и Elasticsearch открыть параллельно при старте, чтобы первые запросы их не ждали
+    pool_warmup_connections: int = 10
+
+     # Circuit breaker запросов к поисковому движку: окно последних запросов, пороги доли ошибок и медленных
+    # запросов (дольше circuit_breaker_slow_call_duration секунд), сколько секунд он открыт и сколько пробных запросов
+    # пропускает после этого. Пока он открыт, отдаём последние известные копии из кеша или 503 с Retry-After
+    circuit_breaker_enabled: bool = True
+    circuit_breaker_window_size: int = 50
+    circuit_breaker_minimum_calls: int = 10
+    circuit_breaker_failure_rate: float = 0.5
+    circuit_breaker_slow_call_duration: float = 2.0
+    circuit_breaker_slow_call_rate: float = 0.8
+    circuit_breaker_open_duration: float = 10.0
+    circuit_breaker_half_open_calls: int = 3
+
+     # Поисковый движок: elasticsearch или memory (в памяти процесса, для локальных запусков без Elasticsearch)
+    # и JSON файл с документами для него: {"movies": [...], "genres": [...], "persons": [...]}
+    search_engine_backend: str = 'elasticsearch'
+    search_engine_fixtures: str | None = None
+
+     # Аренда ключа в Redis (SET NX) при промахе кеша, чтобы кеш заполнял только один воркер
+    cache_lease_enabled: bool = False
+
+     # L1 кеш внутри процесса перед Redis
+    cache_l1_enabled: bool = True
+    cache_l1_max_entries: int = 10_000
+    cache_l1_max_bytes: int = 64 * 1024 * 1024  # 64 Мб
+    cache_l1_ttl: int = 30  # 30 секунд
+
+     # Формат значений кеша: сериализатор orjson или msgpack, сжатие none, lz4 или zstd для значений от порога в байтах
+    cache_serializer: str = 'orjson'
+    cache_compression: str = 'none'
+    cache_compression_threshold: int = 1024
+
+     # Сжатие ответов по Accept-Encoding (zstd, br, gzip) для тел от порога в байтах
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024
+
+     # Фильтры Блума по ID индексов, чтобы отвечать 404 на несуществующие ID без Redis и Elasticsearch.
+    # Только для индексов, о новых документах которых ETL сообщает воркерам (add:<id>), иначе новый документ
+    # получит ложный 404 до перестроения фильтра. О фильмах сообщать некому, поэтому movies по умолчанию нет
+    bloom_enabled: bool = True
+    bloom_indexes: list[str] = ['persons', 'genres']
+    bloom_false_positive_rate: float = 0.01
+    bloom_rebuild_interval: int = 60 * 60  # 1 час
+
+     # Период проверки индекса genres на изменения для снимка жанров в памяти
+    genre_dictionary_refresh_interval: int = 60  # 1 минута
+
+     # Подсказки /api/v1/suggest из памяти процесса: период сверки индекса префиксов с индексами movies и persons
+    suggest_enabled: bool = True
+    suggest_refresh_interval: int = 60  # 1 минута
+    # Полная перезагрузка индексов без поля modified (movies): их изменения по версии индекса не видны
+    suggest_full_reload_interval: int = 60 * 10  # 10 минут
+
+     # Популярность документов и страниц списков для прогрева кеша: счётчики в Redis (ZSET), которые раз в
+    # popularity_half_life секунд уменьшаются вдвое. Накопленное в памяти воркера уходит в Redis раз в
+    # popularity_flush_interval секунд, в каждом множестве остаются popularity_max_members самых популярных ключей
+    popularity_enabled: bool = True
+    popularity_flush_interval: int = 5  # 5 секунд
+    popularity_half_life: int = 60 * 60 * 6  # 6 часов
+    popularity_max_members: int = 10_000
+
+     # Прогрев кеша самыми популярными документами и страницами списков при старте и раз в warmup_interval секунд:
+    # сколько документов каждого индекса и страниц брать, сколько загрузок идёт одновременно, документов в одном mget
+    # и сколько секунд отводится на весь прогрев
+    warmup_enabled: bool = True
+    warmup_interval: int = 60 * 5  # 5 минут
+    warmup_top_documents: int = 500
+    warmup_top_pages: int = 100
+    warmup_concurrency: int = 4
+    warmup_batch_size: int = 100
+    warmup_time_budget: float = 10.0  # 10 секунд
+
+     # Метрики Prometheus на /metrics и период замера лага event loop
+    metrics_enabled: bool = True
+    event_loop_lag_interval: float = 0.5  # 500 миллисекунд
+
+     # Профилирование запросов: заголовок X-Profile с секретом profiling_token или доля случайных запросов.
+    # Профили speedscope и разбивка времени сохраняются в profiling_output_dir, без токена и доли профилирование выключено
+    profiling_token: str | None = None
+    profiling_sample_rate: float = 0.0
+    profiling_interval: float = 0.001  # 1 миллисекунда
+    profiling_output_dir: str = '/tmp/profiles'
+
+     # Внутренние счётчики на /api/v1/stats: только с заголовком X-Stats-Token, без токена ручка выключена
+    stats_token: str | None = None
+
+     # Источник ETL индекса persons (python -m etl.persons)
+    postgres_dsn: str | None = None
+
     model_config = SettingsConfigDict(env_file=".env")
 
+
+# Настройки читаются один раз на процесс, чтобы middleware, сервисы и lifespan видели один и тот же объект
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
+
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
  
\ No newline at end of file
@@ -0,0 +1,26 @@
+import base64
+import binascii
+
+import orjson
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+# Курсор для клиента непрозрачен: это base64url от json с позицией в выдаче Elasticsearch
+def encode_cursor(state: dict) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(state)).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        state = orjson.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError) as exc:
+        raise InvalidCursorError('invalid cursor') from exc
+
+    if not isinstance(state, dict):
+        raise InvalidCursorError('invalid cursor')
+
+    return state
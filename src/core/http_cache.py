@@ -0,0 +1,47 @@
+"""
+Валидаторы HTTP кеша: сильные ETag по байтам ответа и проверка If-None-Match.
+
+У сжатого ответа другое тело, поэтому и свой ETag: к ETag исходного тела добавляется суффикс кодировки
+("abc" -> "abc-gzip"). При сравнении с If-None-Match суффикс отбрасывается, так что клиент, сохранивший
+сжатый вариант, получает 304 и тогда, когда ответ пришёл бы в другой кодировке.
+"""
+import hashlib
+from typing import Optional
+
+import orjson
+from pydantic import BaseModel
+
+# 128 бит хеша хватает, чтобы разные тела не получали один ETag
+ETAG_DIGEST_SIZE = 16
+
+
+def make_etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=ETAG_DIGEST_SIZE).hexdigest()}"'
+
+
+def model_etag(model: BaseModel) -> str:
+    # Хеш json документа: тот же документ всегда даёт тот же ETag, на каком бы воркере он ни считался
+    return make_etag(orjson.dumps(model.dict()))
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # Слабые ETag (W/"...") одинаковы для всех кодировок, их не меняем
+    if not etag.startswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _opaque_tag(etag: str) -> str:
+    # В hex хеша нет дефиса, поэтому всё после него - суффикс кодировки
+    return etag.strip().removeprefix('W/').strip('"').partition('-')[0]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Слабое сравнение из RFC 9110 для If-None-Match: W/ и суффикс кодировки не учитываются."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    tag = _opaque_tag(etag)
+    return any(_opaque_tag(candidate) == tag for candidate in if_none_match.split(','))
@@ -0,0 +1,220 @@
+"""
+Метрики Prometheus: задержки ручек, Redis и Elasticsearch, попадания в кеш, запросы в обработке и лаг event loop.
+
+Несколько воркеров uvicorn пишут метрики в общий каталог PROMETHEUS_MULTIPROC_DIR (multiprocess режим
+prometheus_client), и /metrics в любом воркере отдаёт сумму по всем процессам. Каталог задаётся переменной
+окружения до старта процесса, а master gunicorn очищает его перед запуском воркеров (см. gunicorn.conf.py),
+иначе в суммы попадали бы счётчики процессов прошлого запуска.
+
+Без установленного prometheus_client метрики ничего не делают, а /metrics отвечает 503.
+"""
+import asyncio
+import glob
+import os
+import time
+
+from starlette.routing import Match
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                                   generate_latest, multiprocess)
+except ImportError:
+    CollectorRegistry = Counter = Gauge = Histogram = generate_latest = multiprocess = None
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+    REGISTRY = None
+
+
+# Границы бакетов в секундах: от попадания в L1 кеш до медленного поиска
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+EVENT_LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Метка для запросов, не попавших ни в одну ручку, чтобы произвольные пути не плодили временные ряды
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class _NoopMetric:
+    """Заглушка на случай, когда prometheus_client не установлен."""
+
+    def labels(self, *args, **kwargs) -> '_NoopMetric':
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+
+def _metric(kind, *args, **kwargs):
+    return _NoopMetric() if kind is None else kind(*args, **kwargs)
+
+
+HTTP_REQUEST_DURATION = _metric(
+    Histogram, 'http_request_duration_seconds', 'Время обработки запроса по шаблону пути и статусу',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = _metric(
+    Gauge, 'http_requests_in_flight', 'Запросы в обработке', multiprocess_mode='livesum',
+)
+BACKEND_REQUEST_DURATION = _metric(
+    Histogram, 'backend_request_duration_seconds', 'Время запросов к Redis и Elasticsearch',
+    ['backend', 'operation', 'index'], buckets=LATENCY_BUCKETS,
+)
+BACKEND_ERRORS = _metric(
+    Counter, 'backend_errors_total', 'Ошибки запросов к Redis и Elasticsearch',
+    ['backend', 'operation', 'index', 'error'],
+)
+CACHE_REQUESTS = _metric(
+    Counter, 'cache_requests_total', 'Обращения к кешу сервисов: hit или miss', ['service', 'result'],
+)
+CACHE_EVICTIONS = _metric(
+    Counter, 'cache_evictions_total', 'Записи, удалённые из L1 кеша: capacity, expired или invalidated', ['reason'],
+)
+POOL_CONNECTIONS_IN_USE = _metric(
+    Gauge, 'pool_connections_in_use', 'Соединения пулов Redis и Elasticsearch, занятые запросами', ['backend'],
+    multiprocess_mode='livesum',
+)
+POOL_ACQUIRE_DURATION = _metric(
+    Histogram, 'pool_acquire_duration_seconds', 'Ожидание свободного соединения пула вместе с открытием нового',
+    ['backend'], buckets=LATENCY_BUCKETS,
+)
+CIRCUIT_BREAKER_STATE = _metric(
+    Gauge, 'circuit_breaker_state', 'Состояние circuit breaker: 0 - closed, 1 - half_open, 2 - open', ['name'],
+    multiprocess_mode='livemax',
+)
+CIRCUIT_BREAKER_REJECTED = _metric(
+    Counter, 'circuit_breaker_rejected_total', 'Запросы, отклонённые открытым circuit breaker', ['name'],
+)
+CACHE_WARMUP_DURATION = _metric(
+    Histogram, 'cache_warmup_duration_seconds', 'Длительность прогрева кеша популярными ключами',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+CACHE_WARMUP_KEYS = _metric(
+    Counter, 'cache_warmup_keys_total', 'Ключи, загруженные в кеш прогревом: документы по индексам и страницы', ['kind'],
+)
+EVENT_LOOP_LAG = _metric(
+    Histogram, 'event_loop_lag_seconds', 'Насколько позже запланированного просыпается event loop',
+    buckets=EVENT_LOOP_LAG_BUCKETS,
+)
+
+
+def metrics_available() -> bool:
+    return REGISTRY is not None
+
+
+def is_multiprocess() -> bool:
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+def render_metrics() -> bytes:
+    if is_multiprocess():
+        # Каждый раз собираем реестр заново: файлы метрик пишут все воркеры
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def clear_multiprocess_dir():
+    # Файлы метрик прошлого запуска: их pid могут совпасть с новыми воркерами, а счётчики сложились бы с новыми
+    if is_multiprocess():
+        for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+            os.remove(path)
+
+
+def mark_process_dead(pid: int | None = None):
+    # Gauge в режиме livesum не должен учитывать значения остановленного воркера
+    if metrics_available() and is_multiprocess():
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+# Временные ряды задержек хранилищ по меткам: labels() берёт блокировку на каждый вызов
+_backend_histograms = {}
+
+
+def observe_backend(backend: str, operation: str, index: str, started: float, error: BaseException | None = None):
+    """Записывает длительность запроса к хранилищу, начатого в started (time.perf_counter())."""
+    histogram = _backend_histograms.get((backend, operation, index))
+    if histogram is None:
+        histogram = _backend_histograms[backend, operation, index] = BACKEND_REQUEST_DURATION.labels(
+            backend, operation, index)
+    histogram.observe(time.perf_counter() - started)
+    if error is not None:
+        BACKEND_ERRORS.labels(backend, operation, index, type(error).__name__).inc()
+
+
+async def monitor_event_loop_lag(interval: float):
+    """Засыпает на interval и записывает, насколько позже проснулся: так видно блокирующий код в обработчиках."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0.0))
+
+
+def route_template(scope) -> str:
+    """Шаблон пути найденной ручки: /api/v1/films/{film_id} вместо /api/v1/films/<uuid>."""
+    # Роутер кладёт в scope ручку и значения параметров пути. Ответы из кеша ответов до роутера не доходят,
+    # для них шаблон ищем в таблице маршрутов приложения так же, как это сделал бы роутер
+    if 'endpoint' not in scope:
+        return _match_route(scope)
+
+    names = {str(value): name for name, value in scope.get('path_params', {}).items()}
+    if not names:
+        return scope['path']
+    return '/'.join(f'{{{names[part]}}}' if part in names else part for part in scope['path'].split('/'))
+
+
+def _match_route(scope) -> str:
+    router = getattr(scope.get('app'), 'router', None)
+    partial = None
+    for route in getattr(router, 'routes', ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: время ответа по шаблону пути (/api/v1/films/{film_id}) и статусу, число запросов в обработке.
+
+    Написан без BaseHTTPMiddleware, чтобы не добавлять лишнюю задачу и поток ответа на каждый запрос.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # labels() берёт блокировку на каждый вызов, поэтому найденные временные ряды держим в словаре
+        self._histograms = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            labels = (scope['method'], route_template(scope), status)
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = HTTP_REQUEST_DURATION.labels(*labels[:2], str(status))
+            histogram.observe(time.perf_counter() - started)
@@ -0,0 +1,234 @@
+"""
+Профилирование отдельных запросов по требованию.
+
+Запрос профилируется, если в заголовке X-Profile передан секрет PROFILING_TOKEN или если он попал в долю
+PROFILING_SAMPLE_RATE. Для такого запроса:
+- поток-сэмплер снимает стек event loop и сохраняет профиль в формате speedscope (https://www.speedscope.app);
+- время раскладывается по этапам: cache (Redis), search_engine, validation (декодирование моделей),
+  serialization (рендер ответа) и возвращается в заголовке Server-Timing;
+- поиски уходят в Elasticsearch с profile: true, их профили сохраняются рядом с разбивкой времени.
+
+Сэмплер видит весь поток event loop, поэтому в профиль попадают и параллельные запросы.
+По умолчанию профилирование выключено, и middleware в приложение не добавляется.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b'x-profile'
+
+# Порядок этапов в Server-Timing
+PROFILE_PHASES = ('cache', 'search_engine', 'validation', 'serialization')
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, query: str):
+        self.id = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.method = method
+        self.path = path
+        self.query = query
+        self.status = None
+        self.timings: dict[str, float] = defaultdict(float)
+        # Ответы Elasticsearch на поиски с profile: true
+        self.search_profiles: list[dict] = []
+
+    def server_timing(self, total: float) -> str:
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+        phases = [(phase, self.timings[phase]) for phase in PROFILE_PHASES if phase in self.timings]
+        return ', '.join(f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in [*phases, ('total', total)])
+
+    def summary(self, total: float) -> dict:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'query': self.query,
+            'status': self.status,
+            'total_ms': round(total * 1000, 3),
+            'timings_ms': {phase: round(seconds * 1000, 3) for phase, seconds in self.timings.items()},
+            'search_profiles': self.search_profiles,
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('current_profile', default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+def record_timing(phase: str, started: float):
+    """Добавляет к этапу время с started (time.perf_counter()), если текущий запрос профилируется."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.timings[phase] += time.perf_counter() - started
+
+
+def profiled(phase: str):
+    """Декоратор синхронной функции: её время попадает в этап phase профилируемого запроса."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_profile.get() is None:
+                return func(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_timing(phase, started)
+
+        return wrapper
+
+    return decorator
+
+
+class ProfiledORJSONResponse(ORJSONResponse):
+    """ORJSONResponse, время рендера которого попадает в этап serialization."""
+
+    @profiled('serialization')
+    def render(self, content) -> bytes:
+        return super().render(content)
+
+
+class StackSampler(threading.Thread):
+    """Раз в interval секунд снимает стек потока thread_id, пока не вызван stop()."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: list[tuple[list, float]] = []
+        self._stopped = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                # Вес сэмпла - фактическое время с прошлого: под GIL поток просыпается не точно по интервалу
+                self.samples.append((stack[::-1], now - last))
+            last = now
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def speedscope(self, name: str) -> dict:
+        # https://github.com/jlfwong/speedscope/wiki/Importing-from-custom-sources
+        frames, indexes, samples, weights = [], {}, [], []
+        for stack, weight in self.samples:
+            sample = []
+            for code in stack:
+                if code not in indexes:
+                    indexes[code] = len(frames)
+                    frames.append({
+                        'name': getattr(code, 'co_qualname', code.co_name),
+                        'file': code.co_filename,
+                        'line': code.co_firstlineno,
+                    })
+                sample.append(indexes[code])
+            samples.append(sample)
+            weights.append(weight)
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'async-api profiling',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+
+def save_profile(output_dir: str, profile: RequestProfile, sampler: StackSampler, total: float) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, profile.id)
+    name = f'{profile.method} {profile.path}'
+    with open(f'{path}.speedscope.json', 'wb') as file:
+        file.write(orjson.dumps(sampler.speedscope(name)))
+    with open(f'{path}.json', 'wb') as file:
+        file.write(orjson.dumps(profile.summary(total), option=orjson.OPT_INDENT_2))
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: профилирует запросы с заголовком X-Profile: <token> и долю sample_rate случайных запросов.
+
+    Профиль и разбивка времени сохраняются в output_dir, имя файлов возвращается в заголовке X-Profile-Id.
+    """
+
+    def __init__(self, app, token: Optional[str], sample_rate: float, interval: float, output_dir: str):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output_dir = output_dir
+
+    def _should_profile(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope['headers']:
+                # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по времени ответа
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope['method'], scope['path'], scope['query_string'].decode('latin-1'))
+        sampler = StackSampler(threading.get_ident(), self.interval)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                profile.status = message['status']
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', profile.server_timing(time.perf_counter() - started))
+                headers.append('X-Profile-Id', profile.id)
+            await send(message)
+
+        context_token = _current_profile.set(profile)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            total = time.perf_counter() - started
+            _current_profile.reset(context_token)
+            sampler.stop()
+            try:
+                path = await asyncio.to_thread(save_profile, self.output_dir, profile, sampler, total)
+                logger.info('profiled %s %s in %.1f ms: %s', profile.method, profile.path, total * 1000, path)
+            except OSError:
+                logger.exception('failed to save profile %s', profile.id)
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from typing import NamedTuple, Optional, Union
+from urllib.parse import quote
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.datastructures import QueryParams
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+
+from core.circuit_breaker import is_circuit_open_response, last_known_good_key
+from core.compression import compress, negotiate_encoding
+from core.http_cache import encoded_etag, etag_matches, make_etag
+from core.metrics import CACHE_REQUESTS
+from db.abstract.cache import AsyncCacheStorage
+from db.implementation.popularity import POPULARITY_PAGES, PopularityTracker
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_KEY_PREFIX = 'response'
+
+# Сколько хранится последняя известная копия ответа для недоступного Elasticsearch
+RESPONSE_LAST_KNOWN_GOOD_EXPIRE_IN_SECONDS = 60 * 60  # 1 час
+
+
+class CachedRoute(NamedTuple):
+    """Кешируемая ручка: время жизни ответа и правила приведения её параметров к ключу кеша."""
+
+    expire: int
+    # Значения по умолчанию параметров ручки. Если клиент передал значение по умолчанию явно,
+    # то ключ кеша должен совпасть с ключом запроса без параметра: /films == /films?page_number=1
+    defaults: dict[str, str] = {}
+    # Целые параметры: page_number=01 и page_number=1 - одна страница
+    int_params: tuple[str, ...] = ()
+    # Параметры свободного текста попадают в ключ как есть: регистр и пробелы могут менять ответ
+    text_params: tuple[str, ...] = ()
+    # Поиск ручки по тексту не различает регистр и лишние пробелы (анализатор Elasticsearch),
+    # поэтому "Star  Wars" и "star wars" - один ключ
+    case_insensitive: bool = False
+
+# Страницы по курсору не считаем популярными: курсор почти у каждого запроса свой и быстро устаревает
+UNTRACKED_QUERY_PARAMS = ('cursor',)
+
+# Ключ ASGI scope запросов прогрева кеша (services.warmup): они заполняют кеш, но не считаются обращениями
+CACHE_WARMUP_SCOPE_KEY = 'cache_warmup'
+
+# Заголовки ответа, которые сохраняются в кеше вместе с телом (например, курсор следующей страницы)
+CACHED_RESPONSE_HEADERS = ('x-next-cursor', 'cache-control')
+
+# Заголовки ответа 304: по ним клиент и CDN обновляют сохранённый ответ
+NOT_MODIFIED_HEADERS = ('cache-control', 'vary')
+
+
+def normalize_query_params(query_params: QueryParams, route: CachedRoute = CachedRoute(0)) -> list[tuple[str, str]]:
+    """Приводит параметры запроса к каноническому виду: сортировка по имени, без пустых и дефолтных значений."""
+    normalized = []
+    for name, value in query_params.multi_items():
+        if name in route.text_params:
+            if route.case_insensitive:
+                value = ' '.join(value.lower().split())
+        else:
+            value = value.strip()
+        if name in route.int_params and value.isdigit():
+            value = str(int(value))
+        if name == 'fields':
+            # fields=title,id и fields=id,title - одна и та же проекция
+            value = ','.join(sorted({field.strip() for field in value.split(',') if field.strip()}))
+        if not value or route.defaults.get(name) == value:
+            continue
+        normalized.append((name, value))
+
+    return sorted(normalized)
+
+
+def build_cache_key(path: str, query_params: QueryParams, route: CachedRoute = CachedRoute(0)) -> str:
+    # Имена и значения экранируются: query=x%26page_number%3D2 и query=x&page_number=2 - разные ключи
+    query = '&'.join(f'{quote(name, safe="")}={quote(value, safe="")}'
+                     for name, value in normalize_query_params(query_params, route))
+    return f'{RESPONSE_CACHE_KEY_PREFIX}:{path.rstrip("/")}?{query}'
+
+
+def variant_key(key: str, encoding: str) -> str:
+    # Сжатый вариант лежит рядом с исходным ответом; # не встречается в пути и параметрах запроса
+    return f'{key}#{encoding}'
+
+
+def validator_key(key: str) -> str:
+    # Только заголовки ответа с ETag: условный запрос проверяется без чтения тела
+    return f'{key}#etag'
+
+
+def response_cache_keys(key: str, encodings: tuple[str, ...] = ()) -> list[str]:
+    """Все ключи одного закешированного ответа: исходный ответ, ETag и сжатые варианты."""
+    return [key, validator_key(key), *(variant_key(key, encoding) for encoding in encodings)]
+
+
+def cache_key_url(key: str) -> str:
+    # Ключ кеша - путь и нормализованные параметры запроса, по ним запрос можно повторить
+    return key[len(RESPONSE_CACHE_KEY_PREFIX) + 1:]
+
+
+def pack_response(body: bytes, headers: dict[str, str]) -> bytes:
+    # Первая строка - заголовки в json, дальше тело ответа как есть
+    return orjson.dumps(headers) + b'\n' + body
+
+
+def unpack_response(data: bytes) -> tuple[bytes, dict[str, str]]:
+    headers, _, body = data.partition(b'\n')
+    return body, orjson.loads(headers)
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    Кеширует уже сериализованные ответы GET ручек в AsyncCacheStorage.
+
+    routes - CachedRoute (или просто время жизни кеша в секундах) для каждого пути, остальные запросы проходят мимо кеша.
+    Ответы от minimum_size байт сразу сжимаются всеми кодировками encodings и кладутся рядом с исходными,
+    поэтому попадание в кеш отдаёт уже сжатое тело по Accept-Encoding клиента.
+    ETag ответа - хеш исходного тела, на If-None-Match с тем же ETag отвечаем 304 по одному маленькому ключу.
+    С stale_expire исходный ответ ещё столько секунд хранится отдельным ключом (last known good) и отдаётся
+    с X-Cache: STALE вместо 503, пока circuit breaker не пускает запросы в Elasticsearch.
+    С popularity успешные ответы считаются обращениями к странице, по ним прогрев кеша выбирает популярные страницы.
+    """
+
+    def __init__(self, app, cache: AsyncCacheStorage, routes: dict[str, Union[int, CachedRoute]],
+                 encodings: tuple[str, ...] = (), minimum_size: int = 0, stale_expire: int = 0,
+                 popularity: Optional[PopularityTracker] = None):
+        super().__init__(app)
+        self.cache = cache
+        self.routes = {path.rstrip('/'): route if isinstance(route, CachedRoute) else CachedRoute(route)
+                       for path, route in routes.items()}
+        self.encodings = encodings
+        self.minimum_size = minimum_size
+        self.stale_expire = stale_expire
+        self.popularity = popularity
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        route = self.routes.get(request.url.path.rstrip('/'))
+        if request.method != 'GET' or route is None:
+            return await call_next(request)
+
+        key = build_cache_key(request.url.path, request.query_params, route)
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'), self.encodings)
+
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match:
+            validator = (await self._get_from_cache([validator_key(key)]))[0]
+            if validator is not None:
+                _, headers = unpack_response(validator)
+                if etag_matches(if_none_match, headers['etag']):
+                    CACHE_REQUESTS.labels('response', 'hit').inc()
+                    self._record_hit(request, key)
+                    return self._not_modified(headers, encoding, 'HIT')
+
+        # Сжатый вариант и исходный ответ одним запросом: у маленьких ответов сжатого варианта нет
+        keys = [variant_key(key, encoding), key] if encoding else [key]
+        cached = next((data for data in await self._get_from_cache(keys) if data), None)
+        if cached is not None:
+            CACHE_REQUESTS.labels('response', 'hit').inc()
+            self._record_hit(request, key)
+            body, headers = unpack_response(cached)
+            return Response(content=body, media_type='application/json', headers={**headers, 'X-Cache': 'HIT'})
+
+        CACHE_REQUESTS.labels('response', 'miss').inc()
+        response = await call_next(request)
+        if self.stale_expire and is_circuit_open_response(response.status_code, response.headers):
+            stale = (await self._get_from_cache([last_known_good_key(key)], local=False))[0]
+            if stale is not None:
+                CACHE_REQUESTS.labels('response', 'last_known_good').inc()
+                body, headers = unpack_response(stale)
+                return Response(content=body, media_type='application/json', headers={**headers, 'X-Cache': 'STALE'})
+
+        response.headers['X-Cache'] = 'MISS'
+        if response.status_code != 200:
+            return response
+
+        # Тело ответа приходит потоком, собираем его целиком, чтобы положить в кеш и отдать клиенту
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        headers = {name: response.headers[name] for name in CACHED_RESPONSE_HEADERS if name in response.headers}
+        headers['etag'] = make_etag(body)
+        compressed = bool(self.encodings) and len(body) >= self.minimum_size
+        if compressed:
+            headers['vary'] = 'Accept-Encoding'
+        entries = {key: pack_response(body, headers), validator_key(key): pack_response(b'', headers)}
+        if compressed:
+            for variant in self.encodings:
+                entries[variant_key(key, variant)] = pack_response(
+                    compress(body, variant),
+                    {**headers, 'content-encoding': variant, 'etag': encoded_etag(headers['etag'], variant)},
+                )
+        writes = [self._put_to_cache(entries, route.expire)]
+        if self.stale_expire:
+            # Последняя известная копия - отдельным пайплайном: у неё своё время жизни, а в L1 кеше она не нужна
+            writes.append(self._put_to_cache({last_known_good_key(key): entries[key]}, self.stale_expire, local=False))
+        await asyncio.gather(*writes)
+        self._record_hit(request, key)
+
+        # Ответ мог не измениться и тогда, когда его не было в кеше
+        if etag_matches(if_none_match, headers['etag']):
+            return self._not_modified(headers, encoding, 'MISS')
+
+        variant = entries.get(variant_key(key, encoding)) if encoding else None
+        if variant is not None:
+            body, headers = unpack_response(variant)
+            return Response(content=body, media_type='application/json', headers={**headers, 'X-Cache': 'MISS'})
+
+        response.headers['ETag'] = headers['etag']
+        return Response(
+            content=body,
+            status_code=response.status_code,
+            headers=dict(response.headers),
+            media_type=response.media_type,
+        )
+
+    def _record_hit(self, request: Request, key: str):
+        if self.popularity is None or request.scope.get(CACHE_WARMUP_SCOPE_KEY):
+            return
+        if any(name in request.query_params for name in UNTRACKED_QUERY_PARAMS):
+            return
+        self.popularity.hit(POPULARITY_PAGES, key)
+
+    @staticmethod
+    def _not_modified(headers: dict[str, str], encoding: str | None, cache_status: str) -> Response:
+        # ETag тот же, что был бы у полного ответа в кодировке клиента
+        etag = headers['etag']
+        if encoding and 'vary' in headers:
+            etag = encoded_etag(etag, encoding)
+        return Response(
+            status_code=304,
+            headers={
+                **{name: headers[name] for name in NOT_MODIFIED_HEADERS if name in headers},
+                'ETag': etag,
+                'X-Cache': cache_status,
+            },
+        )
+
+    async def _get_from_cache(self, keys: list[str], **kwargs) -> list[bytes | None]:
+        # Недоступность кеша не должна ломать ответ, в этом случае идём в Elasticsearch
+        try:
+            return await self.cache.get_many(keys, **kwargs)
+        except Exception:
+            logger.exception('response cache read failed for %s', keys[-1])
+            return [None] * len(keys)
+
+    async def _put_to_cache(self, entries: dict[str, bytes], expire: int, **kwargs):
+        # Исходный ответ и его сжатые варианты пишутся одним пайплайном с общим временем жизни
+        try:
+            await self.cache.set_many(entries, expire, **kwargs)
+        except Exception:
+            logger.exception('response cache write failed for %s', next(iter(entries)))
+
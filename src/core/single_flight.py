@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import uuid
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from db.abstract.cache import AsyncCacheStorage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+LEASE_KEY_PREFIX = 'lease'
+LEASE_POLL_INTERVAL_IN_SECONDS = 0.05
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные промахи кеша по одному ключу в один поход в хранилище.
+
+    Первый запрос по ключу становится лидером и запускает загрузку отдельной задачей, остальные ждут её результат.
+    Задача не принадлежит ни одному запросу: отмена лидера (клиент оборвал соединение) не отменяет загрузку
+    для остальных, а результат всё равно попадёт в кеш.
+    Если передан lease_cache, лидер дополнительно берёт в Redis короткую аренду (SET NX),
+    чтобы между процессами uvicorn кеш заполнял только один воркер.
+    """
+
+    def __init__(self, name: str, lease_cache: Optional[AsyncCacheStorage] = None, lease_expire: int = 5):
+        self.name = name
+        self.lease_cache = lease_cache
+        self.lease_expire = lease_expire
+        self._calls: dict[str, asyncio.Task] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.lease_waits = 0
+
+    async def do(
+            self,
+            key: str,
+            load: Callable[[], Awaitable[T]],
+            recheck: Optional[Callable[[], Awaitable[Optional[T]]]] = None,
+    ) -> T:
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(self._load(key, load, recheck))
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda done: self._release(key, done))
+
+        # shield - отмена одного из ожидающих запросов, в том числе лидера, не должна отменять загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, иначе asyncio ругается, если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    async def _load(
+            self,
+            key: str,
+            load: Callable[[], Awaitable[T]],
+            recheck: Optional[Callable[[], Awaitable[Optional[T]]]],
+    ) -> T:
+        if self.lease_cache is None or recheck is None or await self._acquire_lease(key):
+            return await load()
+
+        # Кеш прямо сейчас заполняет другой воркер, ждём его результат, пока не истечёт аренда
+        self.lease_waits += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lease_expire
+        while loop.time() < deadline:
+            await asyncio.sleep(LEASE_POLL_INTERVAL_IN_SECONDS)
+            result = await recheck()
+            if result is not None:
+                return result
+
+        return await load()
+
+    async def _acquire_lease(self, key: str) -> bool:
+        try:
+            return bool(await self.lease_cache.set(
+                f'{LEASE_KEY_PREFIX}:{self.name}:{key}', uuid.uuid4().hex, self.lease_expire, nx=True))
+        except Exception:
+            # Без Redis аренда невозможна, но загрузка внутри процесса всё равно объединена
+            logger.exception('single flight lease failed for %s', key)
+            return True
+
+    def stats(self) -> dict:
+        return {
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'lease_waits': self.lease_waits,
+            'in_flight': len(self._calls),
+        }
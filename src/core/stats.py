@@ -0,0 +1,12 @@
+from typing import Callable
+
+# Реестр счётчиков, которые компоненты сервиса отдают наружу через /api/v1/stats
+_providers: dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, provider: Callable[[], dict]):
+    _providers[name] = provider
+
+
+def collect_stats() -> dict:
+    return {name: provider() for name, provider in _providers.items()}
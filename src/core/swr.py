@@ -0,0 +1,70 @@
+import math
+import random
+import time
+from enum import Enum
+
+from db.abstract.cache import CacheEnvelope
+
+
+class Freshness(str, Enum):
+    FRESH = 'fresh'
+    # Значение ещё свежее, но XFetch решил обновить его заранее
+    EARLY = 'early'
+    STALE = 'stale'
+
+
+class StaleWhileRevalidate:
+    """
+    Политика кеширования stale-while-revalidate с вероятностным ранним обновлением (XFetch).
+
+    fresh_ttl - мягкий срок, после которого значение считается устаревшим,
+    stale_ttl - сколько ещё после него значение можно отдавать, пока оно обновляется в фоне.
+    Оба срока получают случайный разброс jitter, чтобы ключи не истекали одновременно.
+
+    XFetch: https://cseweb.ucsd.edu/~avattani/papers/cache_stampede.pdf
+    """
+
+    def __init__(self, fresh_ttl: int, stale_ttl: int, jitter: float = 0.1, beta: float = 1.0):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.jitter = jitter
+        self.beta = beta
+
+        self.fresh_served = 0
+        self.stale_served = 0
+        self.early_refreshes = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def wrap(self, value, delta: float) -> tuple[CacheEnvelope, int]:
+        """Возвращает конверт для кеша и жёсткое время жизни ключа в секундах."""
+        fresh_ttl = self._with_jitter(self.fresh_ttl)
+        expire = math.ceil(fresh_ttl + self._with_jitter(self.stale_ttl))
+        return CacheEnvelope(value, time.time() + fresh_ttl, delta), expire
+
+    def check(self, envelope: CacheEnvelope) -> Freshness:
+        now = time.time()
+        if now >= envelope.fresh_until:
+            self.stale_served += 1
+            return Freshness.STALE
+
+        # Чем дороже расчёт (delta) и ближе мягкий срок, тем выше шанс начать обновление заранее.
+        # 1 - random() лежит в (0, 1], логарифм от него не бывает бесконечным
+        if now - envelope.delta * self.beta * math.log(1 - random.random()) >= envelope.fresh_until:
+            self.early_refreshes += 1
+            return Freshness.EARLY
+
+        self.fresh_served += 1
+        return Freshness.FRESH
+
+    def _with_jitter(self, ttl: int) -> float:
+        return ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def stats(self) -> dict:
+        return {
+            'fresh_served': self.fresh_served,
+            'stale_served': self.stale_served,
+            'early_refreshes': self.early_refreshes,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+        }
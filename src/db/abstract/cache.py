@@ -1,11 +1,43 @@
-from typing import Optional
-from redis.asyncio import Redis
+from abc import ABC, abstractmethod
+from typing import Any, NamedTuple
 
-class AsyncCacheStorage:
+
+class CacheEnvelope(NamedTuple):
+    """
+    Значение кеша с мягким сроком жизни (stale-while-revalidate).
+
+    До fresh_until значение свежее, после - устаревшее, но его ещё можно отдать, пока ключ не удалил Redis.
+    delta - сколько секунд занял расчёт значения, по нему решаем, насколько рано начинать обновление.
+    """
+
+    value: Any
+    fresh_until: float
+    delta: float
+
+
+class AsyncCacheStorage(ABC):
+    # model - класс pydantic модели, в которую нужно декодировать значение; без него возвращаются сырые данные
     @abstractmethod
     async def get(self, key: str, **kwargs):
         pass
 
+    # value - строка, байты, pydantic модель или CacheEnvelope с моделью, модель сериализуется самим хранилищем
+    @abstractmethod
+    async def set(self, key: str, value, expire: int, **kwargs):
+        pass
+
     @abstractmethod
-    async def set(self, key: str, value: str, expire: int, **kwargs):
-        pass
\ No newline at end of file
+    async def delete(self, key: str, **kwargs):
+        pass
+
+    # Значения возвращаются в порядке ключей, отсутствующие ключи - None.
+    # local=False в get_many и set_many - только общий кеш, мимо кеша внутри процесса (редко читаемые ключи).
+    # overwrite=True в set и set_many - значение заменяет другое, уже закешированное (например, обновлённый документ),
+    # и копии в кешах внутри процессов нужно сбросить
+    @abstractmethod
+    async def get_many(self, keys: list[str], **kwargs) -> list:
+        pass
+
+    @abstractmethod
+    async def set_many(self, values: dict, expire: int, **kwargs):
+        pass
@@ -1,7 +1,74 @@
-from typing import Optional
-from redis.asyncio import Redis
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterable
+
+
+class AsyncSearchEngine(ABC):
+    """
+    Поисковый движок сервисов. Запросы и ответы - в формате Elasticsearch Query DSL.
+
+    Отсутствующий документ или истёкший point in time - elasticsearch.NotFoundError.
+    """
+
+    @abstractmethod
+    async def get(self, index: str, id: str, **kwargs):
+        pass
+
+    # Документы возвращаются в порядке ids, у отсутствующих found == False
+    @abstractmethod
+    async def mget(self, index: str, ids: list[str], **kwargs) -> list[dict]:
+        pass
+
+    # body: query (фильтры), sort, search_after, _source (включаемые поля), from/size, pit, aggs
+    @abstractmethod
+    async def search(self, index: str, body: dict, **kwargs):
+        pass
+
+    @abstractmethod
+    async def count(self, index: str, query: dict | None = None, **kwargs) -> int:
+        pass
+
+    # Point in time фиксирует состояние индекса для постраничного обхода через search_after
+    @abstractmethod
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> str:
+        pass
+
+    @abstractmethod
+    async def close_point_in_time(self, pit_id: str, **kwargs):
+        pass
 
-class AsyncSearchEngine:
     @abstractmethod
-    async def get(self, index: str, id: int, **kwargs):
-        pass
\ No newline at end of file
+    async def index(self, index: str, id: str, document: dict, **kwargs):
+        pass
+
+    # Действия в формате elasticsearch.helpers: _op_type, _index, _id, _source или doc/upsert.
+    # Возвращает число успешных действий и список ошибок
+    @abstractmethod
+    async def bulk(self, actions: Iterable[dict], **kwargs) -> tuple[int, list]:
+        pass
+
+    # Все документы запроса (hits) страницами по page_size, без ограничения index.max_result_window:
+    # каждый шаг - список hits одной страницы, последняя страница может быть пустой.
+    # source - значение _source: False, чтобы получить только ID, или список включаемых полей
+    @abstractmethod
+    def scan_pages(
+            self,
+            index: str,
+            query: dict | None = None,
+            source: bool | list[str] = True,
+            page_size: int = 1000,
+            **kwargs,
+    ) -> AsyncIterator[list[dict]]:
+        pass
+
+    # То же, что scan_pages, по одному документу
+    async def scan_stream(
+            self,
+            index: str,
+            query: dict | None = None,
+            source: bool | list[str] = True,
+            page_size: int = 1000,
+            **kwargs,
+    ) -> AsyncIterator[dict]:
+        async for page in self.scan_pages(index, query, source, page_size, **kwargs):
+            for hit in page:
+                yield hit
@@ -1,13 +1,288 @@
-from typing import Optional
+import asyncio
+import logging
+import time
+import uuid
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+from pydantic import BaseModel
 from redis.asyncio import Redis
-from db.abstract.cache import AsyncCacheStorage
+
+from core.config import get_settings
+from core.metrics import observe_backend
+from core.profiling import record_timing
+from core.stats import register_stats
+from db.abstract.cache import AsyncCacheStorage, CacheEnvelope
+from db.implementation.codecs import CacheCodec
+from db.implementation.local_cache import BoundedTTLCache
+
+logger = logging.getLogger(__name__)
+
 #redis: Optional[Redis] = None
 redis: Redis | None = None
 
+# Канал Redis, через который воркеры uvicorn сообщают друг другу об изменённых ключах
+CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'
+# Пауза перед повторной подпиской после обрыва соединения pub/sub, удваивается до максимума
+PUBSUB_RECONNECT_MIN_DELAY = 0.5
+PUBSUB_RECONNECT_MAX_DELAY = 30
+
+
+def keyspace(key: str) -> str:
+    # Метка для метрик: префикс служебных ключей (response:..., person_films:...), у документов ключ - просто ID
+    prefix, separator, _ = key.partition(':')
+    return prefix if separator else 'document'
+
+
+def is_instance_of(value, model: type[BaseModel]) -> bool:
+    if isinstance(value, CacheEnvelope):
+        value = value.value
+    return isinstance(value, model)
+
+
+async def listen_channel(
+        channel: str,
+        handle: Callable[[str], Awaitable],
+        on_reconnect: Optional[Callable[[], Awaitable]] = None,
+):
+    """
+    Слушает канал Redis pub/sub и передаёт каждое сообщение в handle, пока задачу не отменят.
+
+    При обрыве соединения подписывается заново с нарастающей паузой. Сообщения, отправленные, пока подписки не было,
+    потеряны, поэтому после повторной подписки вызывается on_reconnect, чтобы сбросить то, что могло устареть.
+    """
+    delay = PUBSUB_RECONNECT_MIN_DELAY
+    reconnecting = False
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(channel)
+            delay = PUBSUB_RECONNECT_MIN_DELAY
+            if reconnecting and on_reconnect is not None:
+                await on_reconnect()
+            reconnecting = False
+            async for message in pubsub.listen():
+                data = message['data']
+                await handle(data.decode() if isinstance(data, bytes) else data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning('pubsub %s: connection lost, resubscribing in %ss', channel, delay, exc_info=True)
+        finally:
+            await _close_pubsub(pubsub, channel)
+
+        reconnecting = True
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, PUBSUB_RECONNECT_MAX_DELAY)
+
+
+async def _close_pubsub(pubsub, channel: str):
+    # Соединение могло уже оборваться, ошибка закрытия не должна мешать переподключению или отмене
+    try:
+        await pubsub.unsubscribe(channel)
+        await pubsub.close()
+    except Exception:
+        logger.debug('pubsub %s: close failed', channel, exc_info=True)
+
+
 class MemcachedRepository(AsyncCacheStorage):
+    def __init__(self, codec: Optional[CacheCodec] = None):
+        # Кодек переводит модели в компактный бинарный формат и обратно, строки и байты хранятся как есть
+        self.codec = codec or CacheCodec()
+        self.hits = 0
+        self.misses = 0
+
     # Функция понадобится при внедрении зависимостей    
-    async def get(self, key: str, **kwargs):
-        return await redis.get(key)
+    async def get(self, key: str, model: type[BaseModel] | None = None, **kwargs):
+        data = await self._call('get', key, redis.get(key))
+        self._count(data)
+        if not data or model is None:
+            return data
+
+        return self.codec.decode(data, model)
+
+    async def set(self, key: str, value, expire: int, overwrite: bool = False, **kwargs):
+        # kwargs пробрасываются в SET, например nx=True для аренды ключа; без L1 перезапись рассылать некому
+        return await self._call('set', key, redis.set(key, self.codec.encode(value), ex=expire, **kwargs))
+
+    async def delete(self, key: str, **kwargs):
+        return await self._call('delete', key, redis.delete(key))
+
+    async def get_many(self, keys: list[str], model: type[BaseModel] | None = None, **kwargs) -> list:
+        if not keys:
+            return []
+
+        # Один MGET вместо отдельного GET на каждый ключ
+        # https://redis.io/commands/mget/
+        values = await self._call('mget', keys[0], redis.mget(keys))
+        for data in values:
+            self._count(data)
+        if model is None:
+            return values
+
+        return [self.codec.decode(data, model) if data else None for data in values]
+
+    async def set_many(self, values: dict, expire: int, **kwargs):
+        if not values:
+            return
+
+        # MSET не умеет выставлять время жизни, поэтому отправляем SET-ы одним пайплайном
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(key, self.codec.encode(value), ex=expire)
+            await self._call('pipeline_set', next(iter(values)), pipe.execute())
+
+    async def _call(self, operation: str, key: str, call: Awaitable):
+        started = time.perf_counter()
+        try:
+            result = await call
+        except Exception as error:
+            observe_backend('redis', operation, keyspace(key), started, error)
+            raise
+        finally:
+            record_timing('cache', started)
+        observe_backend('redis', operation, keyspace(key), started)
+        return result
+
+    def _count(self, data):
+        if data:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class TwoTierCacheRepository(AsyncCacheStorage):
+    """
+    Двухуровневый кеш: L1 - LRU внутри процесса с уже декодированными моделями, L2 - Redis.
+
+    Перезапись общего ключа (overwrite=True, например обновление документа) и удаление рассылают ключ остальным
+    воркерам через Redis pub/sub, и они удаляют его из своего L1. Обычное заполнение кеша после промаха не рассылается:
+    значение в Redis то же самое, а копии в L1 других воркеров живут не дольше cache_l1_ttl.
+    """
+
+    def __init__(self, remote: AsyncCacheStorage, local: BoundedTTLCache, codec: Optional[CacheCodec] = None):
+        self.remote = remote
+        self.local = local
+        # Кодирует сам двухуровневый кеш: размер записи в L1 считается по закодированным байтам,
+        # а в Redis уходят уже готовые байты
+        self.codec = codec or CacheCodec()
+        # По этому префиксу воркер узнаёт и пропускает собственные сообщения об инвалидации
+        self.instance_id = uuid.uuid4().hex
+
+    async def get(self, key: str, model: type[BaseModel] | None = None, **kwargs):
+        value = self.local.get(key)
+        if value is not None and (model is None or is_instance_of(value, model)):
+            return value
+
+        data = await self.remote.get(key)
+        if not data:
+            return None
+
+        value = data if model is None else self.codec.decode(data, model)
+        self.local.set(key, value, size=len(data))
+        return value
+
+    async def set(self, key: str, value, expire: int, overwrite: bool = False, **kwargs):
+        data = self.codec.encode(value)
+        result = await self.remote.set(key, data, expire, **kwargs)
+        # Служебные записи с опциями SET (например, аренда с nx=True) в L1 не нужны
+        if kwargs:
+            return result
+
+        self.local.set(key, value, size=len(data), ttl=expire)
+        if overwrite:
+            await self._publish_invalidation(key)
+        return result
+
+    async def delete(self, key: str, **kwargs):
+        self.local.delete(key)
+        result = await self.remote.delete(key)
+        await self._publish_invalidation(key)
+        return result
+
+    async def get_many(self, keys: list[str], model: type[BaseModel] | None = None, **kwargs) -> list:
+        if kwargs.get('local') is False:
+            return await self.remote.get_many(keys, model=model)
+
+        values = [self.local.get(key) for key in keys]
+        if model is not None:
+            values = [value if is_instance_of(value, model) else None for value in values]
+
+        # В Redis идём одним MGET только за ключами, которых нет в L1
+        missing = [index for index, value in enumerate(values) if value is None]
+        if not missing:
+            return values
+
+        remote_values = await self.remote.get_many([keys[index] for index in missing])
+        for index, data in zip(missing, remote_values):
+            if not data:
+                continue
+            value = data if model is None else self.codec.decode(data, model)
+            self.local.set(keys[index], value, size=len(data))
+            values[index] = value
+
+        return values
+
+    async def set_many(self, values: dict, expire: int, overwrite: bool = False, **kwargs):
+        if not values:
+            return
+        # Ключи только для Redis: в L1 их не кладём, поэтому и рассылать инвалидацию не нужно
+        if kwargs.get('local') is False:
+            return await self.remote.set_many(values, expire)
+
+        serialized = {key: self.codec.encode(value) for key, value in values.items()}
+        await self.remote.set_many(serialized, expire)
+
+        for key, value in values.items():
+            self.local.set(key, value, size=len(serialized[key]), ttl=expire)
+        if overwrite:
+            await self._publish_invalidation(*values)
+
+    async def _publish_invalidation(self, *keys: str):
+        # Несколько ключей отправляем одним сообщением, по одному ключу на строку
+        message = '\n'.join(keys)
+        try:
+            await redis.publish(CACHE_INVALIDATION_CHANNEL, f'{self.instance_id}:{message}')
+        except Exception:
+            logger.exception('cache invalidation publish failed for %s', message)
+
+    async def listen_invalidations(self):
+        """Слушает канал инвалидации и удаляет из L1 ключи, изменённые другими воркерами."""
+        # Пока подписки не было, инвалидации могли потеряться, поэтому после переподключения L1 сбрасывается целиком
+        await listen_channel(CACHE_INVALIDATION_CHANNEL, self._invalidate, on_reconnect=self._clear_local)
+
+    async def _invalidate(self, data: str):
+        instance_id, _, keys = data.partition(':')
+        if instance_id == self.instance_id:
+            return
+        for key in keys.split('\n'):
+            self.local.delete(key)
+
+    async def _clear_local(self):
+        self.local.clear()
+
+
+# Один репозиторий на процесс, чтобы lru_cache в get_*_service не создавал сервис на каждый запрос
+@lru_cache()
+def get_cache() -> AsyncCacheStorage:
+    settings = get_settings()
+    codec = CacheCodec(
+        serializer=settings.cache_serializer,
+        compression=settings.cache_compression,
+        compression_threshold=settings.cache_compression_threshold,
+    )
+    remote = MemcachedRepository(codec)
+    register_stats('cache.redis', remote.stats)
+    if not settings.cache_l1_enabled:
+        return remote
 
-    async def set(self, key: str, value: str, expire: int, **kwargs):
-        await redis.set(key, value, expire)
\ No newline at end of file
+    local = BoundedTTLCache(
+        max_entries=settings.cache_l1_max_entries,
+        max_bytes=settings.cache_l1_max_bytes,
+        ttl=settings.cache_l1_ttl,
+    )
+    register_stats('cache.l1', local.stats)
+    return TwoTierCacheRepository(remote, local, codec)
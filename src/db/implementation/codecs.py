@@ -0,0 +1,150 @@
+import datetime
+import struct
+import uuid
+
+import orjson
+from pydantic import BaseModel
+
+from core.profiling import profiled
+from db.abstract.cache import CacheEnvelope
+
+# msgpack, lz4 и zstandard нужны только для соответствующих форматов
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Первый байт значения в кеше:
+#   биты 0-3 - сериализатор, биты 4-5 - сжатие, бит 7 - дальше идёт заголовок конверта stale-while-revalidate.
+# Читаются все форматы сразу, поэтому формат записи можно менять без сброса кеша
+SERIALIZERS = {'orjson': 1, 'msgpack': 2}
+COMPRESSIONS = {'none': 0, 'lz4': 1, 'zstd': 2}
+ENVELOPE_FLAG = 0x80
+SERIALIZER_MASK = 0x0F
+COMPRESSION_SHIFT = 4
+COMPRESSION_MASK = 0x30
+
+# fresh_until и delta конверта
+ENVELOPE_HEADER = struct.Struct('>dd')
+
+# Старый формат: json модели, конверт - сигнатура SWR1 и тот же заголовок перед json
+LEGACY_ENVELOPE_SIGNATURE = b'SWR1'
+
+
+def _msgpack_default(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'cannot serialize {type(value)!r}')
+
+
+def _serialize(serializer: int, data: dict) -> bytes:
+    if serializer == SERIALIZERS['orjson']:
+        return orjson.dumps(data)
+    return msgpack.packb(data, default=_msgpack_default)
+
+
+def _deserialize(serializer: int, payload: bytes) -> dict:
+    if serializer == SERIALIZERS['orjson']:
+        return orjson.loads(payload)
+    if serializer == SERIALIZERS['msgpack']:
+        return msgpack.unpackb(payload)
+    raise ValueError(f'unknown cache serializer {serializer}')
+
+
+def _compress(compression: int, payload: bytes) -> bytes:
+    if compression == COMPRESSIONS['lz4']:
+        return lz4.frame.compress(payload)
+    return zstandard.ZstdCompressor().compress(payload)
+
+
+def _decompress(compression: int, payload: bytes) -> bytes:
+    if compression == COMPRESSIONS['none']:
+        return payload
+    if compression == COMPRESSIONS['lz4']:
+        return lz4.frame.decompress(payload)
+    if compression == COMPRESSIONS['zstd']:
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f'unknown cache compression {compression}')
+
+
+class CacheCodec:
+    """
+    Кодирует модели и конверты кеша в компактный бинарный формат с байтом-заголовком.
+
+    Значения, которые не являются моделями (строки, байты), хранятся как есть.
+    Сжатие применяется только к данным не меньше compression_threshold байт.
+    """
+
+    def __init__(self, serializer: str = 'orjson', compression: str = 'none', compression_threshold: int = 1024):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f'unknown cache serializer {serializer}')
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'unknown cache compression {compression}')
+        if serializer == 'msgpack' and msgpack is None:
+            raise ImportError('msgpack is required for the msgpack cache serializer')
+        if compression == 'lz4' and lz4 is None:
+            raise ImportError('lz4 is required for lz4 cache compression')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstandard is required for zstd cache compression')
+
+        self.serializer = SERIALIZERS[serializer]
+        self.compression = COMPRESSIONS[compression]
+        self.compression_threshold = compression_threshold
+
+    def encode(self, value) -> str | bytes:
+        envelope = None
+        if isinstance(value, CacheEnvelope):
+            envelope = value
+            value = value.value
+        if not isinstance(value, BaseModel):
+            return value
+
+        payload = _serialize(self.serializer, value.dict())
+        header = self.serializer
+        if self.compression and len(payload) >= self.compression_threshold:
+            payload = _compress(self.compression, payload)
+            header |= self.compression << COMPRESSION_SHIFT
+
+        if envelope is None:
+            return bytes([header]) + payload
+
+        return bytes([header | ENVELOPE_FLAG]) + ENVELOPE_HEADER.pack(envelope.fresh_until, envelope.delta) + payload
+
+    @profiled('validation')
+    def decode(self, data: str | bytes, model: type[BaseModel]):
+        if isinstance(data, str):
+            data = data.encode()
+
+        # Значения, записанные до появления кодеков: json или конверт SWR1 с json
+        if data.startswith(b'{'):
+            return model.parse_raw(data)
+        if data.startswith(LEGACY_ENVELOPE_SIGNATURE):
+            offset = len(LEGACY_ENVELOPE_SIGNATURE)
+            fresh_until, delta = ENVELOPE_HEADER.unpack_from(data, offset)
+            return CacheEnvelope(model.parse_raw(data[offset + ENVELOPE_HEADER.size:]), fresh_until, delta)
+
+        header = data[0]
+        offset = 1
+        envelope = None
+        if header & ENVELOPE_FLAG:
+            envelope = ENVELOPE_HEADER.unpack_from(data, offset)
+            offset += ENVELOPE_HEADER.size
+
+        payload = _decompress((header & COMPRESSION_MASK) >> COMPRESSION_SHIFT, data[offset:])
+        value = model.parse_obj(_deserialize(header & SERIALIZER_MASK, payload))
+        if envelope is None:
+            return value
+
+        return CacheEnvelope(value, *envelope)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+import uuid
+from functools import lru_cache
+from typing import Optional
+
+from core.bloom import BloomFilter
+from core.config import get_settings
+from core.stats import register_stats
+from db.abstract.search_engine import AsyncSearchEngine
+from db.implementation import cache
+from db.implementation.search_engine import get_search_engine
+
+logger = logging.getLogger(__name__)
+
+EXISTENCE_KEY_PREFIX = 'bloom'
+# Размер страницы при обходе ID индекса
+EXISTENCE_SCAN_PAGE_SIZE = 5000
+# Фильтр строим с запасом на рост индекса, чтобы вероятность ложного срабатывания не росла до перестроения
+EXISTENCE_CAPACITY_FACTOR = 2
+EXISTENCE_MIN_CAPACITY = 1000
+# ID, добавленный незадолго до начала обхода, мог ещё не попасть в поиск (refresh_interval индекса),
+# поэтому из списка недавно добавленных он уходит только через эту минуту после начала обхода
+EXISTENCE_RECENT_GRACE = 60
+
+# Сообщения канала (после ID воркера-отправителя): reload - в Redis новый снимок фильтра, add:<id> - в индекс добавлен документ
+RELOAD_MESSAGE = 'reload'
+ADD_MESSAGE_PREFIX = 'add:'
+
+
+class ExistenceIndex:
+    """
+    Индекс существования ID в индексе Elasticsearch на основе фильтра Блума.
+
+    Фильтр строит один воркер (под арендой в Redis) обходом всех ID индекса и сохраняет снимок в Redis,
+    остальные воркеры загружают снимок. Каждый воркер держит копию фильтра в памяти, поэтому проверка
+    не требует походов в сеть. Пока фильтр не готов, он ничего не отсекает.
+    """
+
+    def __init__(self, index: str, search_engine: AsyncSearchEngine, false_positive_rate: float, rebuild_interval: int):
+        self.index = index
+        self.search_engine = search_engine
+        self.false_positive_rate = false_positive_rate
+        self.rebuild_interval = rebuild_interval
+        self.channel = f'{EXISTENCE_KEY_PREFIX}:{index}'
+        self.snapshot_key = f'{EXISTENCE_KEY_PREFIX}:{index}:snapshot'
+        # Время начала обхода, по которому построен снимок (unix time)
+        self.snapshot_started_key = f'{EXISTENCE_KEY_PREFIX}:{index}:snapshot_started'
+        self.lease_key = f'{EXISTENCE_KEY_PREFIX}:{index}:lease'
+        # По этому префиксу воркер узнаёт и пропускает собственные сообщения
+        self.instance_id = uuid.uuid4().hex
+
+        self._filter: Optional[BloomFilter] = None
+        # ID, добавленные во время перестроения, попадают и в новый фильтр
+        self._pending: Optional[set[str]] = None
+        # Недавно добавленные ID и время их добавления (unix time). Снимок мог быть построен раньше, чем они попали
+        # в индекс, поэтому после загрузки снимка добавляем их повторно, пока их не учтёт следующий обход
+        self._recent: dict[str, float] = {}
+
+        self.short_circuits = 0
+        self.rebuild_duration = 0.0
+        self.rebuilds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def definitely_absent(self, doc_id: str) -> bool:
+        if self._filter is None or doc_id in self._filter:
+            return False
+
+        self.short_circuits += 1
+        return True
+
+    async def add(self, doc_id: str):
+        self._add_local(doc_id)
+        try:
+            await self._publish(f'{ADD_MESSAGE_PREFIX}{doc_id}')
+        except Exception:
+            logger.exception('existence index %s: add broadcast failed for %s', self.index, doc_id)
+
+    def _add_local(self, doc_id: str):
+        if self._filter is not None:
+            self._filter.add(doc_id)
+        if self._pending is not None:
+            self._pending.add(doc_id)
+        self._recent[doc_id] = time.time()
+
+    async def _publish(self, message: str):
+        await cache.redis.publish(self.channel, f'{self.instance_id}:{message}')
+
+    async def run(self):
+        """Загружает или строит фильтр, затем слушает обновления и периодически перестраивает его."""
+        listener = asyncio.create_task(cache.listen_channel(self.channel, self._handle, on_reconnect=self._reset))
+        try:
+            try:
+                if not await self._load_snapshot():
+                    await self._rebuild_under_lease()
+            except Exception:
+                # Без фильтра сервис работает как раньше, попробуем снова при следующем перестроении
+                logger.exception('existence index %s: initial load failed', self.index)
+
+            while True:
+                await asyncio.sleep(self.rebuild_interval)
+                await self._rebuild_under_lease()
+        finally:
+            listener.cancel()
+
+    async def _rebuild_under_lease(self):
+        # Перестраивает только один воркер, остальные получат сообщение reload
+        lease = await cache.redis.set(self.lease_key, '1', ex=max(self.rebuild_interval // 2, 1), nx=True)
+        if not lease:
+            return
+
+        try:
+            await self.rebuild()
+        except Exception:
+            logger.exception('existence index %s: rebuild failed', self.index)
+
+    async def rebuild(self):
+        started = time.monotonic()
+        scan_started = time.time()
+        self._pending = set()
+        try:
+            total = await self._count()
+            bloom = BloomFilter.for_capacity(
+                max(total * EXISTENCE_CAPACITY_FACTOR, EXISTENCE_MIN_CAPACITY), self.false_positive_rate)
+            async for doc_id in self._scan_ids():
+                bloom.add(doc_id)
+            for doc_id in [*self._pending, *self._recent]:
+                bloom.add(doc_id)
+        finally:
+            self._pending = None
+
+        self._filter = bloom
+        self._trim_recent(scan_started)
+        self.rebuild_duration = time.monotonic() - started
+        self.rebuilds += 1
+        logger.info('existence index %s: %s ids in %.2fs', self.index, bloom.count, self.rebuild_duration)
+
+        async with cache.redis.pipeline(transaction=False) as pipe:
+            pipe.set(self.snapshot_key, bloom.to_bytes(), ex=self.rebuild_interval * 2)
+            pipe.set(self.snapshot_started_key, str(scan_started), ex=self.rebuild_interval * 2)
+            await pipe.execute()
+        await self._publish(RELOAD_MESSAGE)
+
+    async def _load_snapshot(self) -> bool:
+        data, scan_started = await cache.redis.mget([self.snapshot_key, self.snapshot_started_key])
+        if not data:
+            return False
+
+        bloom = BloomFilter.from_bytes(data)
+        for doc_id in self._recent:
+            bloom.add(doc_id)
+        if scan_started:
+            self._trim_recent(float(scan_started))
+
+        self._filter = bloom
+        return True
+
+    def _trim_recent(self, scan_started: float):
+        # ID, добавленные задолго до начала обхода, уже есть в построенном им фильтре
+        horizon = scan_started - EXISTENCE_RECENT_GRACE
+        self._recent = {doc_id: added for doc_id, added in self._recent.items() if added >= horizon}
+
+    async def _count(self) -> int:
+        return await self.search_engine.count(index=self.index)
+
+    async def _scan_ids(self):
+        # Документы не загружаем - нужны только ID
+        async for hit in self.search_engine.scan_stream(
+                index=self.index, source=False, page_size=EXISTENCE_SCAN_PAGE_SIZE):
+            yield hit['_id']
+
+    async def _handle(self, data: str):
+        instance_id, _, data = data.partition(':')
+        if instance_id == self.instance_id:
+            return
+        if data == RELOAD_MESSAGE:
+            await self._load_snapshot()
+        elif data.startswith(ADD_MESSAGE_PREFIX):
+            self._add_local(data[len(ADD_MESSAGE_PREFIX):])
+
+    async def _reset(self):
+        # Пока подписки не было, сообщения add: могли потеряться, и фильтр ответил бы по новым ID 404.
+        # Перестаём отсекать до следующего перестроения: его снимок придёт сообщением reload
+        if self._filter is not None:
+            logger.warning('existence index %s: disabled until the next rebuild after a pub/sub reconnect', self.index)
+        self._filter = None
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            'ready': bloom is not None,
+            'items': bloom.count if bloom else 0,
+            'size_in_bytes': len(bloom.bits) if bloom else 0,
+            'hash_count': bloom.hash_count if bloom else 0,
+            'false_positive_rate': bloom.false_positive_rate if bloom else None,
+            'rebuild_duration': self.rebuild_duration,
+            'rebuilds': self.rebuilds,
+            'short_circuits': self.short_circuits,
+            'recent': len(self._recent),
+        }
+
+
+# Один индекс существования на индекс Elasticsearch в процессе; None - проверка выключена в настройках
+# или индекс не входит в bloom_indexes
+@lru_cache()
+def get_existence_index(index: str) -> Optional[ExistenceIndex]:
+    settings = get_settings()
+    if not settings.bloom_enabled or index not in settings.bloom_indexes:
+        return None
+
+    existence = ExistenceIndex(
+        index,
+        get_search_engine(),
+        false_positive_rate=settings.bloom_false_positive_rate,
+        rebuild_interval=settings.bloom_rebuild_interval,
+    )
+    register_stats(f'bloom.{index}', existence.stats)
+    return existence
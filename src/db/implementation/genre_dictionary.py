@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
+
+from core.config import get_settings
+from core.http_cache import model_etag
+from core.stats import register_stats
+from db.abstract.search_engine import AsyncSearchEngine
+from db.implementation.search_engine import get_search_engine
+from models.genre import Genre
+
+logger = logging.getLogger(__name__)
+
+GENRES_INDEX = 'genres'
+# Elasticsearch по умолчанию не отдаёт больше 10 000 документов за один запрос (index.max_result_window)
+GENRES_MAX_RESULT_WINDOW = 10_000
+
+
+def normalize_genre_name(name: str) -> str:
+    return ' '.join(name.split()).casefold()
+
+
+class GenreSnapshot(NamedTuple):
+    """Неизменяемый снимок всех жанров. Обновление подменяет снимок целиком, поэтому читатели не видят половину данных."""
+
+    genres: tuple[Genre, ...]
+    by_id: Mapping[str, Genre]
+    by_name: Mapping[str, Genre]
+    # ETag жанров по ID считаются один раз на снимок, а не на каждый ответ
+    etags: Mapping[str, str]
+    # Число документов и наибольший modified индекса на момент загрузки
+    version: tuple
+
+    @classmethod
+    def build(cls, genres: list[Genre], version: tuple) -> 'GenreSnapshot':
+        genres = tuple(sorted(genres, key=lambda genre: genre.name))
+        return cls(
+            genres=genres,
+            by_id=MappingProxyType({str(genre.id): genre for genre in genres}),
+            by_name=MappingProxyType({normalize_genre_name(genre.name): genre for genre in genres}),
+            etags=MappingProxyType({str(genre.id): model_etag(genre) for genre in genres}),
+            version=version,
+        )
+
+
+class GenreDictionary:
+    """
+    Все жанры в памяти процесса: поиск по ID и названию без походов в Redis и Elasticsearch.
+
+    Снимок загружается при старте и периодически перечитывается, если у индекса изменились
+    число документов или наибольшая дата изменения. Пока снимка нет, сервис жанров ходит в Elasticsearch.
+    """
+
+    def __init__(self, search_engine: AsyncSearchEngine, refresh_interval: int):
+        self.search_engine = search_engine
+        self.refresh_interval = refresh_interval
+        self.snapshot: Optional[GenreSnapshot] = None
+
+        self.loads = 0
+        self.skipped_refreshes = 0
+        self.load_duration = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.snapshot is not None
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Перечитывает жанры, если индекс изменился. Возвращает True, если снимок заменён."""
+        version = await self._version()
+        if not force and self.snapshot is not None and self.snapshot.version == version:
+            self.skipped_refreshes += 1
+            return False
+
+        started = time.monotonic()
+        response = await self.search_engine.search(
+            index=GENRES_INDEX,
+            body={'query': {'match_all': {}}, 'size': GENRES_MAX_RESULT_WINDOW},
+        )
+        genres = [Genre(**hit['_source']) for hit in response['hits']['hits']]
+
+        self.snapshot = GenreSnapshot.build(genres, version)
+        self.load_duration = time.monotonic() - started
+        self.loads += 1
+        logger.info('genre dictionary: %s genres in %.3fs', len(genres), self.load_duration)
+        return True
+
+    def add(self, genre: Genre):
+        # Новый документ ещё может быть не виден поиску, поэтому добавляем его в снимок сами.
+        # Версия остаётся прежней, и следующее обновление перечитает индекс
+        snapshot = self.snapshot
+        if snapshot is None:
+            return
+
+        genres = [known for known in snapshot.genres if known.id != genre.id]
+        self.snapshot = GenreSnapshot.build(genres + [genre], snapshot.version)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # Оставляем прежний снимок, попробуем при следующем обновлении
+                logger.exception('genre dictionary refresh failed')
+
+    async def _version(self) -> tuple:
+        response = await self.search_engine.search(
+            index=GENRES_INDEX,
+            body={
+                'size': 0,
+                'track_total_hits': True,
+                'query': {'match_all': {}},
+                'aggs': {'last_modified': {'max': {'field': 'modified'}}},
+            },
+        )
+        return response['hits']['total']['value'], response['aggregations']['last_modified']['value']
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            'ready': snapshot is not None,
+            'genres': len(snapshot.genres) if snapshot else 0,
+            'loads': self.loads,
+            'skipped_refreshes': self.skipped_refreshes,
+            'load_duration': self.load_duration,
+        }
+
+
+@lru_cache()
+def get_genre_dictionary() -> GenreDictionary:
+    dictionary = GenreDictionary(get_search_engine(), get_settings().genre_dictionary_refresh_interval)
+    register_stats('genres.dictionary', dictionary.stats)
+    return dictionary
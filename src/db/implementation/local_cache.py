@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional
+
+from core.metrics import CACHE_EVICTIONS
+
+
+class _Entry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+
+
+class BoundedTTLCache:
+    """
+    LRU-кеш внутри процесса с ограничением по числу записей, по суммарному размеру и по времени жизни.
+
+    Размер записи передаёт вызывающий код (обычно это длина сериализованного значения),
+    сам кеш значения не сериализует и хранит объекты как есть.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            CACHE_EVICTIONS.labels('expired').inc()
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None):
+        # Значение больше всего кеша не кладём, иначе оно вытеснит всё остальное
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._entries[key] = _Entry(value, size, time.monotonic() + ttl)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+            CACHE_EVICTIONS.labels('capacity').inc()
+
+    def delete(self, key: str) -> bool:
+        if key not in self._entries:
+            return False
+
+        self._remove(key)
+        self.invalidations += 1
+        CACHE_EVICTIONS.labels('invalidated').inc()
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
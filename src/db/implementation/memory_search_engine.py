@@ -0,0 +1,539 @@
+import asyncio
+import datetime
+import itertools
+import math
+import re
+import time
+import uuid
+from collections import defaultdict
+from fnmatch import fnmatch
+from functools import cmp_to_key
+from typing import AsyncIterator, Iterable, Iterator
+
+import orjson
+from elasticsearch import NotFoundError, RequestError
+
+from db.abstract.search_engine import AsyncSearchEngine
+
+TOKEN_RE = re.compile(r'\w+')
+# Подполя multi-field (title.raw) ищутся по значению исходного поля без анализа
+KEYWORD_SUFFIXES = ('.raw', '.keyword')
+DEFAULT_PAGE_SIZE = 10
+# Служебные ключи действия bulk, остальные ключи - сам документ
+BULK_META_FIELDS = {'_op_type', '_index', '_id', '_source', 'doc', 'upsert', 'doc_as_upsert'}
+# Больше открытых point in time не держим, как search.max_open_scroll_context в Elasticsearch
+MAX_OPEN_PITS = 500
+KEEP_ALIVE_RE = re.compile(r'(\d+)(ms|s|m|h|d)')
+KEEP_ALIVE_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def tokenize(text) -> list[str]:
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def _flatten(doc: dict, prefix: str = '') -> Iterator[tuple[str, object]]:
+    # Вложенные объекты и списки объектов раскладываются в пути через точку, как их видит запрос nested
+    for key, value in doc.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{path}.')
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    yield from _flatten(item, f'{path}.')
+                else:
+                    yield path, item
+        elif value is not None:
+            yield path, value
+
+
+def _field(name: str) -> str:
+    for suffix in KEYWORD_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _single(params: dict) -> tuple[str, object]:
+    field, value = next((key, value) for key, value in params.items() if key != 'boost')
+    return field, value
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _project(source: dict, includes: list[str], prefix: str = '') -> dict:
+    result = {}
+    for key, value in source.items():
+        path = f'{prefix}{key}'
+        if any(fnmatch(path, include) for include in includes):
+            result[key] = value
+        elif any(include.startswith(f'{path}.') for include in includes):
+            if isinstance(value, dict):
+                result[key] = _project(value, includes, f'{path}.')
+            elif isinstance(value, list):
+                result[key] = [_project(item, includes, f'{path}.') if isinstance(item, dict) else item
+                               for item in value]
+    return result
+
+
+def _keep_alive_seconds(keep_alive: str) -> float:
+    match = KEEP_ALIVE_RE.fullmatch(keep_alive)
+    if match is None:
+        raise _bad_request(f'failed to parse keep_alive [{keep_alive}]')
+    return int(match[1]) * KEEP_ALIVE_UNITS[match[2]]
+
+
+def _bad_request(what: str) -> RequestError:
+    return RequestError(400, 'illegal_argument_exception', {'error': {'reason': what}})
+
+
+def _not_found(what: str) -> NotFoundError:
+    return NotFoundError(404, 'not_found', {'error': what})
+
+
+class _MemoryIndex:
+    """Документы индекса и инвертированные индексы: точные значения полей и токены строковых полей."""
+
+    def __init__(self):
+        self.docs: dict[str, dict] = {}
+        # Порядковый номер вставки - аналог _shard_doc
+        self.seq: dict[str, int] = {}
+        self.values: dict[str, dict[str, list]] = {}
+        self.keywords: dict[str, dict[object, set[str]]] = defaultdict(lambda: defaultdict(set))
+        self.terms: dict[str, dict[str, set[str]]] = defaultdict(lambda: defaultdict(set))
+        self._counter = itertools.count()
+
+    def put(self, doc_id: str, source: dict):
+        self.remove(doc_id)
+        values = defaultdict(list)
+        for path, value in _flatten(source):
+            values[path].append(value)
+            self.keywords[path][value].add(doc_id)
+            if isinstance(value, str):
+                for token in tokenize(value):
+                    self.terms[path][token].add(doc_id)
+
+        self.docs[doc_id] = source
+        self.seq[doc_id] = next(self._counter)
+        self.values[doc_id] = dict(values)
+
+    def remove(self, doc_id: str) -> bool:
+        values = self.values.pop(doc_id, None)
+        if values is None:
+            return False
+
+        del self.docs[doc_id]
+        del self.seq[doc_id]
+        for path, items in values.items():
+            for value in items:
+                self.keywords[path][value].discard(doc_id)
+                if isinstance(value, str):
+                    for token in tokenize(value):
+                        self.terms[path][token].discard(doc_id)
+        return True
+
+    def keyword_ids(self, field: str, value) -> set[str]:
+        postings = self.keywords.get(_field(field))
+        return postings.get(value, set()) if postings else set()
+
+    def text_scores(self, field: str, text, boost: float = 1.0) -> dict[str, float]:
+        if field != _field(field):
+            return dict.fromkeys(self.keyword_ids(field, text), boost)
+
+        postings = self.terms.get(field, {})
+        scores = defaultdict(float)
+        for token in tokenize(text):
+            for doc_id in postings.get(token, ()):
+                scores[doc_id] += boost
+        return scores
+
+    def first_value(self, doc_id: str, field: str, reverse: bool = False):
+        # Для полей-списков Elasticsearch сортирует по минимуму (asc) или максимуму (desc)
+        values = self.values[doc_id].get(_field(field))
+        if not values:
+            return None
+        return max(values) if reverse else min(values)
+
+
+# Начало корзины date_histogram для calendar_interval
+MIDNIGHT = {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0}
+CALENDAR_INTERVALS = {
+    **dict.fromkeys(('year', '1y'), lambda value: value.replace(month=1, day=1, **MIDNIGHT)),
+    **dict.fromkeys(('month', '1M'), lambda value: value.replace(day=1, **MIDNIGHT)),
+    **dict.fromkeys(('day', '1d'), lambda value: value.replace(**MIDNIGHT)),
+}
+
+
+def _parse_date(value: str) -> datetime.datetime:
+    # Даты хранятся строками ISO 8601, без зоны - UTC, как их читает Elasticsearch
+    parsed = datetime.datetime.fromisoformat(value)
+    return parsed.astimezone(datetime.timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def _bucket_counts(memory_index: _MemoryIndex, scores: dict, field: str, bucket) -> dict:
+    counts = defaultdict(int)
+    for doc_id in scores:
+        for key in {bucket(value) for value in memory_index.values[doc_id].get(_field(field), ())}:
+            counts[key] += 1
+    return counts
+
+
+def _histogram_buckets(counts: dict, params: dict, describe) -> list[dict]:
+    minimum = params.get('min_doc_count', 0)
+    return [{**describe(key), 'doc_count': count} for key, count in sorted(counts.items()) if count >= minimum]
+
+
+class InMemorySearchEngine(AsyncSearchEngine):
+    """
+    Поисковый движок в памяти процесса для локальных запусков API и нагрузочных тестов без Elasticsearch.
+
+    Поддерживает подмножество Query DSL, которым пользуются сервисы: match_all, ids, term, terms, match,
+    multi_match (без fuzziness), range, exists, nested, bool; сортировку, search_after, point in time,
+    _source includes и агрегации min, max, value_count, terms, histogram, date_histogram (calendar_interval).
+    """
+
+    def __init__(self):
+        self.indexes: dict[str, _MemoryIndex] = {}
+        # ID point in time -> индекс и момент истечения по keep_alive; каждый запрос с point in time его продлевает
+        self._pits: dict[str, tuple[str, float]] = {}
+
+    def load(self, index: str, documents: Iterable[dict], id_field: str = 'id'):
+        memory_index = self.indexes.setdefault(index, _MemoryIndex())
+        for document in documents:
+            memory_index.put(str(document[id_field]), orjson.loads(orjson.dumps(document)))
+
+    def load_fixtures(self, path: str):
+        # Файл: {"movies": [...], "genres": [...], "persons": [...]}
+        with open(path, 'rb') as file:
+            fixtures = orjson.loads(file.read())
+        for index, documents in fixtures.items():
+            self.load(index, documents)
+
+    def _index(self, index: str) -> _MemoryIndex:
+        memory_index = self.indexes.get(index)
+        if memory_index is None:
+            raise _not_found(f'no such index [{index}]')
+        return memory_index
+
+    async def get(self, index: str, id: str, **kwargs):
+        memory_index = self._index(index)
+        if id not in memory_index.docs:
+            raise _not_found(f'document [{id}] is missing')
+        return {'_index': index, '_id': id, 'found': True, '_source': memory_index.docs[id]}
+
+    async def mget(self, index: str, ids: list[str], **kwargs) -> list[dict]:
+        memory_index = self._index(index)
+        return [
+            {'_index': index, '_id': doc_id, 'found': True, '_source': memory_index.docs[doc_id]}
+            if doc_id in memory_index.docs else {'_index': index, '_id': doc_id, 'found': False}
+            for doc_id in ids
+        ]
+
+    async def search(self, index: str, body: dict, **kwargs):
+        pit = body.get('pit')
+        if pit:
+            index = self._use_pit(pit['id'], pit.get('keep_alive'))
+        memory_index = self._index(index)
+
+        scores = self._match(memory_index, body.get('query') or {'match_all': {}})
+        sort = self._sort_clauses(body.get('sort'))
+        if pit and sort and all(field != '_shard_doc' for field, _ in sort):
+            # Elasticsearch неявно добавляет _shard_doc в сортировку запросов с point in time
+            sort.append(('_shard_doc', 'asc'))
+        ordered = sort or [('_score', 'desc'), ('_shard_doc', 'asc')]
+
+        keys = {doc_id: self._sort_key(memory_index, doc_id, scores[doc_id], ordered) for doc_id in scores}
+        compare = cmp_to_key(lambda left, right: self._compare(left, right, ordered))
+        doc_ids = sorted(scores, key=lambda doc_id: compare(keys[doc_id]))
+        if body.get('search_after') is not None:
+            search_after = list(body['search_after'])
+            if len(search_after) != len(ordered):
+                raise _bad_request(f'search_after has {len(search_after)} value(s) but sort has {len(ordered)}')
+            after = compare(search_after)
+            try:
+                doc_ids = [doc_id for doc_id in doc_ids if compare(keys[doc_id]) > after]
+            except TypeError:
+                raise _bad_request('search_after values do not match the sort field types')
+
+        start = body.get('from', 0)
+        page = doc_ids[start:start + body.get('size', DEFAULT_PAGE_SIZE)]
+
+        hits = []
+        for doc_id in page:
+            hit = {'_index': index, '_id': doc_id, '_score': scores[doc_id]}
+            source = self._source(memory_index.docs[doc_id], body.get('_source', True))
+            if source is not None:
+                hit['_source'] = source
+            if sort:
+                hit['sort'] = keys[doc_id]
+            hits.append(hit)
+
+        response = {'hits': {'total': {'value': len(scores), 'relation': 'eq'}, 'hits': hits}}
+        if body.get('aggs') or body.get('aggregations'):
+            response['aggregations'] = self._aggregate(memory_index, scores, body.get('aggs') or body['aggregations'])
+        if pit:
+            response['pit_id'] = pit['id']
+        return response
+
+    async def count(self, index: str, query: dict | None = None, **kwargs) -> int:
+        return len(self._match(self._index(index), query or {'match_all': {}}))
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> str:
+        # Снимок не фиксируется: point in time читает живой индекс, но ведёт себя как в Elasticsearch
+        self._index(index)
+        self._expire_pits()
+        if len(self._pits) >= MAX_OPEN_PITS:
+            # Брошенные клиентами point in time не копятся: вытесняем тот, что открыт раньше всех
+            del self._pits[next(iter(self._pits))]
+        pit_id = uuid.uuid4().hex
+        self._pits[pit_id] = (index, time.monotonic() + _keep_alive_seconds(keep_alive))
+        return pit_id
+
+    async def close_point_in_time(self, pit_id: str, **kwargs):
+        self._expire_pits()
+        if self._pits.pop(pit_id, None) is None:
+            raise _not_found('point in time is missing or expired')
+        return {'succeeded': True, 'num_freed': 1}
+
+    def _use_pit(self, pit_id: str, keep_alive: str | None) -> str:
+        self._expire_pits()
+        if pit_id not in self._pits:
+            raise _not_found('point in time is missing or expired')
+        index, _ = self._pits[pit_id]
+        if keep_alive:
+            self._pits[pit_id] = (index, time.monotonic() + _keep_alive_seconds(keep_alive))
+        return index
+
+    def _expire_pits(self):
+        now = time.monotonic()
+        for pit_id in [pit_id for pit_id, (_, expires_at) in self._pits.items() if expires_at <= now]:
+            del self._pits[pit_id]
+
+    async def index(self, index: str, id: str, document: dict, **kwargs):
+        memory_index = self.indexes.setdefault(index, _MemoryIndex())
+        memory_index.put(id, orjson.loads(orjson.dumps(document)))
+        return {'_index': index, '_id': id, 'result': 'created'}
+
+    async def bulk(self, actions: Iterable[dict], **kwargs) -> tuple[int, list]:
+        success, errors = 0, []
+        for action in actions:
+            op_type = action.get('_op_type', 'index')
+            memory_index = self.indexes.setdefault(action['_index'], _MemoryIndex())
+            doc_id = str(action['_id'])
+            source = action.get('_source') or {key: value for key, value in action.items()
+                                               if key not in BULK_META_FIELDS}
+            current = memory_index.docs.get(doc_id)
+
+            if op_type == 'delete':
+                if not memory_index.remove(doc_id):
+                    errors.append({'delete': {'_id': doc_id, 'status': 404}})
+                    continue
+            elif op_type == 'create' and current is not None:
+                errors.append({'create': {'_id': doc_id, 'status': 409}})
+                continue
+            elif op_type == 'update':
+                if current is not None:
+                    source = {**current, **action.get('doc', {})}
+                elif 'upsert' in action:
+                    source = action['upsert']
+                elif action.get('doc_as_upsert'):
+                    source = action['doc']
+                else:
+                    errors.append({'update': {'_id': doc_id, 'status': 404}})
+                    continue
+
+            if op_type != 'delete':
+                memory_index.put(doc_id, orjson.loads(orjson.dumps(source)))
+            success += 1
+        return success, errors
+
+    async def scan_pages(
+            self,
+            index: str,
+            query: dict | None = None,
+            source: bool | list[str] = True,
+            page_size: int = 1000,
+            **kwargs,
+    ) -> AsyncIterator[list[dict]]:
+        memory_index = self._index(index)
+        doc_ids = sorted(self._match(memory_index, query or {'match_all': {}}), key=memory_index.seq.get)
+        for start in range(0, len(doc_ids), page_size):
+            # Отдаём управление циклу событий перед каждой страницей, как при походе в сеть
+            await asyncio.sleep(0)
+            page = []
+            for doc_id in doc_ids[start:start + page_size]:
+                if doc_id not in memory_index.docs:
+                    continue
+                hit = {'_index': index, '_id': doc_id}
+                projected = self._source(memory_index.docs[doc_id], source)
+                if projected is not None:
+                    hit['_source'] = projected
+                page.append(hit)
+            yield page
+
+    def _match(self, memory_index: _MemoryIndex, query: dict) -> dict[str, float]:
+        (kind, params), = query.items()
+        if kind == 'match_all':
+            return dict.fromkeys(memory_index.docs, 1.0)
+        if kind == 'ids':
+            return {doc_id: 1.0 for doc_id in params['values'] if doc_id in memory_index.docs}
+        if kind == 'term':
+            field, value = _single(params)
+            value = value['value'] if isinstance(value, dict) else value
+            return dict.fromkeys(memory_index.keyword_ids(field, value), 1.0)
+        if kind == 'terms':
+            field, values = _single(params)
+            return dict.fromkeys(set().union(*(memory_index.keyword_ids(field, value) for value in values)), 1.0)
+        if kind == 'match':
+            field, value = _single(params)
+            return memory_index.text_scores(field, value['query'] if isinstance(value, dict) else value)
+        if kind == 'multi_match':
+            scores = defaultdict(float)
+            for field in params['fields']:
+                name, _, boost = field.partition('^')
+                for doc_id, score in memory_index.text_scores(name, params['query'], float(boost or 1)).items():
+                    scores[doc_id] += score
+            return scores
+        if kind == 'range':
+            field, bounds = _single(params)
+            return dict.fromkeys(
+                (doc_id for doc_id in memory_index.docs if self._in_range(memory_index, doc_id, field, bounds)), 1.0)
+        if kind == 'exists':
+            field = _field(params['field'])
+            return {doc_id: 1.0 for doc_id, values in memory_index.values.items() if values.get(field)}
+        if kind == 'nested':
+            return self._match(memory_index, params['query'])
+        if kind == 'bool':
+            return self._match_bool(memory_index, params)
+        raise ValueError(f'unsupported query: {kind}')
+
+    def _match_bool(self, memory_index: _MemoryIndex, params: dict) -> dict[str, float]:
+        must = [self._match(memory_index, query) for query in _as_list(params.get('must'))]
+        filters = [self._match(memory_index, query) for query in _as_list(params.get('filter'))]
+        should = [self._match(memory_index, query) for query in _as_list(params.get('should'))]
+        must_not = [self._match(memory_index, query) for query in _as_list(params.get('must_not'))]
+
+        required = must + filters
+        if required:
+            candidates = set(required[0]).intersection(*required[1:])
+        elif should:
+            candidates = set().union(*should)
+        else:
+            candidates = set(memory_index.docs)
+        minimum_should_match = int(params.get('minimum_should_match', 0 if required else min(len(should), 1)))
+
+        scores = {}
+        for doc_id in candidates:
+            if any(doc_id in excluded for excluded in must_not):
+                continue
+            if sum(doc_id in matched for matched in should) < minimum_should_match:
+                continue
+            scores[doc_id] = sum(matched[doc_id] for matched in must) + sum(
+                matched.get(doc_id, 0.0) for matched in should)
+        return scores
+
+    @staticmethod
+    def _in_range(memory_index: _MemoryIndex, doc_id: str, field: str, bounds: dict) -> bool:
+        for value in memory_index.values[doc_id].get(_field(field), ()):
+            if 'gt' in bounds and not value > bounds['gt']:
+                continue
+            if 'gte' in bounds and not value >= bounds['gte']:
+                continue
+            if 'lt' in bounds and not value < bounds['lt']:
+                continue
+            if 'lte' in bounds and not value <= bounds['lte']:
+                continue
+            return True
+        return False
+
+    @staticmethod
+    def _sort_clauses(sort) -> list[tuple[str, str]]:
+        clauses = []
+        for clause in _as_list(sort):
+            if isinstance(clause, str):
+                clauses.append((clause, 'desc' if clause == '_score' else 'asc'))
+                continue
+            field, order = next(iter(clause.items()))
+            clauses.append((field, order['order'] if isinstance(order, dict) else order))
+        return clauses
+
+    @staticmethod
+    def _sort_key(memory_index: _MemoryIndex, doc_id: str, score: float, sort: list[tuple[str, str]]) -> list:
+        key = []
+        for field, order in sort:
+            if field == '_score':
+                key.append(score)
+            elif field in ('_shard_doc', '_doc'):
+                key.append(memory_index.seq[doc_id])
+            else:
+                key.append(memory_index.first_value(doc_id, field, reverse=order == 'desc'))
+        return key
+
+    @staticmethod
+    def _compare(left: list, right: list, sort: list[tuple[str, str]]) -> int:
+        for left_value, right_value, (_, order) in zip(left, right, sort):
+            if left_value == right_value:
+                continue
+            # Документы без значения - в конце при любом направлении сортировки
+            if left_value is None:
+                return 1
+            if right_value is None:
+                return -1
+            result = -1 if left_value < right_value else 1
+            return -result if order == 'desc' else result
+        return 0
+
+    @staticmethod
+    def _source(source: dict, includes) -> dict | None:
+        if includes is False:
+            return None
+        if includes is True or includes is None:
+            return source
+        if isinstance(includes, dict):
+            includes = includes.get('includes', ['*'])
+        return _project(source, _as_list(includes))
+
+    @staticmethod
+    def _aggregate(memory_index: _MemoryIndex, scores: dict, aggs: dict) -> dict:
+        result = {}
+        for name, agg in aggs.items():
+            (kind, params), = ((key, value) for key, value in agg.items() if key != 'aggs')
+            values = [value for doc_id in scores for value in memory_index.values[doc_id].get(_field(params['field']), ())]
+            if kind == 'max':
+                result[name] = {'value': max(values, default=None)}
+            elif kind == 'min':
+                result[name] = {'value': min(values, default=None)}
+            elif kind == 'value_count':
+                result[name] = {'value': len(values)}
+            elif kind == 'terms':
+                counts = defaultdict(int)
+                for doc_id in scores:
+                    for value in set(memory_index.values[doc_id].get(_field(params['field']), ())):
+                        counts[value] += 1
+                buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:params.get('size', 10)]
+                result[name] = {'buckets': [{'key': key, 'doc_count': count} for key, count in buckets]}
+            elif kind == 'histogram':
+                interval, offset = params['interval'], params.get('offset', 0)
+                counts = _bucket_counts(memory_index, scores, params['field'],
+                                        lambda value: math.floor((value - offset) / interval) * interval + offset)
+                if params.get('min_doc_count', 0) == 0 and counts:
+                    # Как и Elasticsearch, заполняем пустые корзины между крайними значениями
+                    low, high = min(counts), max(counts)
+                    counts = {key: counts.get(key, 0)
+                              for key in (low + step * interval for step in range(round((high - low) / interval) + 1))}
+                result[name] = {'buckets': _histogram_buckets(counts, params, lambda key: {'key': float(key)})}
+            elif kind == 'date_histogram':
+                truncate = CALENDAR_INTERVALS[params['calendar_interval']]
+                counts = _bucket_counts(memory_index, scores, params['field'], lambda value: truncate(_parse_date(value)))
+                result[name] = {'buckets': _histogram_buckets(counts, params, lambda key: {
+                    'key_as_string': key.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'key': int(key.timestamp() * 1000),
+                })}
+            else:
+                raise ValueError(f'unsupported aggregation: {kind}')
+        return result
+
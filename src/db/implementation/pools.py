@@ -0,0 +1,263 @@
+"""
+Пулы соединений Redis и Elasticsearch: размеры, таймауты и keep-alive из Settings, прогрев при старте и статистика.
+
+Статистика пулов - занятые и свободные соединения, сколько открыто новых и сколько запросы ждали соединения -
+отдаётся в /api/v1/stats (pool.redis, pool.elasticsearch) и в метриках pool_connections_in_use
+и pool_acquire_duration_seconds. Ожидание соединения считается вместе с открытием нового: всплески
+этого времени под нагрузкой и означают, что пул мал и соединения постоянно открываются заново.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+import aiohttp
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import ImproperlyConfigured
+from elasticsearch._async.http_aiohttp import AIOHttpConnection, ESClientResponse
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from core.config import Settings
+from core.metrics import POOL_ACQUIRE_DURATION, POOL_CONNECTIONS_IN_USE
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    def __init__(self, backend: str):
+        self.acquires = 0
+        self.created = 0
+        self.acquire_seconds = 0.0
+        self.max_acquire_seconds = 0.0
+        self.in_use_gauge = POOL_CONNECTIONS_IN_USE.labels(backend)
+        self._acquire_histogram = POOL_ACQUIRE_DURATION.labels(backend)
+
+    def observe_acquire(self, seconds: float):
+        self.acquires += 1
+        self.acquire_seconds += seconds
+        self.max_acquire_seconds = max(self.max_acquire_seconds, seconds)
+        self._acquire_histogram.observe(seconds)
+
+    def summary(self, in_use: int, idle: int, max_connections: int) -> dict:
+        return {
+            'in_use': in_use,
+            'idle': idle,
+            'max_connections': max_connections,
+            'created': self.created,
+            'acquires': self.acquires,
+            'acquire_ms_avg': round(self.acquire_seconds * 1000 / self.acquires, 3) if self.acquires else 0.0,
+            'acquire_ms_max': round(self.max_acquire_seconds * 1000, 3),
+        }
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """Пул Redis: когда все соединения заняты, ждёт свободное до timeout секунд вместо ошибки и ведёт статистику."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_stats = PoolStats('redis')
+        self._checked_out = set()
+
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        self.pool_stats.observe_acquire(time.perf_counter() - started)
+        self._checked_out.add(connection)
+        self.pool_stats.in_use_gauge.inc()
+        return connection
+
+    def make_connection(self):
+        self.pool_stats.created += 1
+        return super().make_connection()
+
+    async def release(self, connection):
+        # Соединение, не выданное из-за ошибки подключения, пул тоже возвращает через release
+        if connection in self._checked_out:
+            self._checked_out.discard(connection)
+            self.pool_stats.in_use_gauge.dec()
+        await super().release(connection)
+
+    def stats(self) -> dict:
+        in_use = len(self._checked_out)
+        return self.pool_stats.summary(in_use, len(self._connections) - in_use, self.max_connections)
+
+
+def create_redis_pool(settings: Settings) -> InstrumentedConnectionPool:
+    return InstrumentedConnectionPool(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        socket_keepalive=settings.redis_socket_keepalive,
+        health_check_interval=settings.redis_health_check_interval,
+        retry_on_timeout=settings.redis_retry_on_timeout,
+    )
+
+
+# Общая статистика всех узлов Elasticsearch: узлы могут появляться и исчезать при поиске узлов кластера
+ELASTICSEARCH_POOL_STATS = PoolStats('elasticsearch')
+
+
+class ConnectorUsage:
+    """
+    Занятые и простаивающие соединения одного соединителя aiohttp, посчитанные по событиям трассировки.
+
+    Простаивающим считается соединение, возвращённое в пул не раньше keepalive_timeout секунд назад и ещё не
+    выданное снова: aiohttp выдаёт последнее возвращённое, а просроченные закрывает.
+    """
+
+    def __init__(self, stats: PoolStats, keepalive_timeout: float):
+        self.stats = stats
+        self.keepalive_timeout = keepalive_timeout
+        self.in_use = 0
+        # Время возврата простаивающих соединений, последнее возвращённое - справа
+        self._released = deque()
+
+    def idle(self) -> int:
+        expired = time.monotonic() - self.keepalive_timeout
+        while self._released and self._released[0] < expired:
+            self._released.popleft()
+        return len(self._released)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        # https://docs.aiohttp.org/en/stable/tracing_reference.html
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.acquired = False
+
+        async def on_connection_acquired(session, context, params):
+            self.stats.observe_acquire(time.perf_counter() - context.started)
+            self.stats.in_use_gauge.inc()
+            self.in_use += 1
+            context.acquired = True
+
+        async def on_connection_reused(session, context, params):
+            if self._released:
+                self._released.pop()
+            await on_connection_acquired(session, context, params)
+
+        async def on_connection_created(session, context, params):
+            self.stats.created += 1
+            await on_connection_acquired(session, context, params)
+
+        async def on_request_failed(session, context, params):
+            if context.acquired:
+                self.stats.in_use_gauge.dec()
+                self.in_use -= 1
+                context.acquired = False
+
+        async def on_request_end(session, context, params):
+            # Соединение после ответа возвращается в пул, после ошибки - закрывается
+            if context.acquired:
+                self._released.append(time.monotonic())
+            await on_request_failed(session, context, params)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_reuseconn.append(on_connection_reused)
+        trace_config.on_connection_create_end.append(on_connection_created)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_failed)
+        return trace_config
+
+
+class PooledAIOHttpConnection(AIOHttpConnection):
+    """
+    Соединение elasticsearch-py с настраиваемым keep-alive простаивающих соединений и статистикой пула aiohttp.
+
+    maxsize - сколько соединений держать к узлу, keepalive_timeout - сколько секунд простаивающее соединение
+    остаётся открытым: при коротком keep-alive всплески нагрузки каждый раз открывают соединения заново.
+    Для SSL нужен готовый ssl_context: остальные SSL-параметры elasticsearch-py собирает в контекст,
+    который наружу не отдаёт.
+    """
+
+    def __init__(self, *args, maxsize: int = 10, ssl_context=None, keepalive_timeout: float = 60.0, **kwargs):
+        super().__init__(*args, maxsize=maxsize, ssl_context=ssl_context, **kwargs)
+        if self.use_ssl and ssl_context is None:
+            raise ImproperlyConfigured('PooledAIOHttpConnection requires ssl_context when use_ssl is set')
+        self.maxsize = maxsize
+        self.ssl_context = ssl_context
+        self.keepalive_timeout = keepalive_timeout
+        self.usage = ConnectorUsage(ELASTICSEARCH_POOL_STATS, keepalive_timeout)
+
+    async def _create_aiohttp_session(self):
+        # Сессию с заголовками и настройками elasticsearch-py создаёт сам, а keep-alive соединителя и трассировка
+        # задаются в aiohttp только при создании: её настройки переносятся в сессию с другим соединителем
+        await super()._create_aiohttp_session()
+        default_session = self.session
+        self.session = aiohttp.ClientSession(
+            headers=default_session.headers,
+            skip_auto_headers=default_session.skip_auto_headers,
+            auto_decompress=default_session.auto_decompress,
+            cookie_jar=default_session.cookie_jar,
+            response_class=ESClientResponse,
+            connector=aiohttp.TCPConnector(
+                limit=self.maxsize,
+                use_dns_cache=True,
+                enable_cleanup_closed=True,
+                ssl=self.ssl_context or True,
+                keepalive_timeout=self.keepalive_timeout,
+            ),
+            trace_configs=[self.usage.trace_config()],
+        )
+        # Запросов через сессию по умолчанию ещё не было, открытых соединений у неё нет
+        await default_session.close()
+
+    def pool_usage(self) -> tuple[int, int]:
+        """Занятые и свободные соединения к узлу."""
+        return self.usage.in_use, self.usage.idle()
+
+
+def create_elasticsearch(settings: Settings) -> AsyncElasticsearch:
+    return AsyncElasticsearch(
+        hosts=[f'{settings.elastic_host}:{settings.elastic_port}'],
+        connection_class=PooledAIOHttpConnection,
+        maxsize=settings.elastic_connections_per_node,
+        keepalive_timeout=settings.elastic_keepalive_timeout,
+        timeout=settings.elastic_timeout,
+        max_retries=settings.elastic_max_retries,
+        retry_on_timeout=settings.elastic_retry_on_timeout,
+        # Поиск узлов кластера: при старте, после ошибки соединения и раз в sniffer_timeout секунд
+        sniff_on_start=settings.elastic_sniff_on_start,
+        sniff_on_connection_fail=settings.elastic_sniff_on_connection_fail,
+        sniffer_timeout=settings.elastic_sniffer_timeout,
+    )
+
+
+def redis_pool_stats(redis: Redis) -> dict:
+    pool = getattr(redis, 'connection_pool', None)
+    return pool.stats() if isinstance(pool, InstrumentedConnectionPool) else {}
+
+
+def elasticsearch_pool_stats(es: AsyncElasticsearch) -> dict:
+    in_use = idle = max_connections = 0
+    for connection in es.transport.connection_pool.connections:
+        if isinstance(connection, PooledAIOHttpConnection):
+            connection_in_use, connection_idle = connection.pool_usage()
+            in_use += connection_in_use
+            idle += connection_idle
+            max_connections += connection.maxsize
+    return ELASTICSEARCH_POOL_STATS.summary(in_use, idle, max_connections)
+
+
+async def _warm_up(name: str, connect, connections: int):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(connect() for _ in range(connections)), return_exceptions=True)
+    # es.ping() при ошибке возвращает False, а не бросает исключение
+    errors = [result for result in results if isinstance(result, BaseException) or result is False]
+    if errors:
+        logger.warning('%s warm-up: %d of %d connections failed: %r', name, len(errors), connections, errors[0])
+    logger.info('%s warm-up: %d connections in %.1f ms',
+                name, connections - len(errors), (time.perf_counter() - started) * 1000)
+
+
+async def warm_up_redis(redis: Redis, connections: int):
+    """Открывает до connections соединений к Redis: одновременные PING берут из пула разные соединения."""
+    await _warm_up('redis', redis.ping, connections)
+
+
+async def warm_up_elasticsearch(es: AsyncElasticsearch, connections: int):
+    await _warm_up('elasticsearch', es.ping, connections)
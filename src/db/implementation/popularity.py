@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+from core.config import get_settings
+from core.stats import register_stats
+from db.implementation import cache
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_KEY_PREFIX = 'popular'
+# Вид счётчиков для страниц списков: участник множества - ключ закешированного ответа (см. core.response_cache).
+# Документы считаются по имени индекса: movies, persons, genres
+POPULARITY_PAGES = 'pages'
+POPULARITY_KINDS = ('movies', 'persons', 'genres', POPULARITY_PAGES)
+# Раз в период полураспада счётчики уменьшаются вдвое
+POPULARITY_DECAY_WEIGHT = 0.5
+# Счётчики, затухшие ниже порога, удаляются из множеств
+POPULARITY_MIN_SCORE = 0.01
+# Больше разных ключей между сбросами не копим: поток случайных ID не должен раздувать память процесса
+POPULARITY_MAX_PENDING = 10_000
+
+
+def popularity_key(kind: str) -> str:
+    return f'{POPULARITY_KEY_PREFIX}:{kind}'
+
+
+class PopularityTracker:
+    """
+    Счётчики обращений к документам и страницам списков в отсортированных множествах Redis (ZSET) с затуханием.
+
+    hit только увеличивает счётчик в памяти процесса, запрос не ждёт Redis. Раз в flush_interval накопленное
+    уходит в Redis одним пайплайном ZINCRBY, и множества обрезаются до max_members лучших ключей.
+    Раз в half_life один воркер под арендой вдвое уменьшает все счётчики (ZUNIONSTORE с весом 0.5): старые
+    обращения затухают экспоненциально, и популярное вчера уступает популярному сегодня.
+    """
+
+    def __init__(self, flush_interval: int, half_life: int, max_members: int):
+        self.flush_interval = flush_interval
+        self.half_life = half_life
+        self.max_members = max_members
+        self.lease_key = f'{POPULARITY_KEY_PREFIX}:decay'
+        self._pending: dict[str, Counter] = {}
+        self._pending_count = 0
+
+        self.hits = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.decays = 0
+
+    def hit(self, kind: str, member: str):
+        counter = self._pending.get(kind)
+        if counter is None:
+            counter = self._pending[kind] = Counter()
+        if member not in counter:
+            if self._pending_count >= POPULARITY_MAX_PENDING:
+                self.dropped += 1
+                return
+            self._pending_count += 1
+        counter[member] += 1
+        self.hits += 1
+
+    async def top(self, kind: str, count: int) -> list[str]:
+        """count самых популярных ключей вида kind, от самого популярного."""
+        if count <= 0:
+            return []
+        members = await cache.redis.zrevrange(popularity_key(kind), 0, count - 1)
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    async def flush(self):
+        pending, self._pending, self._pending_count = self._pending, {}, 0
+        if not pending:
+            return
+
+        async with cache.redis.pipeline(transaction=False) as pipe:
+            for kind, counter in pending.items():
+                key = popularity_key(kind)
+                for member, count in counter.items():
+                    pipe.zincrby(key, count, member)
+                # Самые непопулярные - в начале множества, оставляем max_members с конца
+                pipe.zremrangebyrank(key, 0, -self.max_members - 1)
+            await pipe.execute()
+        self.flushes += 1
+
+    async def decay(self) -> bool:
+        # Затухание - одно на half_life для всех воркеров: аренда живёт ровно период полураспада
+        if not await cache.redis.set(self.lease_key, '1', ex=self.half_life, nx=True):
+            return False
+
+        async with cache.redis.pipeline(transaction=False) as pipe:
+            for kind in POPULARITY_KINDS:
+                key = popularity_key(kind)
+                pipe.zunionstore(key, {key: POPULARITY_DECAY_WEIGHT})
+                pipe.zremrangebyscore(key, '-inf', f'({POPULARITY_MIN_SCORE}')
+            await pipe.execute()
+        self.decays += 1
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self.decay()
+            except Exception:
+                # Потерянные счётчики только чуть занижают популярность, попробуем при следующем сбросе
+                logger.exception('popularity flush failed')
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'pending': self._pending_count,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'decays': self.decays,
+        }
+
+
+# None - подсчёт популярности выключен в настройках
+@lru_cache()
+def get_popularity_tracker() -> Optional[PopularityTracker]:
+    settings = get_settings()
+    if not settings.popularity_enabled:
+        return None
+
+    tracker = PopularityTracker(
+        flush_interval=settings.popularity_flush_interval,
+        half_life=settings.popularity_half_life,
+        max_members=settings.popularity_max_members,
+    )
+    register_stats('popularity', tracker.stats)
+    return tracker
@@ -1,9 +1,229 @@
-from typing import Optional
-from elasticsearch import AsyncElasticsearch
+import asyncio
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Iterable, Optional
+from elasticsearch import AsyncElasticsearch, NotFoundError, TransportError
+from elasticsearch.helpers import async_bulk
+
+from core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from core.config import get_settings
+from core.metrics import observe_backend
+from core.profiling import current_profile, record_timing
+from core.stats import register_stats
+from db.abstract.search_engine import AsyncSearchEngine
 
 #es: Optional[AsyncElasticsearch] = None
 es: AsyncElasticsearch | None = None
 
+# Сколько живёт point in time между страницами scan_stream
+SCAN_KEEP_ALIVE = '1m'
+
+
 class SearchEngineRepository(AsyncSearchEngine):
-    async def get(self, index: str, id: int, **kwargs):
-        return self.es.get(index=index, id=id)
\ No newline at end of file
+    async def get(self, index: str, id: str, **kwargs):
+        return await es.get(index=index, id=id, **kwargs)
+
+    async def mget(self, index: str, ids: list[str], **kwargs) -> list[dict]:
+        # https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-multi-get.html
+        response = await es.mget(index=index, body={'ids': ids}, **kwargs)
+        return response['docs']
+
+    async def search(self, index: str, body: dict, **kwargs):
+        # Запрос с point in time уже привязан к индексу, указывать индекс повторно нельзя
+        if 'pit' in body:
+            return await es.search(body=body, **kwargs)
+        return await es.search(index=index, body=body, **kwargs)
+
+    async def count(self, index: str, query: dict | None = None, **kwargs) -> int:
+        body = {'query': query} if query else None
+        response = await es.count(index=index, body=body, **kwargs)
+        return response['count']
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> str:
+        # https://www.elastic.co/guide/en/elasticsearch/reference/current/point-in-time-api.html
+        response = await es.open_point_in_time(index=index, keep_alive=keep_alive, **kwargs)
+        return response['id']
+
+    async def close_point_in_time(self, pit_id: str, **kwargs):
+        return await es.close_point_in_time(body={'id': pit_id}, **kwargs)
+
+    async def index(self, index: str, id: str, document: dict, **kwargs):
+        return await es.index(index=index, id=id, body=document, **kwargs)
+
+    async def bulk(self, actions: Iterable[dict], **kwargs) -> tuple[int, list]:
+        # https://elasticsearch-py.readthedocs.io/en/7.x/async.html#async-helpers
+        return await async_bulk(es, actions, raise_on_error=False, **kwargs)
+
+    async def scan_pages(
+            self,
+            index: str,
+            query: dict | None = None,
+            source: bool | list[str] = True,
+            page_size: int = 1000,
+            **kwargs,
+    ) -> AsyncIterator[list[dict]]:
+        # Обход через point in time и search_after: в отличие от scroll не держит контекст на каждую страницу
+        pit_id = await self.open_point_in_time(index=index, keep_alive=SCAN_KEEP_ALIVE)
+        body = {
+            'query': query or {'match_all': {}},
+            'size': page_size,
+            '_source': source,
+            'sort': [{'_shard_doc': 'asc'}],
+            'pit': {'id': pit_id, 'keep_alive': SCAN_KEEP_ALIVE},
+        }
+        try:
+            while True:
+                response = await self.search(index=index, body=body, **kwargs)
+                hits = response['hits']['hits']
+                yield hits
+                if len(hits) < page_size:
+                    break
+                body['search_after'] = hits[-1]['sort']
+                body['pit']['id'] = response.get('pit_id', body['pit']['id'])
+        finally:
+            try:
+                await self.close_point_in_time(body['pit']['id'])
+            except NotFoundError:
+                pass
+
+
+def is_search_engine_failure(error: BaseException) -> bool:
+    # Ошибки запроса (404, 400, 409) - нормальный ответ Elasticsearch, а не его отказ.
+    # У ошибок соединения и таймаутов status_code - строка 'N/A'
+    if isinstance(error, TransportError) and isinstance(error.status_code, int):
+        return error.status_code >= 500 or error.status_code == 429
+    return True
+
+
+class InstrumentedSearchEngine(AsyncSearchEngine):
+    """
+    Считает обращения к поисковому движку по методам, чтобы мерить число запросов к Elasticsearch на запрос API,
+    и пишет их длительность в метрики Prometheus по операции и индексу.
+
+    С breaker запросы идут через circuit breaker (core.circuit_breaker): пока он открыт,
+    запросы сразу получают CircuitOpenError и не ждут медленный или недоступный Elasticsearch.
+    """
+
+    def __init__(self, search_engine: AsyncSearchEngine, backend: str = 'elasticsearch',
+                 breaker: Optional[CircuitBreaker] = None):
+        self.search_engine = search_engine
+        # Значение метки backend в метриках
+        self.backend = backend
+        self.breaker = breaker
+        self.calls = Counter()
+
+    async def _call(self, operation: str, index: str, call: Awaitable):
+        if self.breaker is not None:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                # Запрос не отправляем: закрываем созданную корутину, чтобы asyncio не ругался на неё
+                call.close()
+                raise
+
+        self.calls[operation] += 1
+        started = time.perf_counter()
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            if self.breaker is not None:
+                self.breaker.on_cancel()
+            raise
+        except Exception as error:
+            observe_backend(self.backend, operation, index, started, error)
+            if self.breaker is not None:
+                self.breaker.on_failure(error, time.perf_counter() - started)
+            raise
+        finally:
+            record_timing('search_engine', started)
+        observe_backend(self.backend, operation, index, started)
+        if self.breaker is not None:
+            self.breaker.on_success(time.perf_counter() - started)
+        return result
+
+    async def get(self, index: str, id: str, **kwargs):
+        return await self._call('get', index, self.search_engine.get(index, id, **kwargs))
+
+    async def mget(self, index: str, ids: list[str], **kwargs) -> list[dict]:
+        return await self._call('mget', index, self.search_engine.mget(index, ids, **kwargs))
+
+    async def search(self, index: str, body: dict, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return await self._call('search', index, self.search_engine.search(index, body, **kwargs))
+
+        # В профилируемом запросе Elasticsearch сам раскладывает время поиска по шардам и частям запроса
+        response = await self._call('search', index, self.search_engine.search(index, {**body, 'profile': True}, **kwargs))
+        profile.search_profiles.append({'index': index, 'took': response.get('took'), 'profile': response.get('profile')})
+        return response
+
+    async def count(self, index: str, query: dict | None = None, **kwargs) -> int:
+        return await self._call('count', index, self.search_engine.count(index, query, **kwargs))
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> str:
+        return await self._call(
+            'open_point_in_time', index, self.search_engine.open_point_in_time(index, keep_alive, **kwargs))
+
+    async def close_point_in_time(self, pit_id: str, **kwargs):
+        return await self._call('close_point_in_time', '', self.search_engine.close_point_in_time(pit_id, **kwargs))
+
+    async def index(self, index: str, id: str, document: dict, **kwargs):
+        return await self._call('index', index, self.search_engine.index(index, id, document, **kwargs))
+
+    async def bulk(self, actions: Iterable[dict], **kwargs) -> tuple[int, list]:
+        return await self._call('bulk', '', self.search_engine.bulk(actions, **kwargs))
+
+    async def scan_pages(
+            self,
+            index: str,
+            query: dict | None = None,
+            source: bool | list[str] = True,
+            page_size: int = 1000,
+            **kwargs,
+    ) -> AsyncIterator[list[dict]]:
+        # Каждая страница - отдельный запрос к Elasticsearch: в метриках и circuit breaker обход виден постранично,
+        # и открытый breaker останавливает уже начатый обход
+        pages = self.search_engine.scan_pages(index, query, source, page_size, **kwargs)
+        try:
+            while (page := await self._call('scan', index, anext(pages, None))) is not None:
+                yield page
+        finally:
+            await pages.aclose()
+
+    def stats(self) -> dict:
+        return {'calls': sum(self.calls.values()), **self.calls}
+
+
+# Один репозиторий на процесс, чтобы lru_cache в get_*_service не создавал сервис на каждый запрос.
+# SEARCH_ENGINE_BACKEND=memory подменяет Elasticsearch поиском в памяти процесса для локальных запусков
+@lru_cache()
+def get_search_engine() -> AsyncSearchEngine:
+    settings = get_settings()
+    if settings.search_engine_backend == 'memory':
+        from db.implementation.memory_search_engine import InMemorySearchEngine
+
+        search_engine = InMemorySearchEngine()
+        if settings.search_engine_fixtures:
+            search_engine.load_fixtures(settings.search_engine_fixtures)
+    else:
+        search_engine = SearchEngineRepository()
+
+    breaker = None
+    if settings.circuit_breaker_enabled:
+        breaker = CircuitBreaker(
+            'search_engine',
+            window_size=settings.circuit_breaker_window_size,
+            minimum_calls=settings.circuit_breaker_minimum_calls,
+            failure_rate_threshold=settings.circuit_breaker_failure_rate,
+            slow_call_duration=settings.circuit_breaker_slow_call_duration,
+            slow_call_rate_threshold=settings.circuit_breaker_slow_call_rate,
+            open_duration=settings.circuit_breaker_open_duration,
+            half_open_calls=settings.circuit_breaker_half_open_calls,
+            is_failure=is_search_engine_failure,
+        )
+        register_stats('circuit_breaker.search_engine', breaker.stats)
+
+    instrumented = InstrumentedSearchEngine(search_engine, settings.search_engine_backend, breaker)
+    register_stats('search_engine', instrumented.stats)
+    return instrumented
@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import logging
+import time
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from operator import itemgetter
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional
+
+from core.config import get_settings
+from core.stats import register_stats
+from db.abstract.search_engine import AsyncSearchEngine
+from db.implementation.search_engine import get_search_engine
+
+logger = logging.getLogger(__name__)
+
+# Больше подсказок одного вида за запрос не отдаём
+SUGGEST_MAX_LIMIT = 20
+# Если ключей с префиксом больше, лучшие подсказки для него посчитаны заранее, иначе перебираем ключи при запросе.
+# Так поиск не просматривает больше SUGGEST_SCAN_LIMIT ключей для любого префикса
+SUGGEST_SCAN_LIMIT = 128
+# Дальше этой длины префиксы заранее не считаем, даже если под ними много одинаковых названий
+SUGGEST_MAX_PRECOMPUTED_PREFIX_LENGTH = 32
+# С каких слов названия можно начинать ввод: "godf" находит "The Godfather", но не с десятого слова
+SUGGEST_MAX_WORD_STARTS = 8
+# Размер страницы при загрузке индекса
+SUGGEST_SCAN_PAGE_SIZE = 5000
+
+
+def normalize_suggest_text(text: str) -> str:
+    """Регистр, диакритика, ё и знаки препинания не важны: "Amélie!" и "amelie" дают один ключ."""
+    text = unicodedata.normalize('NFKD', text.casefold().replace('ё', 'е'))
+    text = ''.join(char if char.isalnum() else ' ' for char in text if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+
+def index_keys(text: str) -> set[str]:
+    # Ключ на каждое слово: название целиком и все его хвосты, начинающиеся с начала слова
+    words = normalize_suggest_text(text).split(' ')
+    return {' '.join(words[start:]) for start in range(min(len(words), SUGGEST_MAX_WORD_STARTS)) if words[start]}
+
+
+class SuggestEntry(NamedTuple):
+    id: str
+    text: str
+    # Чем больше, тем выше подсказка: рейтинг фильма или число фильмов персоны
+    score: float
+
+
+def _rank(entry: SuggestEntry) -> tuple:
+    return -entry.score, entry.text
+
+
+class PrefixIndex:
+    """
+    Неизменяемый индекс префиксов: отсортированный массив нормализованных ключей и записи на тех же позициях.
+
+    Подсказки по префиксу - диапазон ключей, найденный двумя бинарными поисками, из которого берутся
+    limit лучших записей. Для префиксов с диапазоном больше SUGGEST_SCAN_LIMIT ключей лучшие записи посчитаны заранее.
+    """
+
+    def __init__(self, entries: Mapping[str, SuggestEntry], pairs: list[tuple[str, SuggestEntry]]):
+        # При обновлении pairs - два уже отсортированных отрезка, и timsort просто сливает их за O(n)
+        pairs.sort(key=itemgetter(0))
+        self.entries = entries
+        self.keys = [key for key, _ in pairs]
+        self.refs = [entry for _, entry in pairs]
+        self.top = self._precompute_top()
+
+    @classmethod
+    def build(cls, entries: Iterable[SuggestEntry]) -> 'PrefixIndex':
+        entries = {entry.id: entry for entry in entries}
+        return cls(entries, [(key, entry) for entry in entries.values() for key in index_keys(entry.text)])
+
+    def updated(self, changed: Iterable[SuggestEntry]) -> 'PrefixIndex':
+        """Новый индекс с добавленными и изменёнными записями без пересортировки всех ключей."""
+        changed = {entry.id: entry for entry in changed}
+        pairs = [(key, entry) for key, entry in zip(self.keys, self.refs) if entry.id not in changed]
+        pairs += sorted(((key, entry) for entry in changed.values() for key in index_keys(entry.text)), key=itemgetter(0))
+        return PrefixIndex({**self.entries, **changed}, pairs)
+
+    def search(self, prefix: str, limit: int) -> list[SuggestEntry]:
+        if not prefix:
+            return []
+
+        top = self.top.get(prefix)
+        if top is not None:
+            return list(top[:limit])
+
+        start = bisect_left(self.keys, prefix)
+        # Все ключи с этим префиксом меньше префикса, дополненного наибольшим символом
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        # Запись может совпасть несколькими ключами (разными словами названия), оставляем одну
+        unique = {entry.id: entry for entry in self.refs[start:end]}
+        return heapq.nsmallest(limit, unique.values(), key=_rank)
+
+    def _precompute_top(self) -> dict[str, tuple[SuggestEntry, ...]]:
+        # Префиксы длины length, под которыми больше SUGGEST_SCAN_LIMIT ключей, лежат внутри таких же префиксов
+        # длины length - 1, поэтому на каждом шаге просматриваем только их диапазоны
+        keys = self.keys
+        top = {}
+        spans = [(0, len(keys))]
+        for length in range(1, SUGGEST_MAX_PRECOMPUTED_PREFIX_LENGTH + 1):
+            heavy = []
+            for start, end in spans:
+                position = start
+                while position < end:
+                    if len(keys[position]) < length:
+                        position += 1
+                        continue
+                    prefix = keys[position][:length]
+                    group_end = bisect_left(keys, prefix + '\U0010ffff', position, end)
+                    if group_end - position > SUGGEST_SCAN_LIMIT:
+                        unique = {entry.id: entry for entry in self.refs[position:group_end]}
+                        top[prefix] = tuple(heapq.nsmallest(SUGGEST_MAX_LIMIT, unique.values(), key=_rank))
+                        heavy.append((position, group_end))
+                    position = group_end
+            if not heavy:
+                break
+            spans = heavy
+        return top
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SuggestSource(NamedTuple):
+    index: str
+    # Поля документа, которые нужны подсказкам: остальное Elasticsearch не отдаёт
+    fields: list[str]
+    entry: Callable[[dict], SuggestEntry]
+    # Время изменения документа; без него изменения видны только по числу документов и полной перезагрузке
+    modified_field: Optional[str] = 'modified'
+
+
+SUGGEST_SOURCES = {
+    # У документов movies нет modified: изменённое название или рейтинг подхватывает периодическая полная загрузка
+    'films': SuggestSource(
+        'movies', ['id', 'title', 'rating'],
+        lambda source: SuggestEntry(str(source['id']), source['title'], source.get('rating') or 0.0),
+        modified_field=None,
+    ),
+    'persons': SuggestSource(
+        'persons', ['id', 'full_name', 'films'],
+        lambda source: SuggestEntry(str(source['id']), source['full_name'], len(source.get('films') or ())),
+    ),
+}
+
+
+class SuggestIndex:
+    """
+    Подсказки по началу названия фильма и имени персоны из памяти процесса, без Elasticsearch на каждый символ ввода.
+
+    Индексы префиксов загружаются при старте и раз в refresh_interval сверяются с индексами Elasticsearch по числу
+    документов и наибольшему modified. Если документы только добавлялись и менялись, подгружаются лишь изменённые
+    после прошлой загрузки (modified > прошлого), иначе - все документы заново.
+    Индексы без modified сверяются только по числу документов, поэтому, кроме того, раз в full_reload_interval
+    загружаются заново целиком. Пока индекс не загружен, ready - False.
+    """
+
+    def __init__(self, search_engine: AsyncSearchEngine, refresh_interval: int, full_reload_interval: int):
+        self.search_engine = search_engine
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.indexes: dict[str, PrefixIndex] = {}
+        # Число документов и наибольший modified индекса Elasticsearch на момент загрузки
+        self.versions: dict[str, tuple] = {}
+        # Время последней полной загрузки (time.monotonic())
+        self.loaded_at: dict[str, float] = {}
+
+        self.loads = 0
+        self.incremental_updates = 0
+        self.skipped_refreshes = 0
+        self.load_duration = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return len(self.indexes) == len(SUGGEST_SOURCES)
+
+    def suggest(self, query: str, limit: int) -> dict[str, list[SuggestEntry]]:
+        prefix = normalize_suggest_text(query)
+        limit = min(limit, SUGGEST_MAX_LIMIT)
+        return {name: index.search(prefix, limit) for name, index in self.indexes.items()}
+
+    async def refresh(self):
+        for name, source in SUGGEST_SOURCES.items():
+            await self._refresh_source(name, source)
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Оставляем прежние индексы, попробуем при следующем обновлении
+                logger.exception('suggest index refresh failed')
+            await asyncio.sleep(self.refresh_interval)
+
+    async def _refresh_source(self, name: str, source: SuggestSource):
+        version = await self._version(source)
+        current, known = self.indexes.get(name), self.versions.get(name)
+        if current is not None and known == version and not self._reload_due(name, source):
+            self.skipped_refreshes += 1
+            return
+
+        started = time.monotonic()
+        count = version[0]
+        if current is not None and known[1] is not None and count >= known[0]:
+            changed = await self._load(source, {'range': {source.modified_field: {'gt': known[1]}}})
+            updated = await asyncio.to_thread(current.updated, changed)
+            # Число документов не сошлось - что-то удалили, такие изменения видны только при полной загрузке
+            if len(updated) == count:
+                self._replace(name, updated, version, started)
+                self.incremental_updates += 1
+                logger.info('suggest index %s: %s changed documents in %.3fs', name, len(changed), self.load_duration)
+                return
+
+        # Индекс строится в потоке: GIL переключается между ним и event loop, и запросы не ждут всю сборку
+        index = await asyncio.to_thread(PrefixIndex.build, await self._load(source))
+        self._replace(name, index, version, started)
+        self.loaded_at[name] = started
+        self.loads += 1
+        logger.info('suggest index %s: %s documents in %.3fs', name, len(index), self.load_duration)
+
+    def _replace(self, name: str, index: PrefixIndex, version: tuple, started: float):
+        # Подмена целиком: читатели видят либо старый, либо новый индекс
+        self.indexes[name] = index
+        self.versions[name] = version
+        self.load_duration = time.monotonic() - started
+
+    async def _load(self, source: SuggestSource, query: Optional[dict] = None) -> list[SuggestEntry]:
+        return [
+            source.entry(hit['_source'])
+            async for hit in self.search_engine.scan_stream(
+                source.index, query, source=source.fields, page_size=SUGGEST_SCAN_PAGE_SIZE)
+        ]
+
+    def _reload_due(self, name: str, source: SuggestSource) -> bool:
+        # Изменения документов без modified не видны по версии индекса
+        if source.modified_field is not None:
+            return False
+        return time.monotonic() - self.loaded_at.get(name, 0.0) >= self.full_reload_interval
+
+    async def _version(self, source: SuggestSource) -> tuple:
+        if source.modified_field is None:
+            return await self.search_engine.count(index=source.index), None
+
+        response = await self.search_engine.search(
+            index=source.index,
+            body={
+                'size': 0,
+                'track_total_hits': True,
+                'query': {'match_all': {}},
+                'aggs': {'last_modified': {'max': {'field': source.modified_field}}},
+            },
+        )
+        return response['hits']['total']['value'], response['aggregations']['last_modified']['value']
+
+    def stats(self) -> dict:
+        return {
+            'ready': self.ready,
+            **{name: len(index) for name, index in self.indexes.items()},
+            'keys': sum(len(index.keys) for index in self.indexes.values()),
+            'loads': self.loads,
+            'incremental_updates': self.incremental_updates,
+            'skipped_refreshes': self.skipped_refreshes,
+            'load_duration': self.load_duration,
+        }
+
+
+@lru_cache()
+def get_suggest_index() -> SuggestIndex:
+    settings = get_settings()
+    index = SuggestIndex(get_search_engine(), settings.suggest_refresh_interval, settings.suggest_full_reload_interval)
+    register_stats('suggest', index.stats)
+    return index
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = 500
+BULK_CONCURRENCY = 4
+BULK_MAX_RETRIES = 3
+
+
+async def bulk_write(
+        client: AsyncElasticsearch,
+        actions: Iterable[dict],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        concurrency: int = BULK_CONCURRENCY,
+) -> int:
+    """
+    Отправляет действия через async_streaming_bulk в concurrency параллельных потоков и возвращает число успешных.
+
+    Действия раздаются потокам из ограниченной очереди, поэтому в памяти их не больше chunk_size * concurrency.
+    """
+    queue = asyncio.Queue(maxsize=chunk_size * concurrency)
+
+    async def produce():
+        for action in actions:
+            await queue.put(action)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume() -> int:
+        async def stream():
+            while (action := await queue.get()) is not None:
+                yield action
+
+        written = 0
+        async for ok, item in async_streaming_bulk(
+                client,
+                stream(),
+                chunk_size=chunk_size,
+                max_retries=BULK_MAX_RETRIES,
+                raise_on_error=False,
+        ):
+            if ok:
+                written += 1
+            else:
+                logger.error('Bulk action failed: %s', item)
+        return written
+
+    _, *written = await asyncio.gather(produce(), *[consume() for _ in range(concurrency)])
+    return sum(written)
+
+
+async def ensure_index(client: AsyncElasticsearch, index: str, body: dict):
+    if not await client.indices.exists(index=index):
+        # 400 - индекс уже создал параллельный запуск
+        await client.indices.create(index=index, body=body, ignore=400)
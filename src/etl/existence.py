@@ -0,0 +1,34 @@
+import uuid
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from db.implementation.existence import ADD_MESSAGE_PREFIX, EXISTENCE_KEY_PREFIX
+
+
+class ExistenceNotifier:
+    """
+    Сообщает воркерам API о документах, записанных ETL в обход API.
+
+    Фильтр Блума воркера узнаёт о новых ID только из этих сообщений или при следующем перестроении,
+    без них API отвечал бы по новым документам 404 до перестроения.
+    """
+
+    def __init__(self, redis: Redis, index: str, instance_id: Optional[str] = None):
+        self.redis = redis
+        self.channel = f'{EXISTENCE_KEY_PREFIX}:{index}'
+        # Воркеры API пропускают только собственные сообщения, поэтому у ETL свой ID отправителя
+        self.instance_id = instance_id or uuid.uuid4().hex
+
+    def queue(self, pipe, ids: list[str]):
+        # Для ETL, которые отправляют сообщения в своём пайплайне вместе с другими командами
+        for doc_id in ids:
+            pipe.publish(self.channel, f'{self.instance_id}:{ADD_MESSAGE_PREFIX}{doc_id}')
+
+    async def __call__(self, ids: list[str]):
+        if not ids:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self.queue(pipe, ids)
+            await pipe.execute()
@@ -0,0 +1,252 @@
+"""
+ETL индекса genres: жанры и число фильмов каждого жанра собираются из индекса movies.
+
+Запуск из папки src:
+    python -m etl.genres --chunk-size 500 --concurrency 4
+    python -m etl.genres --elastic-url http://localhost:9200 --redis-url redis://localhost:6379
+
+Фильмы читаются страницами через point in time + search_after, после каждой страницы
+прогресс сохраняется в файл состояния. Прерванный запуск продолжается с последней страницы.
+После записи ID жанров рассылаются воркерам API, чтобы их фильтры Блума сразу узнали о новых жанрах.
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from redis.asyncio import Redis
+
+from etl.bulk import BULK_CHUNK_SIZE, BULK_CONCURRENCY, bulk_write, ensure_index
+from etl.existence import ExistenceNotifier
+from etl.state import BaseStateStorage, JsonFileStorage
+
+logger = logging.getLogger(__name__)
+
+MOVIES_INDEX = 'movies'
+GENRES_INDEX = 'genres'
+
+SCAN_PAGE_SIZE = 1000
+PIT_KEEP_ALIVE = '5m'
+STATE_FILE = 'etl_genres_state.json'
+
+# ID жанра выводится из названия, чтобы повторные запуски обновляли те же документы
+GENRE_ID_NAMESPACE = uuid.UUID('5f0c6b8e-3c39-4b7e-9a55-0d5b2f1e6a41')
+
+GENRES_INDEX_BODY = {
+    'mappings': {
+        'dynamic': 'strict',
+        'properties': {
+            'id': {'type': 'keyword'},
+            'name': {'type': 'text', 'fields': {'raw': {'type': 'keyword'}}},
+            'film_count': {'type': 'integer'},
+            'created': {'type': 'date'},
+            'modified': {'type': 'date'},
+        },
+    },
+}
+
+# Фазы запуска, сохраняются в файле состояния
+PHASE_SCAN = 'scan'
+PHASE_WRITE = 'write'
+
+
+class EtlReport(NamedTuple):
+    scanned: int
+    written: int
+    scan_seconds: float
+    write_seconds: float
+    resumed: bool
+
+    @property
+    def scan_docs_per_second(self) -> float:
+        return self.scanned / self.scan_seconds if self.scan_seconds else 0.0
+
+    @property
+    def write_docs_per_second(self) -> float:
+        return self.written / self.write_seconds if self.write_seconds else 0.0
+
+
+def genre_id(name: str) -> str:
+    return str(uuid.uuid5(GENRE_ID_NAMESPACE, name.lower()))
+
+
+def genre_key(name: str) -> str:
+    # "Sci-Fi", "sci-fi" и " Sci-Fi " - один жанр: по этому ключу считаются фильмы и строится ID документа
+    return ' '.join(name.split()).lower()
+
+
+async def _open_point_in_time(client: AsyncElasticsearch) -> str:
+    response = await client.open_point_in_time(index=MOVIES_INDEX, keep_alive=PIT_KEEP_ALIVE)
+    return response['id']
+
+
+async def scan_movies(
+        client: AsyncElasticsearch,
+        storage: BaseStateStorage,
+        state: dict,
+        page_size: int = SCAN_PAGE_SIZE,
+) -> int:
+    """
+    Досчитывает жанры по фильмам, начиная с сохранённого search_after, и возвращает число прочитанных фильмов.
+
+    В памяти одновременно лежат только одна страница фильмов и счётчики жанров.
+    """
+    scanned = 0
+    pit_id = state.get('pit_id') or await _open_point_in_time(client)
+    while True:
+        body = {
+            'size': page_size,
+            # Сортировка по уникальному id, а не по _shard_doc, чтобы продолжить обход и в новом point in time
+            'sort': [{'id': 'asc'}],
+            '_source': ['genres'],
+            'pit': {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE},
+        }
+        if state.get('search_after'):
+            body['search_after'] = state['search_after']
+
+        try:
+            response = await client.search(body=body)
+        except NotFoundError:
+            # Point in time истёк, пока запуск стоял: документы до search_after уже учтены
+            logger.info('Point in time for %s expired, opening a new one', MOVIES_INDEX)
+            pit_id = await _open_point_in_time(client)
+            continue
+
+        hits = response['hits']['hits']
+        if not hits:
+            break
+
+        # Счётчики по нормализованному ключу, а название жанра - в том виде, в котором оно встретилось первым
+        genres, names = state['genres'], state.setdefault('names', {})
+        for hit in hits:
+            for name in hit['_source'].get('genres') or []:
+                key = genre_key(name)
+                if key:
+                    names.setdefault(key, ' '.join(name.split()))
+                    genres[key] = genres.get(key, 0) + 1
+
+        pit_id = response.get('pit_id', pit_id)
+        scanned += len(hits)
+        state['scanned'] += len(hits)
+        state['search_after'] = hits[-1]['sort']
+        state['pit_id'] = pit_id
+        storage.save(state)
+        logger.debug('Scanned %s films, %s genres so far', state['scanned'], len(genres))
+
+    try:
+        await client.close_point_in_time(body={'id': pit_id})
+    except NotFoundError:
+        pass
+
+    state['phase'] = PHASE_WRITE
+    state.pop('pit_id', None)
+    storage.save(state)
+    return scanned
+
+
+async def write_genres(
+        client: AsyncElasticsearch,
+        genres: dict[str, int],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        concurrency: int = BULK_CONCURRENCY,
+        names: Optional[dict[str, str]] = None,
+) -> int:
+    """
+    Записывает жанры в индекс genres и возвращает число записанных документов.
+
+    genres - число фильмов по ключу жанра (genre_key), names - название жанра по тому же ключу.
+    Запись идемпотентна: upsert по ID из названия сохраняет created у существующих жанров.
+    """
+    await ensure_index(client, GENRES_INDEX, GENRES_INDEX_BODY)
+
+    names = names or {}
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    actions = (
+        {
+            '_op_type': 'update',
+            '_index': GENRES_INDEX,
+            '_id': genre_id(key),
+            'doc': {'name': names.get(key, key), 'film_count': film_count, 'modified': now},
+            'upsert': {'id': genre_id(key), 'name': names.get(key, key), 'film_count': film_count,
+                       'created': now, 'modified': now},
+        }
+        for key, film_count in genres.items()
+    )
+    return await bulk_write(client, actions, chunk_size, concurrency)
+
+
+async def run(
+        client: AsyncElasticsearch,
+        storage: BaseStateStorage,
+        page_size: int = SCAN_PAGE_SIZE,
+        chunk_size: int = BULK_CHUNK_SIZE,
+        concurrency: int = BULK_CONCURRENCY,
+        notify: Optional[Callable[[list[str]], Awaitable]] = None,
+) -> EtlReport:
+    state = storage.load()
+    resumed = bool(state)
+    if not state:
+        state = {'phase': PHASE_SCAN, 'search_after': None, 'genres': {}, 'scanned': 0}
+
+    started = time.perf_counter()
+    scanned = 0
+    if state['phase'] == PHASE_SCAN:
+        scanned = await scan_movies(client, storage, state, page_size)
+    scan_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    written = await write_genres(client, state['genres'], chunk_size, concurrency, names=state.get('names'))
+    # Состояние ещё не удалено: если рассылка не удалась, повторный запуск перезапишет жанры и разошлёт их снова
+    if notify is not None:
+        await notify([genre_id(key) for key in state['genres']])
+    write_seconds = time.perf_counter() - started
+
+    # Запуск завершён, следующий начнёт обход заново
+    storage.clear()
+    return EtlReport(scanned, written, scan_seconds, write_seconds, resumed)
+
+
+async def main(args: argparse.Namespace):
+    # Настройки нужны, только если адреса не переданы явно
+    settings = None
+    if not (args.elastic_url and args.redis_url):
+        from core.config import get_settings
+
+        settings = get_settings()
+
+    client = AsyncElasticsearch(hosts=[args.elastic_url or f'{settings.elastic_host}:{settings.elastic_port}'])
+    redis = Redis.from_url(args.redis_url) if args.redis_url else Redis(host=settings.redis_host, port=settings.redis_port)
+    try:
+        report = await run(
+            client,
+            JsonFileStorage(args.state_file),
+            page_size=args.page_size,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            notify=ExistenceNotifier(redis, GENRES_INDEX),
+        )
+    finally:
+        await redis.close()
+        await client.close()
+
+    print(
+        f'{"resumed" if report.resumed else "started"} run: '
+        f'scanned {report.scanned} films in {report.scan_seconds:.2f}s ({report.scan_docs_per_second:.0f} docs/s), '
+        f'wrote {report.written} genres in {report.write_seconds:.2f}s ({report.write_docs_per_second:.0f} docs/s)'
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--elastic-url', help='Elasticsearch url, by default ELASTIC_HOST:ELASTIC_PORT from settings')
+    parser.add_argument('--redis-url', help='Redis url for broadcasting new genre ids, by default REDIS_HOST:REDIS_PORT from settings')
+    parser.add_argument('--state-file', default=STATE_FILE)
+    parser.add_argument('--page-size', type=int, default=SCAN_PAGE_SIZE)
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument('--concurrency', type=int, default=BULK_CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
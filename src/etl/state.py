@@ -0,0 +1,65 @@
+import json
+import os
+from abc import ABC, abstractmethod
+
+
+class BaseStateStorage(ABC):
+    """Хранилище состояния ETL: контрольная точка или отметка времени, с которой продолжать следующий запуск."""
+
+    @abstractmethod
+    def load(self) -> dict:
+        pass
+
+    @abstractmethod
+    def save(self, state: dict):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class JsonFileStorage(BaseStateStorage):
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict:
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, state: dict):
+        # Пишем во временный файл и подменяем, чтобы прерванная запись не испортила контрольную точку
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RedisStorage(BaseStateStorage):
+    """Состояние в ключе Redis, чтобы его видели запуски ETL с разных машин."""
+
+    def __init__(self, redis, key: str):
+        # Синхронный клиент redis.Redis
+        self.redis = redis
+        self.key = key
+
+    def load(self) -> dict:
+        data = self.redis.get(self.key)
+        return json.loads(data) if data else {}
+
+    def save(self, state: dict):
+        self.redis.set(self.key, json.dumps(state))
+
+    def clear(self):
+        self.redis.delete(self.key)
@@ -0,0 +1,12 @@
+# Настройки gunicorn, файл подхватывается из рабочего каталога (см. Dockerfile)
+from core.metrics import clear_multiprocess_dir, mark_process_dead
+
+
+def on_starting(server):
+    # Каталог метрик Prometheus общий для воркеров, очищаем его один раз в master до их запуска
+    clear_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    # Упавший воркер не проходит lifespan shutdown, его gauge убираем из master
+    mark_process_dead(worker.pid)
@@ -1,30 +1,110 @@
+import asyncio
 import logging
 
 import uvicorn
-from elasticsearch import AsyncElasticsearch
 from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
 from redis.asyncio import Redis
 
-from api.v1 import films, persons
+from api import metrics as metrics_api
+from api.v1 import films, persons, genre, stats, suggest
 from core import config
+from core.circuit_breaker import CircuitOpenError, circuit_open_handler
+from core.compression import CompressionMiddleware, available_encodings
 from core.logger import LOGGING
+from core.metrics import MetricsMiddleware, mark_process_dead, monitor_event_loop_lag
+from core.profiling import ProfiledORJSONResponse, ProfilingMiddleware
+from core.response_cache import RESPONSE_LAST_KNOWN_GOOD_EXPIRE_IN_SECONDS, ResponseCacheMiddleware
 from db.implementation import search_engine
 from db.implementation import cache
+from db.implementation.existence import get_existence_index
+from db.implementation.genre_dictionary import get_genre_dictionary
+from db.implementation.popularity import get_popularity_tracker
+from db.implementation.suggest_index import get_suggest_index
+from db.implementation.pools import (create_elasticsearch, create_redis_pool, elasticsearch_pool_stats,
+                                     redis_pool_stats, warm_up_elasticsearch, warm_up_redis)
 
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
-from core.config import Settings
+from core.config import get_settings
+from core.stats import register_stats
+from services.warmup import get_cache_warmer
 
-settings = Settings()
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Кодировки сжатых вариантов ответов в кеше ответов, их же прогревает services.warmup
+response_encodings = available_encodings() if settings.compression_enabled else ()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    cache.redis = Redis(host=settings.redis_host, port=settings.redis_port)
-    search_engine.es = AsyncElasticsearch(hosts=[f'{settings.elastic_host}:{settings.elastic_port}'])
-    
+    # Пулы соединений настраиваются через Settings, см. db.implementation.pools
+    cache.redis = Redis(connection_pool=create_redis_pool(settings))
+    search_engine.es = create_elasticsearch(settings)
+    register_stats('pool.redis', lambda: redis_pool_stats(cache.redis))
+    register_stats('pool.elasticsearch', lambda: elasticsearch_pool_stats(search_engine.es))
+
+    # Соединения открываем заранее и параллельно, чтобы первые запросы после старта не ждали их открытия
+    warm_ups = [warm_up_redis(cache.redis, settings.pool_warmup_connections)]
+    if settings.search_engine_backend == 'elasticsearch':
+        warm_ups.append(warm_up_elasticsearch(search_engine.es, settings.pool_warmup_connections))
+    await asyncio.gather(*warm_ups)
+
+    # Воркеры сообщают друг другу об изменённых ключах, чтобы L1 кеш не отдавал устаревшие данные
+    invalidation_listener = None
+    cache_storage = cache.get_cache()
+    if isinstance(cache_storage, cache.TwoTierCacheRepository):
+        invalidation_listener = asyncio.create_task(cache_storage.listen_invalidations())
+
+    # Фильтры Блума строятся в фоне, до готовности они ничего не отсекают и старт не задерживают
+    existence_tasks = [
+        asyncio.create_task(existence.run())
+        for existence in map(get_existence_index, settings.bloom_indexes)
+        if existence is not None
+    ]
+
+    # Жанров мало и они редко меняются, поэтому держим их в памяти и отвечаем без Redis и Elasticsearch
+    genre_dictionary = get_genre_dictionary()
+    try:
+        await genre_dictionary.refresh()
+    except Exception:
+        logger.exception('genre dictionary initial load failed')
+    genre_dictionary_task = asyncio.create_task(genre_dictionary.run())
+
+    background_tasks = [genre_dictionary_task, *existence_tasks]
+    # Индекс подсказок тоже строится в фоне: пока он не готов, /suggest отвечает 503
+    if settings.suggest_enabled:
+        background_tasks.append(asyncio.create_task(get_suggest_index().run()))
+    if settings.metrics_enabled:
+        background_tasks.append(asyncio.create_task(monitor_event_loop_lag(settings.event_loop_lag_interval)))
+
+    # Счётчики популярности копятся в памяти и раз в несколько секунд уходят в Redis
+    popularity = get_popularity_tracker()
+    if popularity is not None:
+        background_tasks.append(asyncio.create_task(popularity.run()))
+    # Прогрев кеша популярными ключами - сразу и по таймеру, в фоне: старт его не ждёт
+    warmer = get_cache_warmer(app, response_encodings)
+    if warmer is not None:
+        background_tasks.append(asyncio.create_task(warmer.run()))
+
     yield
-    
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    mark_process_dead()
+
+    # Счётчики, накопленные после последнего сброса
+    if popularity is not None:
+        try:
+            await popularity.flush()
+        except Exception:
+            logger.exception('popularity flush on shutdown failed')
+
+    if invalidation_listener:
+        invalidation_listener.cancel()
+        with suppress(asyncio.CancelledError):
+            await invalidation_listener
+
     await cache.redis.close()
     await search_engine.es.close()
 
@@ -32,10 +112,13 @@ app = FastAPI(
     title=settings.project_name,
     docs_url='/api/openapi',
     openapi_url='/api/openapi.json',
-    default_response_class=ORJSONResponse,
+    default_response_class=ProfiledORJSONResponse,
     lifespan=lifespan
 )
 
+# Пока circuit breaker не пускает запросы в Elasticsearch, ручки без последней известной копии отвечают 503
+app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+
 #@app.on_event('startup')
 #async def startup():
     # Подключаемся к базам при старте сервера
@@ -51,10 +134,51 @@ app = FastAPI(
 #    await redis.redis.close()
 #    await elastic.es.close()
 
-# Подключаем роутер к серверу, указав префикс /v1/films
+# Кешируем готовые ответы списочных ручек, чтобы повторяющиеся запросы не ходили в Elasticsearch
+app.add_middleware(
+    ResponseCacheMiddleware,
+    cache=cache.get_cache(),
+    routes={
+        '/api/v1/films': films.FILMS_LIST_CACHED_ROUTE,
+        '/api/v1/films/search': films.FILMS_SEARCH_CACHED_ROUTE,
+        '/api/v1/persons': persons.PERSONS_LIST_CACHED_ROUTE,
+        '/api/v1/persons/search': persons.PERSONS_SEARCH_CACHED_ROUTE,
+        '/api/v1/genres': genre.GENRES_LIST_CACHE_EXPIRE_IN_SECONDS,
+    },
+    encodings=response_encodings,
+    minimum_size=settings.compression_minimum_size,
+    stale_expire=RESPONSE_LAST_KNOWN_GOOD_EXPIRE_IN_SECONDS if settings.circuit_breaker_enabled else 0,
+    popularity=get_popularity_tracker(),
+)
+
+# Сжатие снаружи кеша ответов: кеш сам отдаёт сжатые варианты, а middleware сжимает остальные ответы
+if settings.compression_enabled:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+
+# Профилировщик внутри метрик, но снаружи кеша ответов, чтобы в профиль попадало чтение из кеша
+if settings.profiling_token or settings.profiling_sample_rate > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        token=settings.profiling_token,
+        sample_rate=settings.profiling_sample_rate,
+        interval=settings.profiling_interval,
+        output_dir=settings.profiling_output_dir,
+    )
+
+# Метрики добавляем последними, чтобы middleware был внешним и учитывал время всех остальных, включая кеш ответов
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_api.router, tags=['metrics'])
+
+# Подключаем роутеры к серверу, указав префикс /api/v1 - пути ресурсов (/films, /persons, /genres) заданы в самих роутерах
 # Теги указываем для удобства навигации по документации
-app.include_router(films.router, prefix='/api/v1/films', tags=['films-api'])
-app.include_router(persons.router, prefix='/api/v1/persons', tags=['persons-api'])
+app.include_router(films.router, prefix='/api/v1', tags=['films-api'])
+app.include_router(persons.router, prefix='/api/v1', tags=['persons-api'])
+app.include_router(genre.router, prefix='/api/v1', tags=['genres-api'])
+if settings.stats_token:
+    app.include_router(stats.router, prefix='/api/v1', tags=['stats-api'])
+if settings.suggest_enabled:
+    app.include_router(suggest.router, prefix='/api/v1', tags=['suggest-api'])
 
 if __name__ == '__main__':
     uvicorn.run(
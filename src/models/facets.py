@@ -0,0 +1,24 @@
+from typing import List
+from models.orjson import BaseOrjsonModel
+
+# Значение фасета (жанр или тип фильма) и число фильмов с ним
+class TermFacet(BaseOrjsonModel):
+    value: str
+    count: int
+
+# Корзина рейтинга: фильмы с рейтингом от rating включительно до rating + шаг гистограммы
+class RatingFacet(BaseOrjsonModel):
+    rating: float
+    count: int
+
+class YearFacet(BaseOrjsonModel):
+    year: int
+    count: int
+
+# Фасеты фильмов, подходящих под фильтры списка: сколько фильмов останется, если добавить ещё одно условие
+class FilmFacets(BaseOrjsonModel):
+    total: int
+    genres: List[TermFacet]
+    types: List[TermFacet]
+    ratings: List[RatingFacet]
+    years: List[YearFacet]
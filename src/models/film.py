@@ -3,16 +3,19 @@ import datetime
 from typing import List
 from models.orjson import BaseOrjsonModel
 
+# Персона внутри документа фильма (nested поля actors, directors, screenwriters индекса movies)
+class FilmPerson(BaseOrjsonModel):
+    id: str
+    name: str
+
 class Film(BaseOrjsonModel):
-    id: uuid
+    id: uuid.UUID
     title: str
     description: str
-    creation_date: datetime
+    creation_date: datetime.datetime
     rating: float
     type: str
     genres: List[str]
-    actors: List[str]
-    directors = List[str]
-    screenwriters = List[str]
-        
-        
\ No newline at end of file
+    actors: List[FilmPerson]
+    directors: List[FilmPerson]
+    screenwriters: List[FilmPerson]
@@ -3,7 +3,9 @@ import datetime
 from models.orjson import BaseOrjsonModel
 
 class Genre(BaseOrjsonModel):
-    id: uuid
+    id: uuid.UUID
     name: str
-    created: datetime
-    modified: datetime
\ No newline at end of file
+    created: datetime.datetime
+    modified: datetime.datetime
+    # Число фильмов жанра, считается ETL при построении индекса genres
+    film_count: int = 0
@@ -1,11 +1,17 @@
 import uuid
 import datetime
+from typing import List
 from models.orjson import BaseOrjsonModel
 
+# Фильм персоны и её роли в нём, заполняются ETL индекса persons
+class PersonFilm(BaseOrjsonModel):
+    id: str
+    roles: List[str]
+
 class Person(BaseOrjsonModel):
-    id: uuid
+    id: uuid.UUID
     full_name: str
     gender: str
-    created: datetime
-    modified: datetime
-   
\ No newline at end of file
+    created: datetime.datetime
+    modified: datetime.datetime
+    films: List[PersonFilm] = []
@@ -0,0 +1,49 @@
+from functools import lru_cache
+from typing import Optional, get_type_hints
+
+from pydantic import BaseModel, create_model
+
+from models.orjson import BaseOrjsonModel
+
+# Поле, которое есть в любой проекции: без него клиент не сопоставит документ
+PROJECTION_REQUIRED_FIELDS = ('id',)
+
+
+def model_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(getattr(model, 'model_fields', None) or model.__fields__)
+
+
+def parse_fields(fields: Optional[str], model: type[BaseModel]) -> Optional[tuple[str, ...]]:
+    """
+    Разбирает параметр fields=id,title,rating в отсортированный кортеж полей модели.
+
+    None - поля не заданы, нужен документ целиком. Неизвестные поля - ValueError.
+    """
+    if not fields:
+        return None
+
+    requested = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = requested - set(model_fields(model))
+    if unknown:
+        raise ValueError(f'unsupported fields: {", ".join(sorted(unknown))}')
+
+    return tuple(sorted(requested.union(PROJECTION_REQUIRED_FIELDS)))
+
+
+@lru_cache()
+def projection_model(model: type[BaseModel], fields: tuple[str, ...]) -> type[BaseOrjsonModel]:
+    """Модель только с полями fields: валидирует и сериализует меньше, чем полная модель."""
+    hints = get_type_hints(model)
+    return create_model(
+        f'{model.__name__}Projection',
+        __base__=BaseOrjsonModel,
+        **{name: (Optional[hints[name]], None) for name in fields},
+    )
+
+
+def project(doc: BaseModel, fields: Optional[tuple[str, ...]]) -> BaseModel:
+    """Проекция уже загруженного документа: значения уже проверены, поэтому без повторной валидации."""
+    if fields is None:
+        return doc
+
+    return projection_model(type(doc), fields).construct(**{name: getattr(doc, name) for name in fields})
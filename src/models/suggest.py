@@ -0,0 +1,13 @@
+from typing import List
+from models.orjson import BaseOrjsonModel
+
+# Подсказка поисковой строки: ID и название фильма или имя персоны
+class Suggestion(BaseOrjsonModel):
+    id: str
+    text: str
+    # Рейтинг фильма или число фильмов персоны, по нему отсортированы подсказки
+    score: float
+
+class Suggestions(BaseOrjsonModel):
+    films: List[Suggestion]
+    persons: List[Suggestion]
@@ -0,0 +1,301 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from elasticsearch import NotFoundError
+
+from core.circuit_breaker import CircuitOpenError, last_known_good_key
+from core.http_cache import model_etag
+from core.metrics import CACHE_REQUESTS
+from core.profiling import profiled
+from core.single_flight import SingleFlight
+from core.stats import register_stats
+from core.swr import Freshness, StaleWhileRevalidate
+from db.abstract.cache import AsyncCacheStorage, CacheEnvelope
+from db.abstract.search_engine import AsyncSearchEngine
+from db.implementation.existence import ExistenceIndex
+from db.implementation.popularity import PopularityTracker
+from models.orjson import BaseOrjsonModel
+
+logger = logging.getLogger(__name__)
+
+# Документов на страницу point in time при выгрузке индекса целиком
+EXPORT_PAGE_SIZE = 1000
+
+# Ключ с ETag документа рядом с самим документом: по нему отвечаем 304, не читая документ
+ETAG_KEY_PREFIX = 'etag'
+
+
+# Сколько хранится последняя известная копия документа, см. core.circuit_breaker
+LAST_KNOWN_GOOD_EXPIRE_IN_SECONDS = 60 * 60 * 24  # 1 сутки
+
+
+def etag_key(doc_id: str) -> str:
+    return f'{ETAG_KEY_PREFIX}:{doc_id}'
+
+
+def document_cache_keys(doc_id: str) -> list[str]:
+    # Все ключи документа в кеше: сам документ, его ETag и последняя известная копия
+    return [doc_id, etag_key(doc_id), last_known_good_key(doc_id)]
+
+
+class BaseService:
+    """
+    Общая логика получения документа по ID: кеш -> Elasticsearch -> кеш.
+
+    Наследники задают индекс Elasticsearch, модель и время жизни кеша.
+    После cache_expire документ ещё cache_stale_expire секунд отдаётся из кеша, пока обновляется в фоне.
+    Копия документа хранится ещё last_known_good_expire секунд отдельным ключом: если Elasticsearch недоступен
+    (CircuitOpenError), отдаём её; без копии CircuitOpenError уходит дальше и ручка отвечает 503.
+    """
+
+    index: str
+    model: type[BaseOrjsonModel]
+    cache_expire: int
+    cache_stale_expire: int = 60 * 5  # 5 минут
+    last_known_good_expire: int = LAST_KNOWN_GOOD_EXPIRE_IN_SECONDS
+
+    def __init__(
+            self,
+            cache: AsyncCacheStorage,
+            search_engine: AsyncSearchEngine,
+            single_flight: Optional[SingleFlight] = None,
+            existence: Optional[ExistenceIndex] = None,
+            popularity: Optional[PopularityTracker] = None,
+    ):
+        self.cache = cache
+        self.search_engine = search_engine
+        # Фильтр Блума по ID индекса: если ID точно нет, не ходим ни в кеш, ни в Elasticsearch
+        self.existence = existence
+        # Счётчики обращений к документам, по ним прогрев кеша выбирает самые популярные (см. services.warmup)
+        self.popularity = popularity
+        # Одновременные промахи кеша по одному ID идут в Elasticsearch один раз
+        self.single_flight = single_flight or SingleFlight(self.index)
+        register_stats(f'single_flight.{self.index}', self.single_flight.stats)
+
+        self.swr = StaleWhileRevalidate(self.cache_expire, self.cache_stale_expire)
+        register_stats(f'swr.{self.index}', self.swr.stats)
+        self._cache_hits = CACHE_REQUESTS.labels(self.index, 'hit')
+        self._cache_misses = CACHE_REQUESTS.labels(self.index, 'miss')
+        self._last_known_good_served = CACHE_REQUESTS.labels(self.index, 'last_known_good')
+        # Ссылки на фоновые обновления, иначе задачи может собрать сборщик мусора
+        self._refresh_tasks: set[asyncio.Task] = set()
+
+    # get_by_id возвращает объект модели. Он опционален, так как документ может отсутствовать в базе
+    async def get_by_id(self, doc_id: str) -> Optional[BaseOrjsonModel]:
+        if self._definitely_absent(doc_id):
+            return None
+
+        # Пытаемся получить данные из кеша, потому что оно работает быстрее
+        doc = await self._from_cache(doc_id)
+        if not doc:
+            doc = await self.single_flight.do(
+                doc_id,
+                lambda: self._load_by_id(doc_id),
+                recheck=lambda: self._from_cache(doc_id),
+            )
+
+        # Считаем только найденные документы, чтобы несуществующие ID не попадали в прогрев
+        if doc:
+            self._record_hit(doc_id)
+        return doc
+
+    # get_many возвращает документы в порядке ids, на месте отсутствующих в базе документов - None
+    async def get_many(self, doc_ids: list[str]) -> list[Optional[BaseOrjsonModel]]:
+        unique_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if not self._definitely_absent(doc_id)]
+
+        # Все закешированные документы получаем одним MGET
+        cached = await self.cache.get_many(unique_ids, model=self.model)
+        docs = {doc_id: self._unwrap(doc_id, doc) for doc_id, doc in zip(unique_ids, cached) if doc}
+        self._cache_hits.inc(len(docs))
+        self._cache_misses.inc(len(unique_ids) - len(docs))
+
+        # Промахи кеша запрашиваем в Elasticsearch одним mget и одним пайплайном кладём в кеш
+        missing = [doc_id for doc_id in unique_ids if doc_id not in docs]
+        if missing:
+            started = time.monotonic()
+            try:
+                loaded = await self._get_many_from_elastic(missing)
+            except CircuitOpenError as error:
+                docs.update(await self._from_last_known_good(missing, error))
+                return [docs.get(doc_id) for doc_id in doc_ids]
+            delta = (time.monotonic() - started) / len(missing)
+
+            envelopes = {}
+            expire = 0
+            for doc_id, doc in loaded.items():
+                envelopes[doc_id], doc_expire = self.swr.wrap(doc, delta)
+                envelopes[etag_key(doc_id)] = self.etag(doc)
+                expire = max(expire, doc_expire)
+            await asyncio.gather(self.cache.set_many(envelopes, expire), self._put_last_known_good(loaded))
+            docs.update(loaded)
+
+        return [docs.get(doc_id) for doc_id in doc_ids]
+
+    async def get_etag(self, doc_id: str, doc: Optional[BaseOrjsonModel] = None) -> Optional[str]:
+        """
+        ETag документа из кеша без чтения самого документа, None - документа в кеше нет.
+
+        С уже загруженным doc ETag тоже берётся из кеша, где он лежит рядом с документом, и считается заново,
+        только если ключа нет (например, документ отдан из last known good).
+        """
+        if doc is None and self._definitely_absent(doc_id):
+            return None
+
+        etag = await self.cache.get(etag_key(doc_id))
+        if etag is None and doc is not None:
+            return self.etag(doc)
+        return etag.decode() if isinstance(etag, bytes) else etag
+
+    async def revalidate(self, doc_id: str) -> bool:
+        """
+        Ответ 304 вместо документа: обращение засчитывается, как при полном ответе. False - документа в кеше уже нет.
+
+        Свежесть проверяется по закешированному документу: устаревший обновляется в фоне, иначе клиенты
+        с актуальным ETag так и получали бы 304 по старой копии, не давая ей обновиться.
+        """
+        if not await self._from_cache(doc_id):
+            return False
+        self._record_hit(doc_id)
+        return True
+
+    @staticmethod
+    def etag(doc: BaseOrjsonModel) -> str:
+        return model_etag(doc)
+
+    async def export(self, modified_since: Optional[datetime.datetime] = None) -> AsyncIterator[dict]:
+        """
+        Все документы индекса как есть, без построения моделей, для выгрузки каталога.
+
+        Обход идёт через point in time страницами по EXPORT_PAGE_SIZE, поэтому в памяти только одна страница.
+        modified_since оставляет документы, изменённые начиная с этого времени (выгрузка изменений).
+        """
+        query = {'range': {'modified': {'gte': modified_since.isoformat()}}} if modified_since else None
+        async for hit in self.search_engine.scan_stream(self.index, query, page_size=EXPORT_PAGE_SIZE):
+            yield hit['_source']
+
+    def _record_hit(self, doc_id: str):
+        if self.popularity is not None:
+            self.popularity.hit(self.index, doc_id)
+
+    def _definitely_absent(self, doc_id: str) -> bool:
+        return self.existence is not None and self.existence.definitely_absent(doc_id)
+
+    async def _mark_existing(self, doc_id: str):
+        # Новый документ должен сразу попасть в фильтр Блума, иначе get_by_id ответит по нему 404
+        if self.existence is not None:
+            await self.existence.add(doc_id)
+
+    # overwrite=True - документ обновляется поверх закешированного, и его копии в L1 других воркеров нужно сбросить
+    async def _load_by_id(self, doc_id: str, overwrite: bool = False) -> Optional[BaseOrjsonModel]:
+        # Если документа нет в кеше, то ищем его в Elasticsearch
+        started = time.monotonic()
+        try:
+            doc = await self._get_from_elastic(doc_id)
+        except CircuitOpenError as error:
+            # Копию из last known good в основной кеш не кладём: после восстановления документ загрузится заново
+            return (await self._from_last_known_good([doc_id], error))[doc_id]
+        if not doc:
+            # Если он отсутствует в Elasticsearch, значит, документа вообще нет в базе
+            return None
+        # Сохраняем документ в кеш вместе со временем, которое заняла загрузка
+        await self._put_to_cache(doc, time.monotonic() - started, overwrite=overwrite)
+
+        return doc
+
+    def _unwrap(self, doc_id: str, cached) -> BaseOrjsonModel:
+        if not isinstance(cached, CacheEnvelope):
+            return cached
+
+        # Устаревшее или почти устаревшее значение отдаём сразу, а обновляем его в фоне
+        if self.swr.check(cached) != Freshness.FRESH:
+            self._schedule_refresh(doc_id)
+        return cached.value
+
+    def _schedule_refresh(self, doc_id: str):
+        task = asyncio.create_task(self._refresh(doc_id))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh(self, doc_id: str):
+        try:
+            # single flight не даёт нескольким запросам обновлять один документ одновременно
+            doc = await self.single_flight.do(doc_id, lambda: self._load_by_id(doc_id, overwrite=True))
+            if doc is None:
+                # Документ удалили из Elasticsearch - устаревшую копию, её ETag и последнюю известную копию больше не отдаём
+                await asyncio.gather(*(self.cache.delete(key) for key in document_cache_keys(doc_id)))
+            self.swr.refreshes += 1
+        except CircuitOpenError:
+            # Elasticsearch недоступен, а копии документа нет: устаревшее значение пока остаётся в кеше
+            self.swr.refresh_errors += 1
+        except Exception:
+            self.swr.refresh_errors += 1
+            logger.exception('background refresh failed for %s/%s', self.index, doc_id)
+
+    async def _get_from_elastic(self, doc_id: str) -> Optional[BaseOrjsonModel]:
+        try:
+            doc = await self.search_engine.get(index=self.index, id=doc_id)
+        except NotFoundError:
+            return None
+        return self._build(doc['_source'])
+
+    async def _get_many_from_elastic(self, doc_ids: list[str]) -> dict[str, BaseOrjsonModel]:
+        docs = await self.search_engine.mget(index=self.index, ids=doc_ids)
+        return {doc['_id']: self._build(doc['_source']) for doc in docs if doc.get('found')}
+
+    @profiled('validation')
+    def _build(self, source: dict) -> BaseOrjsonModel:
+        return self.model(**source)
+
+    async def _from_cache(self, doc_id: str) -> Optional[BaseOrjsonModel]:
+        # Пытаемся получить данные из кеша, используя команду get
+        # https://redis.io/commands/get/
+        # Хранилище само декодирует данные в модель, а L1 кеш отдаёт уже готовый объект
+        cached = await self.cache.get(doc_id, model=self.model)
+        if not cached:
+            self._cache_misses.inc()
+            return None
+
+        self._cache_hits.inc()
+
+        return self._unwrap(doc_id, cached)
+
+    async def _put_to_cache(self, doc: BaseOrjsonModel, delta: float = 0.0, overwrite: bool = False):
+        # Сохраняем данные, используя команду set
+        # https://redis.io/commands/set/
+        # Модель сериализует само хранилище, чтобы L1 кеш мог сохранить объект без повторного декодирования.
+        # Ключ живёт в Redis дольше мягкого срока, чтобы устаревшее значение можно было отдать во время обновления
+        # ETag документа кладём тем же пайплайном и с тем же временем жизни
+        # Последняя известная копия пишется параллельно отдельным пайплайном: у неё своё время жизни
+        envelope, expire = self.swr.wrap(doc, delta)
+        doc_id = str(doc.id)
+        await asyncio.gather(
+            self.cache.set_many({doc_id: envelope, etag_key(doc_id): self.etag(doc)}, expire, overwrite=overwrite),
+            self._put_last_known_good({doc_id: doc}),
+        )
+
+    async def _put_last_known_good(self, docs: dict[str, BaseOrjsonModel]):
+        # Копии читаются только при недоступном Elasticsearch, поэтому держим их в Redis, но не в L1 кеше процесса
+        if self.last_known_good_expire and docs:
+            await self.cache.set_many(
+                {last_known_good_key(doc_id): doc for doc_id, doc in docs.items()},
+                self.last_known_good_expire,
+                local=False,
+            )
+
+    async def _from_last_known_good(self, doc_ids: list[str], error: CircuitOpenError) -> dict[str, BaseOrjsonModel]:
+        """Последние известные копии документов; если хотя бы одной нет - исходная CircuitOpenError."""
+        if not self.last_known_good_expire:
+            raise error
+
+        cached = await self.cache.get_many(
+            [last_known_good_key(doc_id) for doc_id in doc_ids], model=self.model, local=False)
+        docs = {doc_id: doc for doc_id, doc in zip(doc_ids, cached) if doc}
+        if len(docs) < len(doc_ids):
+            # Без копии нельзя отличить отсутствующий документ от недоступного, поэтому 503, а не 404
+            raise error
+
+        self._last_known_good_served.inc(len(docs))
+        return docs
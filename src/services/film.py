@@ -1,104 +1,396 @@
+import datetime
 from functools import lru_cache
-from typing import Optional
+from typing import NamedTuple, Optional
 from db.abstract.cache import AsyncCacheStorage
 from db.abstract.search_engine import AsyncSearchEngine
 
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import NotFoundError, RequestError
+import orjson
 from fastapi import Depends
-from redis.asyncio import Redis
 
-from db.implementation.search_engine import SearchEngineRepository
-from db.implementation.cache import MemcachedRepository
+from core.config import get_settings
+from core.cursor import InvalidCursorError, decode_cursor, encode_cursor
+from core.profiling import profiled
+from core.single_flight import SingleFlight
+from db.implementation.search_engine import get_search_engine
+from db.implementation.cache import get_cache
+from db.implementation.existence import get_existence_index
+from db.implementation.popularity import get_popularity_tracker
 
+from models.facets import FilmFacets
 from models.film import Film
-
-# Elastic search docementation with examples - https://elasticsearch-dsl.readthedocs.io/en/latest/search_dsl.html#pagination
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search
+from models.projection import projection_model
+from services.base import BaseService
 
 FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
 
+# Поля API, по которым можно сортировать, и соответствующие им поля индекса movies.
+# Сортировка по тексту идёт по keyword подполю, по description (только text) сортировать нельзя
+FILM_SORT_FIELDS = {
+    'id': 'id',
+    'title': 'title.raw',
+    'rating': 'rating',
+    'type': 'type',
+    'creation_date': 'creation_date',
+}
+
+# Глубже этого смещения from/size не используем, дальше - только курсор (search_after)
+FILMS_MAX_PAGE_OFFSET = 1000
+
+# Сколько Elasticsearch держит point in time между запросами страниц по курсору
+FILMS_PIT_KEEP_ALIVE = '5m'
+
+# Запросы с point in time неявно сортируются ещё и по _shard_doc, и search_after у них на одно значение длиннее.
+# Курсор страницы без point in time продолжаем с наибольшим _shard_doc: id в сортировке уникален, поэтому
+# сам последний документ остаётся позади, а остальные отличаются от него раньше, по id
+PIT_SHARD_DOC_MAX = 2 ** 63 - 1
+
+
+# Роли персоны в фильме и nested поля индекса movies, в которых они хранятся
+FILM_PERSON_ROLES = {
+    'actor': 'actors',
+    'director': 'directors',
+    'screenwriter': 'screenwriters',
+}
+
+# Список ID фильмов персоны кешируем отдельно, сами фильмы берём из кеша фильмов
+PERSON_FILMS_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+PERSON_FILMS_CACHE_KEY_PREFIX = 'person_films'
+# Больше фильмов на одну персону не бывает, это потолок одного запроса в Elasticsearch
+PERSON_FILMS_MAX_RESULTS = 1000
+
+
+# Фасеты кешируем по набору фильтров: это второй по объёму вид запросов, и каждый промах - агрегации по индексу
+FILM_FACETS_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+FILM_FACETS_CACHE_KEY_PREFIX = 'film_facets'
+# Жанров в каталоге несколько десятков, отдаём все; типов фильмов единицы
+FILM_FACETS_GENRES_SIZE = 100
+FILM_FACETS_TYPES_SIZE = 10
+# Шаг гистограммы рейтинга
+FILM_FACETS_RATING_INTERVAL = 1
+
+
+class FilmFilters(NamedTuple):
+    """Фильтры списка фильмов, поиска и фасетов; пустые фильтры - все фильмы."""
+
+    # Фильм хотя бы одного из жанров
+    genres: tuple[str, ...] = ()
+    type: Optional[str] = None
+    rating_min: Optional[float] = None
+    rating_max: Optional[float] = None
+
+    def normalized(self) -> 'FilmFilters':
+        # genre=Drama&genre=Action и genre=Action&genre=Drama - один и тот же набор фильтров
+        return self._replace(genres=tuple(sorted(set(self.genres))))
+
+
+class FilmsPage(NamedTuple):
+    films: list[Film]
+    # Курсор следующей страницы, None - страниц больше нет
+    cursor: Optional[str]
 
-class FilmService:
-    def __init__(self, cache: AsyncCacheStorage, search_engine: AsyncSearchEngine):
-        self.cache = cache
-        self.search_engine = search_engine
-
-    # get_by_id возвращает объект фильма. Он опционален, так как фильм может отсутствовать в базе
-    async def get_by_id(self, film_id: str) -> Optional[Film]:
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        film = await self._film_from_cache(film_id)
-        if not film:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            film = await self._get_film_from_elastic(film_id)
-            if not film:
-                # Если он отсутствует в Elasticsearch, значит, фильма вообще нет в базе
-                return None
-            # Сохраняем фильм  в кеш
-            await self._put_film_to_cache(film)
-
-        return film
-    
-    # get_all возвращает лис объектов фильма или None фильмов может и не быть в базе
-    async def get_all(self, page_size, page_number, query) -> Optional[list]:
+
+class FilmService(BaseService):
+    index = 'movies'
+    model = Film
+    cache_expire = FILM_CACHE_EXPIRE_IN_SECONDS
+
+    # get_all возвращает страницу фильмов или None фильмов может и не быть в базе
+    # Страница задаётся номером (page_number) для первых страниц или курсором предыдущей страницы для любых.
+    # Неверные sort, cursor или слишком глубокий page_number - ValueError.
+    # fields - поля проекции (models.projection.parse_fields): Elasticsearch отдаёт только их
+    async def get_all(
+            self,
+            page_size: int,
+            page_number: int = 1,
+            query: str = "",
+            sort: Optional[str] = None,
+            cursor: Optional[str] = None,
+            fields: Optional[tuple[str, ...]] = None,
+            filters: FilmFilters = FilmFilters(),
+    ) -> Optional[FilmsPage]:
         # Фильмы ищем в Elasticsearch
-        films = await self._get_all_film_from_elastic(page_size, page_number, query)
-        if not films:
+        if cursor:
+            page = await self._get_page_by_cursor_from_elastic(page_size, cursor, fields)
+        else:
+            page = await self._get_page_from_elastic(page_size, page_number, query, sort, fields, filters)
+
+        if not page.films:
             # Если фильмы отсутствуют в Elasticsearch, значит, фильмов вообще нет в базе
             return None
-        
-        return films
 
-    async def _get_film_from_elastic(self, film_id: str) -> Optional[Film]:
-        try:
-            doc = await self.search_engine.get(index='movies', id=film_id)
-        except NotFoundError:
+        return page
+
+    # get_facets возвращает число фильмов по жанрам, типам, рейтингу и годам для тех же query и фильтров, что и get_all.
+    # Все фасеты считаются одним запросом агрегаций без загрузки документов и кешируются по набору фильтров
+    async def get_facets(self, query: str = "", filters: FilmFilters = FilmFilters()) -> FilmFacets:
+        query = ' '.join(query.lower().split())
+        filters = filters.normalized()
+        key = f'{FILM_FACETS_CACHE_KEY_PREFIX}:{orjson.dumps([query, *filters]).decode()}'
+
+        facets = await self._get_facets_from_cache(key)
+        if facets:
+            return facets
+
+        # Одновременные промахи по одному набору фильтров считают агрегации один раз
+        return await self.single_flight.do(
+            key,
+            lambda: self._load_facets(key, query, filters),
+            recheck=lambda: self._get_facets_from_cache(key),
+        )
+
+    async def _get_facets_from_cache(self, key: str) -> Optional[FilmFacets]:
+        data = await self.cache.get(key)
+        if not data:
             return None
-        return Film(**doc['_source'])
-    
-    async def _get_all_film_from_elastic(self, page_size, page_number, query) -> Optional[list]:
-        movies = list
+        return FilmFacets.parse_obj(orjson.loads(data))
+
+    async def _load_facets(self, key: str, query: str, filters: FilmFilters) -> FilmFacets:
+        facets = await self._get_facets_from_elastic(query, filters)
+        await self.cache.set(key, orjson.dumps(facets.dict()), FILM_FACETS_CACHE_EXPIRE_IN_SECONDS)
+        return facets
+
+    async def _get_facets_from_elastic(self, query: str, filters: FilmFilters) -> FilmFacets:
+        # size: 0 - документы не читаются, только агрегации по doc values.
+        # Такие ответы Elasticsearch сам кеширует на шардах (request cache), пока индекс не изменился
+        # https://www.elastic.co/guide/en/elasticsearch/reference/current/shard-request-cache.html
+        body = {
+            'query': self._build_query(query, filters),
+            'size': 0,
+            'track_total_hits': True,
+            'aggs': {
+                'genres': {'terms': {'field': 'genres', 'size': FILM_FACETS_GENRES_SIZE}},
+                'types': {'terms': {'field': 'type', 'size': FILM_FACETS_TYPES_SIZE}},
+                'ratings': {'histogram': {'field': 'rating', 'interval': FILM_FACETS_RATING_INTERVAL,
+                                          'min_doc_count': 1}},
+                'years': {'date_histogram': {'field': 'creation_date', 'calendar_interval': 'year',
+                                             'min_doc_count': 1}},
+            },
+        }
+        response = await self.search_engine.search(index=self.index, body=body, request_cache=True)
+
+        aggregations = response['aggregations']
+        return FilmFacets.parse_obj({
+            'total': response['hits']['total']['value'],
+            'genres': [{'value': bucket['key'], 'count': bucket['doc_count']}
+                       for bucket in aggregations['genres']['buckets']],
+            'types': [{'value': bucket['key'], 'count': bucket['doc_count']}
+                      for bucket in aggregations['types']['buckets']],
+            'ratings': [{'rating': bucket['key'], 'count': bucket['doc_count']}
+                        for bucket in aggregations['ratings']['buckets']],
+            # Ключ корзины date_histogram - начало года в миллисекундах UTC
+            'years': [{'year': datetime.datetime.fromtimestamp(bucket['key'] / 1000, datetime.timezone.utc).year,
+                       'count': bucket['doc_count']}
+                      for bucket in aggregations['years']['buckets']],
+        })
+
+    # get_by_person возвращает страницу фильмов, в которых персона участвовала в одной из ролей
+    async def get_by_person(
+            self,
+            person_id: str,
+            page_size: int,
+            page_number: int = 1,
+            roles: Optional[list[str]] = None,
+    ) -> list[Film]:
+        roles = sorted(set(roles or FILM_PERSON_ROLES))
+        unknown_roles = [role for role in roles if role not in FILM_PERSON_ROLES]
+        if unknown_roles:
+            raise ValueError(f'unsupported roles: {", ".join(unknown_roles)}')
+
+        film_ids = await self._get_person_film_ids(person_id, roles)
 
-        # Разбиение на страницы Python
-        # Статья: https://dev.to/emilossola/a-step-by-step-guide-for-pagination-in-python-1464
         start_index = (page_number - 1) * page_size
-        end_index = page_number * page_size
+        page_ids = film_ids[start_index:start_index + page_size]
 
-        # Документация ElasticSeach - https://elasticsearch-py.readthedocs.io/en/master/api.html
-        # Погинация документация - https://www.elastic.co/guide/en/elasticsearch/reference/current/paginate-search-results.html#paginate-search-results
-        # Поиск по полям класса ElasticSeach - https://stackoverflow.com/questions/37709100/how-do-i-do-a-partial-match-in-elasticsearch 
-        search = Search(using=self.search_engine, index="movies", body= { "from": start_index, "size": end_index, "query": { query } })
+        # Фильмы страницы достаём из кеша одним MGET, промахи - одним mget в Elasticsearch
+        films = await self.get_many(page_ids)
+        return [film for film in films if film]
 
-        # Stack overflow: https://stackoverflow.com/questions/50210299/how-to-get-all-documents-under-an-elasticsearch-index-with-python-client
-        for hit in search.scan():
-            movie = Film(**hit['_source'])
-            movies.append(movie)
+    async def _get_person_film_ids(self, person_id: str, roles: list[str]) -> list[str]:
+        key = f'{PERSON_FILMS_CACHE_KEY_PREFIX}:{person_id}:{",".join(roles)}'
+        data = await self.cache.get(key)
+        if data:
+            return orjson.loads(data)
 
-        return movies
+        film_ids = await self._get_person_film_ids_from_elastic(person_id, roles)
+        await self.cache.set(key, orjson.dumps(film_ids), PERSON_FILMS_CACHE_EXPIRE_IN_SECONDS)
 
-    async def _film_from_cache(self, film_id: str) -> Optional[Film]:
-        # Пытаемся получить данные о фильме из кеша, используя команду get
-        # https://redis.io/commands/get/
-        data = await self.cache.get(film_id)
-        if not data:
-            return None
+        return film_ids
+
+    async def _get_person_film_ids_from_elastic(self, person_id: str, roles: list[str]) -> list[str]:
+        # Один запрос по nested полям ролей вместо перебора всех фильмов в Python.
+        # Документы не загружаем (_source: false), нужны только ID
+        # https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-nested-query.html
+        body = {
+            'query': {
+                'bool': {
+                    'should': [
+                        {'nested': {'path': FILM_PERSON_ROLES[role],
+                                    'query': {'term': {f'{FILM_PERSON_ROLES[role]}.id': person_id}}}}
+                        for role in roles
+                    ],
+                    'minimum_should_match': 1,
+                },
+            },
+            '_source': False,
+            'size': PERSON_FILMS_MAX_RESULTS,
+            'sort': [{'rating': 'desc'}, {'id': 'asc'}],
+        }
+        response = await self.search_engine.search(index=self.index, body=body)
+
+        return [hit['_id'] for hit in response['hits']['hits']]
+
+    async def _get_page_from_elastic(self, page_size, page_number, query, sort, fields, filters) -> FilmsPage:
+        start_index = (page_number - 1) * page_size
+        if start_index + page_size > FILMS_MAX_PAGE_OFFSET:
+            raise ValueError(
+                f'page_number is limited to the first {FILMS_MAX_PAGE_OFFSET} films, use cursor for deeper pages')
+
+        body = {'query': self._build_query(query, filters), 'from': start_index, 'size': page_size}
+        if fields:
+            body['_source'] = list(fields)
+        if not sort:
+            # Поиск без сортировки отдаём по релевантности, курсор для него не строим
+            response = await self.search_engine.search(index=self.index, body=body)
+            return FilmsPage(self._films_from_hits(response, fields), None)
+
+        # Сортировку выполняет Elasticsearch, а не Python после загрузки страницы.
+        # Point in time здесь не открываем: большинство клиентов не идёт дальше первых страниц,
+        # а курсор следующей страницы - просто search_after по значениям сортировки
+        body['sort'] = self._build_sort(sort)
+        response = await self.search_engine.search(index=self.index, body=body)
+        state = {'sort': sort, 'query': query}
+        if filters != FilmFilters():
+            state['filters'] = filters._asdict()
+        return await self._build_page(response, page_size, state, fields)
+
+    async def _get_page_by_cursor_from_elastic(self, page_size, cursor, fields) -> FilmsPage:
+        state = decode_cursor(cursor)
+        sort, after, pit_id = state.get('sort'), state.get('after'), state.get('pit')
+        if not isinstance(sort, str) or not isinstance(after, list) or not isinstance(pit_id, (str, type(None))):
+            raise InvalidCursorError('invalid cursor')
+
+        sort_clause = self._build_sort(sort)
+        # С point in time в search_after есть ещё значение _shard_doc
+        if len(after) != len(sort_clause) + bool(pit_id):
+            raise InvalidCursorError('invalid cursor')
+        try:
+            filters = FilmFilters(**state.get('filters', {}))
+        except TypeError:
+            raise InvalidCursorError('invalid cursor')
+        body = {
+            'query': self._build_query(state.get('query', ''), filters),
+            'size': page_size,
+            'sort': sort_clause,
+            'search_after': after,
+        }
+        if fields:
+            body['_source'] = list(fields)
+
+        opened = not pit_id
+        if opened:
+            # Клиент пошёл дальше первой страницы: дальше обходим один снимок индекса через point in time
+            pit_id = await self.search_engine.open_point_in_time(index=self.index, keep_alive=FILMS_PIT_KEEP_ALIVE)
+            body['search_after'] = after + [PIT_SHARD_DOC_MAX]
+
+        body['pit'] = {'id': pit_id, 'keep_alive': FILMS_PIT_KEEP_ALIVE}
+        try:
+            response = await self._search_by_cursor(body)
+            state['pit'] = response.get('pit_id', pit_id)
+            return await self._build_page(response, page_size, state, fields)
+        except InvalidCursorError:
+            # Только что открытый point in time курсору уже не понадобится
+            if opened:
+                await self._close_point_in_time(pit_id)
+            raise
+        except NotFoundError:
+            # Point in time истёк - продолжаем обход по живому индексу.
+            # Последнее значение search_after - неявный _shard_doc из point in time, без него оно лишнее
+            del body['pit']
+            body['search_after'] = body['search_after'][:len(sort_clause)]
+            state['pit'] = None
+
+        response = await self._search_by_cursor(body)
+        return await self._build_page(response, page_size, state, fields)
+
+    async def _search_by_cursor(self, body: dict) -> dict:
+        try:
+            return await self.search_engine.search(index=self.index, body=body)
+        except RequestError as exc:
+            # Значения search_after или point in time из подделанного курсора - ошибка клиента, а не сервиса
+            raise InvalidCursorError('invalid cursor') from exc
+
+    async def _build_page(self, response: dict, page_size: int, state: dict, fields=None) -> FilmsPage:
+        hits = response['hits']['hits']
+        films = self._films_from_hits(response, fields)
+
+        # Неполная страница - последняя, курсор не нужен, а point in time можно закрыть не дожидаясь keep_alive
+        if len(hits) < page_size:
+            if state.get('pit'):
+                await self._close_point_in_time(state['pit'])
+            return FilmsPage(films, None)
+
+        state['after'] = hits[-1]['sort']
+        return FilmsPage(films, encode_cursor(state))
+
+    async def _close_point_in_time(self, pit_id: str):
+        try:
+            await self.search_engine.close_point_in_time(pit_id)
+        except NotFoundError:
+            pass
+
+    @staticmethod
+    def _build_sort(sort: str) -> list:
+        field = FILM_SORT_FIELDS.get(sort.lstrip('-'))
+        if field is None:
+            raise ValueError(f'unsupported sort field: {sort}')
+
+        order = 'desc' if sort.startswith('-') else 'asc'
+        # id - однозначный тайбрейкер, без него страницы на одинаковых значениях будут пересекаться
+        if field == 'id':
+            return [{'id': order}]
+        return [{field: order}, {'id': 'asc'}]
+
+    @staticmethod
+    def _build_query(query: str, filters: FilmFilters = FilmFilters()) -> dict:
+        # Документация по поиску: https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-multi-match-query.html
+        if not query:
+            text_query = {'match_all': {}}
+        else:
+            text_query = {'multi_match': {'query': query, 'fields': ['title^3', 'description'], 'fuzziness': 'AUTO'}}
+
+        # Фильтры не влияют на релевантность, а Elasticsearch кеширует их как битовые множества
+        clauses = []
+        if filters.genres:
+            clauses.append({'terms': {'genres': list(filters.genres)}})
+        if filters.type:
+            clauses.append({'term': {'type': filters.type}})
+        bounds = {bound: value for bound, value in (('gte', filters.rating_min), ('lte', filters.rating_max))
+                  if value is not None}
+        if bounds:
+            clauses.append({'range': {'rating': bounds}})
 
-        # pydantic предоставляет удобное API для создания объекта моделей из json
-        film = Film.parse_raw(data)
-        return film
+        if not clauses:
+            return text_query
+        return {'bool': {'must': text_query, 'filter': clauses}}
 
-    async def _put_film_to_cache(self, film: Film):
-        # Сохраняем данные о фильме, используя команду set
-        # Выставляем время жизни кеша — 5 минут
-        # https://redis.io/commands/set/
-        # pydantic позволяет сериализовать модель в json
-        await self.cache.set(film.id, film.json(), FILM_CACHE_EXPIRE_IN_SECONDS)
+    @staticmethod
+    @profiled('validation')
+    def _films_from_hits(response: dict, fields: Optional[tuple[str, ...]] = None) -> list[Film]:
+        model = projection_model(Film, fields) if fields else Film
+        return [model(**hit['_source']) for hit in response['hits']['hits']]
 
 
 @lru_cache()
 def get_film_service(
-        #redis: Redis = Depends(get_redis),
-        cache: AsyncCacheStorage = Depends(MemcachedRepository),
-        search_engine: AsyncSearchEngine= Depends(SearchEngineRepository),
+        cache: AsyncCacheStorage = Depends(get_cache),
+        search_engine: AsyncSearchEngine= Depends(get_search_engine),
 ) -> FilmService:
-    return FilmService(cache, search_engine)
+    lease_cache = cache if get_settings().cache_lease_enabled else None
+    return FilmService(
+        cache,
+        search_engine,
+        SingleFlight(FilmService.index, lease_cache),
+        get_existence_index(FilmService.index),
+        get_popularity_tracker(),
+    )
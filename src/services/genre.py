@@ -1,162 +1,147 @@
 from functools import lru_cache
 from typing import Optional
+from db.abstract.cache import AsyncCacheStorage
+from db.abstract.search_engine import AsyncSearchEngine
 
-from elasticsearch import AsyncElasticsearch, NotFoundError
 from fastapi import Depends
-from redis.asyncio import Redis
 
-from db.implementation.search_engine import get_elastic
+from core.config import get_settings
+from core.single_flight import SingleFlight
+from db.implementation.search_engine import get_search_engine
+from db.implementation.cache import get_cache
+from db.implementation.existence import get_existence_index
+from db.implementation.popularity import get_popularity_tracker
+from db.implementation.genre_dictionary import (
+    GENRES_MAX_RESULT_WINDOW,
+    GenreDictionary,
+    get_genre_dictionary,
+    normalize_genre_name,
+)
 
-from db.implementation.cache import get_redis
 from models.genre import Genre
-
-# Elastic search docementation with examples - https://elasticsearch-dsl.readthedocs.io/en/latest/search_dsl.html#pagination
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search
+from services.base import BaseService
 
 GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
 
 
-class GenreService:
-    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
-        self.redis = redis
-        self.elastic = elastic
+class GenreService(BaseService):
+    index = 'genres'
+    model = Genre
+    cache_expire = GENRE_CACHE_EXPIRE_IN_SECONDS
 
-    # get_by_id возвращает объект жанра. Он опционален, так как жанр может отсутствовать в базе
-    async def get_by_id(self, genre_id: str) -> Optional[Genre]:
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        genre = await self._genre_from_cache(genre_id)
-        if not genre:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            genre = await self._get_genre_from_elastic(genre_id)
-            if not genre_id:
-                # Если он отсутствует в Elasticsearch, значит, фильма вообще нет в базе
-                return None
-            # Сохраняем фильм  в кеш
-            await self._put_genre_to_cache(genre)
+    def __init__(self, *args, dictionary: Optional[GenreDictionary] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Снимок всех жанров в памяти, пока он не загружен, жанры читаются из кеша и Elasticsearch
+        self.dictionary = dictionary
 
-        return genre
-    
-    # get_by_name возвращает объект жанра. Он опционален, так как фильм может отсутствовать в базе
-    async def get_by_id(self, genre_id: str) -> Optional[Genre]:
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        genre = await self._genre_from_cache(genre_id)
-        if not genre:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            genre = await self._get_genre_from_elastic(genre_id)
-            if not genre_id:
-                # Если он отсутствует в Elasticsearch, значит, фильма вообще нет в базе
-                return None
-            # Сохраняем фильм  в кеш
-            await self._put_genre_to_cache(genre)
+    async def get_by_id(self, doc_id: str) -> Optional[Genre]:
+        snapshot = self._snapshot()
+        if snapshot is not None and doc_id in snapshot.by_id:
+            self._record_hit(doc_id)
+            return snapshot.by_id[doc_id]
 
-        return genre
-    
-    # get_by_name возвращает объект жанра. Он опционален, так как фильм может отсутствовать в базе
+        # Жанр мог появиться после загрузки снимка
+        return await super().get_by_id(doc_id)
+
+    async def get_etag(self, doc_id: str, doc: Optional[Genre] = None) -> Optional[str]:
+        # ETag жанров из снимка посчитаны при его загрузке, без похода в кеш
+        snapshot = self._snapshot()
+        if snapshot is not None and doc_id in snapshot.etags:
+            return snapshot.etags[doc_id]
+
+        return await super().get_etag(doc_id, doc)
+
+    async def get_many(self, doc_ids: list[str]) -> list[Optional[Genre]]:
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return await super().get_many(doc_ids)
+
+        missing = [doc_id for doc_id in doc_ids if doc_id not in snapshot.by_id]
+        loaded = dict(zip(missing, await super().get_many(missing))) if missing else {}
+        return [snapshot.by_id.get(doc_id) or loaded.get(doc_id) for doc_id in doc_ids]
+
+    # get_by_name возвращает объект жанра. Он опционален, так как жанр может отсутствовать в базе
     async def get_by_name(self, genre_name: str) -> Optional[Genre]:
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        #genre = await self._genre_from_cache(None, genre_name)
-        #if not genre:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.by_name.get(normalize_genre_name(genre_name))
+
         genre = await self._get_genre_by_name_from_elastic(genre_name)
         if not genre:
-            # Если он отсутствует в Elasticsearch, значит, фильма вообще нет в базе
+            # Если он отсутствует в Elasticsearch, значит, жанра вообще нет в базе
             return None
 
         return genre
 
     async def add_genre(self, genre: Genre) -> Optional[Genre]:
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        await self._get_genre_to_elastic(genre)
-       
-        # Если фильма нет в кеше, то ищем его в Elasticsearch
-        genre = await self._get_genre_to_elastic(genre.id)
+        if await self._get_genre_to_elastic(genre):
+            await self._mark_existing(str(genre.id))
+            if self.dictionary is not None:
+                # Остальные воркеры увидят жанр при следующем обновлении снимка
+                self.dictionary.add(genre)
+
+        # Проверяем, что жанр действительно появился в Elasticsearch
+        genre = await self._get_from_elastic(str(genre.id))
         if not genre:
             return None
-        
+
         return genre
 
 
-    # get_all возвращает лис объектов персон или None фильмов может и не быть в базе
+    # get_all возвращает лис объектов жанров или None жанров может и не быть в базе
     async def get_all_genres(self) -> Optional[list]:
-        # Фильмы ищем в Elasticsearch
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return list(snapshot.genres) or None
+
+        # Жанры ищем в Elasticsearch
         genres = await self._get_all_genres_from_elastic()
         if not genres:
-            # Если фильмы отсутствуют в Elasticsearch, значит, фильмов вообще нет в базе
+            # Если жанры отсутствуют в Elasticsearch, значит, жанров вообще нет в базе
             return None
-        
+
         return genres
 
+    def _snapshot(self):
+        return self.dictionary.snapshot if self.dictionary is not None else None
+
     async def _get_genre_to_elastic(self, genre: Genre) -> Optional[Genre]:
         try:
-            self.elastic.index(index="genres", body=genre.json(), id=genre.id)
+            await self.search_engine.index(index=self.index, id=str(genre.id), document=genre.dict())
         except Exception:
             return None
-        
-        return genre
-
-    async def _get_genre_from_elastic(self, genres_id: str) -> Optional[Genre]:
-        try:
-            doc = await self.elastic.get(index='genres', id=genres_id)
-        except NotFoundError:
-            return None
-        return Genre(**doc['_source'])
-    
-    async def _get_genre_by_name_from_elastic(self, name) -> Optional[list]:
-        try:
-            result = Genre
-            search = Search(using=self.elastic, index="genres")
-
-            # Stack overflow: https://stackoverflow.com/questions/50210299/how-to-get-all-documents-under-an-elasticsearch-index-with-python-client
-            for hit in search.scan():
-                genre = Genre(**hit['_source'])
-                if genre.name == name:
-                    result = genre
-
-            return result
-            
-        except NotFoundError:
-            return None
 
-    async def _get_all_genres_from_elastic(self) -> Optional[list]:
-        try:
-            genres = list
-            search = Search(using=self.elastic, index="genres")
-
-            # Stack overflow: https://stackoverflow.com/questions/50210299/how-to-get-all-documents-under-an-elasticsearch-index-with-python-client
-            for hit in search.scan():
-                genre = Genre(**hit['_source'])
-                genres.append(genre)
+        return genre
 
-            return genres
-            
-        except NotFoundError:
-            return None
+    async def _get_genre_by_name_from_elastic(self, name) -> Optional[Genre]:
+        genres = await self._get_all_genres_from_elastic()
 
-    async def _genre_from_cache(self, genre_id: str) -> Optional[Genre]:
-        # Пытаемся получить данные о персоне из кеша, используя команду get
-        # https://redis.io/commands/get/
-        
-        data = await self.redis.get(genre_id)
+        for genre in genres:
+            if normalize_genre_name(genre.name) == normalize_genre_name(name):
+                return genre
 
-        if not data:
-            return None
+        return None
 
-        # pydantic предоставляет удобное API для создания объекта моделей из json
-        genre = Genre.parse_raw(data)
-        return genre
+    async def _get_all_genres_from_elastic(self) -> list:
+        response = await self.search_engine.search(
+            index=self.index,
+            body={'query': {'match_all': {}}, 'size': GENRES_MAX_RESULT_WINDOW},
+        )
 
-    async def _put_genre_to_cache(self, genre: Genre):
-        # Сохраняем данные о фильме, используя команду set
-        # Выставляем время жизни кеша — 5 минут
-        # https://redis.io/commands/set/
-        # pydantic позволяет сериализовать модель в json
-        await self.redis.set(genre.id, genre.json(), GENRE_CACHE_EXPIRE_IN_SECONDS)
+        return [self._build(hit['_source']) for hit in response['hits']['hits']]
 
 
 @lru_cache()
 def get_genre_service(
-        redis: Redis = Depends(get_redis),
-        elastic: AsyncElasticsearch = Depends(get_elastic),
+        cache: AsyncCacheStorage = Depends(get_cache),
+        search_engine: AsyncSearchEngine = Depends(get_search_engine),
 ) -> GenreService:
-    return GenreService(redis, elastic)
\ No newline at end of file
+    lease_cache = cache if get_settings().cache_lease_enabled else None
+    return GenreService(
+        cache,
+        search_engine,
+        SingleFlight(GenreService.index, lease_cache),
+        get_existence_index(GenreService.index),
+        get_popularity_tracker(),
+        dictionary=get_genre_dictionary(),
+    )
@@ -0,0 +1,28 @@
+from functools import lru_cache
+from typing import Optional
+
+from db.implementation.suggest_index import SuggestIndex, get_suggest_index
+from models.suggest import Suggestions
+
+
+class SuggestService:
+    def __init__(self, index: SuggestIndex):
+        # Индекс префиксов в памяти процесса, обновляется в фоне (см. db.implementation.suggest_index)
+        self.index = index
+
+    # suggest возвращает подсказки или None, пока индекс префиксов ещё не загружен
+    def suggest(self, query: str, limit: int) -> Optional[Suggestions]:
+        if not self.index.ready:
+            return None
+
+        # Валидация pydantic-core из словарей в разы быстрее, чем construct по модели на каждую подсказку
+        found = self.index.suggest(query, limit)
+        return Suggestions.parse_obj({
+            kind: [{'id': entry.id, 'text': entry.text, 'score': entry.score} for entry in entries]
+            for kind, entries in found.items()
+        })
+
+
+@lru_cache()
+def get_suggest_service() -> SuggestService:
+    return SuggestService(get_suggest_index())
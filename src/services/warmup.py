@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from core.config import get_settings
+from core.metrics import CACHE_WARMUP_DURATION, CACHE_WARMUP_KEYS
+from core.response_cache import CACHE_WARMUP_SCOPE_KEY, cache_key_url, response_cache_keys
+from core.stats import register_stats
+from db.abstract.cache import AsyncCacheStorage
+from db.implementation.cache import get_cache
+from db.implementation.popularity import POPULARITY_PAGES, PopularityTracker, get_popularity_tracker
+from db.implementation.search_engine import get_search_engine
+from services.base import BaseService
+from services.film import get_film_service
+from services.genre import get_genre_service
+from services.person import get_person_service
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupReport(NamedTuple):
+    duration: float
+    # Загруженные в кеш ключи: документы по индексам и страницы списков
+    keys: dict[str, int]
+    # Прогрев не уложился в time_budget, оставшиеся загрузки отменены
+    timed_out: bool
+    failed: int
+
+
+class CacheWarmer:
+    """
+    Прогрев кеша самыми популярными документами и страницами списков (см. db.implementation.popularity).
+
+    Документы каждого сервиса загружаются пачками по batch_size через get_many: закешированные - одним MGET
+    из Redis в L1, остальные - одним mget из Elasticsearch в оба уровня кеша. Закешированные ответы страниц
+    тоже читаются одним MGET, а страницы, которых нет и в Redis, запрашиваются у самого приложения внутри процесса,
+    и их ответ кладёт в кеш ResponseCacheMiddleware.
+    Одновременно идёт не больше concurrency загрузок, а всё, что не успело за time_budget секунд, отменяется:
+    прогрев не должен занимать Elasticsearch и event loop дольше, чем стоят промахи, от которых он спасает.
+    """
+
+    def __init__(
+            self,
+            popularity: PopularityTracker,
+            services: list[BaseService],
+            cache: AsyncCacheStorage,
+            render_page: Optional[Callable[[str], Awaitable[bool]]] = None,
+            encodings: tuple[str, ...] = (),
+            top_documents: int = 500,
+            top_pages: int = 100,
+            concurrency: int = 4,
+            batch_size: int = 100,
+            time_budget: float = 10.0,
+            interval: int = 60 * 5,
+    ):
+        self.popularity = popularity
+        self.services = services
+        self.cache = cache
+        # Запрос страницы у приложения, True - ответ получен и закеширован
+        self.render_page = render_page
+        # Кодировки сжатых вариантов ответов в кеше, как у ResponseCacheMiddleware
+        self.encodings = encodings
+        self.top_documents = top_documents
+        self.top_pages = top_pages
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.interval = interval
+
+        self.runs = 0
+        self.last_report: Optional[WarmupReport] = None
+
+    async def warm(self) -> WarmupReport:
+        started = time.monotonic()
+        keys = dict.fromkeys([service.index for service in self.services] + [POPULARITY_PAGES], 0)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(kind: str, load: Callable[[], Awaitable[int]]):
+            async with semaphore:
+                loaded = await load()
+            keys[kind] += loaded
+
+        jobs = []
+        for service in self.services:
+            doc_ids = await self.popularity.top(service.index, self.top_documents)
+            jobs += [limited(service.index, lambda batch=batch, service=service: self._warm_documents(service, batch))
+                     for batch in self._batches(doc_ids)]
+        pages = await self.popularity.top(POPULARITY_PAGES, self.top_pages)
+        jobs += [limited(POPULARITY_PAGES, lambda batch=batch: self._warm_pages(batch)) for batch in self._batches(pages)]
+
+        tasks = [asyncio.create_task(job) for job in jobs]
+        done, pending = await asyncio.wait(tasks, timeout=self.time_budget) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        failed = 0
+        for task in done:
+            if task.exception() is not None:
+                failed += 1
+                logger.warning('cache warmup job failed: %r', task.exception())
+
+        report = WarmupReport(time.monotonic() - started, keys, bool(pending), failed)
+        self.runs += 1
+        self.last_report = report
+        CACHE_WARMUP_DURATION.observe(report.duration)
+        for kind, count in keys.items():
+            CACHE_WARMUP_KEYS.labels(kind).inc(count)
+        logger.info('cache warmup: %s keys %s in %.3fs%s', sum(keys.values()), keys, report.duration,
+                    ', time budget exceeded' if report.timed_out else '')
+        return report
+
+    async def run(self):
+        while True:
+            try:
+                await self.warm()
+            except Exception:
+                # Без прогрева кеш заполнится запросами, попробуем снова через interval
+                logger.exception('cache warmup failed')
+            await asyncio.sleep(self.interval)
+
+    def _batches(self, items: list[str]) -> list[list[str]]:
+        return [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+
+    @staticmethod
+    async def _warm_documents(service: BaseService, doc_ids: list[str]) -> int:
+        docs = await service.get_many(doc_ids)
+        return sum(doc is not None for doc in docs)
+
+    async def _warm_pages(self, keys: list[str]) -> int:
+        # Ответы и их сжатые варианты из Redis - в L1 одним MGET
+        page_keys = {key: response_cache_keys(key, self.encodings) for key in keys}
+        values = await self.cache.get_many([key for variants in page_keys.values() for key in variants])
+        cached = dict(zip((key for variants in page_keys.values() for key in variants), values))
+
+        loaded = 0
+        for key in keys:
+            if cached[key] is not None:
+                loaded += 1
+            elif self.render_page is not None and await self.render_page(cache_key_url(key)):
+                loaded += 1
+        return loaded
+
+    def stats(self) -> dict:
+        report = self.last_report
+        return {
+            'runs': self.runs,
+            'last_duration': report.duration if report else None,
+            'last_keys': report.keys if report else {},
+            'last_timed_out': report.timed_out if report else False,
+            'last_failed': report.failed if report else 0,
+        }
+
+
+def asgi_page_renderer(app) -> Callable[[str], Awaitable[bool]]:
+    """Запрос GET к ASGI приложению внутри процесса, без сети; запрос помечен как прогрев, см. core.response_cache."""
+
+    async def render(url: str) -> bool:
+        # Параметры в ключе кеша уже экранированы, строка запроса берётся как есть
+        path, _, query_string = url.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'warmup')],
+            'server': ('warmup', 80),
+            'client': None,
+            CACHE_WARMUP_SCOPE_KEY: True,
+        }
+        status = None
+        request_sent = False
+        response_complete = asyncio.Event()
+
+        async def receive() -> dict:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Дальше клиент "отключается" только после ответа, как это делает сервер
+            await response_complete.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message: dict):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                response_complete.set()
+
+        await app(scope, receive, send)
+        return status == 200
+
+    return render
+
+
+@lru_cache()
+def get_cache_warmer(app, encodings: tuple[str, ...] = ()) -> Optional[CacheWarmer]:
+    settings = get_settings()
+    popularity = get_popularity_tracker()
+    if not settings.warmup_enabled or popularity is None:
+        return None
+
+    cache, search_engine = get_cache(), get_search_engine()
+    warmer = CacheWarmer(
+        popularity,
+        # Те же экземпляры сервисов, что получают ручки через Depends
+        [get_film_service(cache=cache, search_engine=search_engine),
+         get_person_service(cache=cache, search_engine=search_engine),
+         get_genre_service(cache=cache, search_engine=search_engine)],
+        cache,
+        render_page=asgi_page_renderer(app),
+        encodings=encodings,
+        top_documents=settings.warmup_top_documents,
+        top_pages=settings.warmup_top_pages,
+        concurrency=settings.warmup_concurrency,
+        batch_size=settings.warmup_batch_size,
+        time_budget=settings.warmup_time_budget,
+        interval=settings.warmup_interval,
+    )
+    register_stats('warmup', warmer.stats)
+    return warmer
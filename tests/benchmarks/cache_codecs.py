@@ -0,0 +1,144 @@
+"""
+Микробенчмарк форматов кеша: скорость кодирования/декодирования фильма и объём Redis на 100 000 фильмов.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src python tests/benchmarks/cache_codecs.py
+    PYTHONPATH=src python tests/benchmarks/cache_codecs.py --redis-url redis://localhost:6379/15
+
+Без --redis-url объём Redis оценивается как сумма размеров значений плюс накладные расходы на ключ,
+с --redis-url фильмы записываются в указанную (пустую) базу и объём берётся из INFO memory.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+import uuid
+
+from db.implementation.codecs import CacheCodec
+from models.film import Film
+
+FORMATS = [
+    ('orjson', 'none'),
+    ('orjson', 'lz4'),
+    ('orjson', 'zstd'),
+    ('msgpack', 'none'),
+    ('msgpack', 'lz4'),
+    ('msgpack', 'zstd'),
+]
+
+# Примерные накладные расходы Redis на ключ с TTL (dictEntry, sds ключа, expires)
+REDIS_KEY_OVERHEAD_IN_BYTES = 90
+FILMS_FOR_MEMORY_ESTIMATE = 100_000
+
+WORDS = ('star', 'war', 'night', 'city', 'love', 'dark', 'return', 'last', 'world', 'king', 'empire', 'dream')
+
+
+def make_film(cast_size: int) -> Film:
+    def people(count):
+        return [{'id': str(uuid.uuid4()), 'name': f'{random.choice(WORDS).title()} {random.choice(WORDS).title()}'}
+                for _ in range(count)]
+
+    return Film(
+        id=uuid.uuid4(),
+        title=' '.join(random.choices(WORDS, k=3)).title(),
+        description=' '.join(random.choices(WORDS, k=60)),
+        creation_date=datetime.datetime(2000, 1, 1) + datetime.timedelta(days=random.randint(0, 8000)),
+        rating=round(random.uniform(1, 10), 1),
+        type='movie',
+        genres=random.sample(['Action', 'Drama', 'Comedy', 'Sci-Fi', 'Thriller'], 2),
+        actors=people(cast_size),
+        directors=people(2),
+        screenwriters=people(3),
+    )
+
+
+def bench(codec: CacheCodec, films: list[Film], rounds: int) -> dict:
+    encoded = [codec.encode(film) for film in films]
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for film in films:
+            codec.encode(film)
+    encode_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for data in encoded:
+            codec.decode(data, Film)
+    decode_seconds = time.perf_counter() - started
+
+    operations = rounds * len(films)
+    average_size = sum(map(len, encoded)) / len(encoded)
+    return {
+        'encode_per_second': round(operations / encode_seconds),
+        'decode_per_second': round(operations / decode_seconds),
+        'average_value_bytes': round(average_size),
+        'estimated_redis_mb_per_100k': round(
+            (average_size + REDIS_KEY_OVERHEAD_IN_BYTES) * FILMS_FOR_MEMORY_ESTIMATE / 2 ** 20, 1),
+    }
+
+
+async def measure_redis(redis_url: str, codec: CacheCodec, films: list[Film]) -> float:
+    from redis.asyncio import Redis
+
+    redis = Redis.from_url(redis_url)
+    try:
+        await redis.flushdb()
+        before = (await redis.info('memory'))['used_memory']
+        async with redis.pipeline(transaction=False) as pipe:
+            for index in range(FILMS_FOR_MEMORY_ESTIMATE):
+                pipe.set(f'film:{index}', codec.encode(films[index % len(films)]), ex=3600)
+            await pipe.execute()
+        after = (await redis.info('memory'))['used_memory']
+        await redis.flushdb()
+    finally:
+        await redis.close()
+
+    return round((after - before) / 2 ** 20, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=1000, help='number of distinct films to encode')
+    parser.add_argument('--cast-size', type=int, default=40, help='actors per film')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--threshold', type=int, default=1024, help='compression threshold in bytes')
+    parser.add_argument('--redis-url', help='measure real memory usage in this Redis database (it is flushed)')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+
+    random.seed(42)
+    films = [make_film(args.cast_size) for _ in range(args.films)]
+
+    results = {}
+    for serializer, compression in FORMATS:
+        try:
+            codec = CacheCodec(serializer, compression, args.threshold)
+        except ImportError as exc:
+            results[f'{serializer}+{compression}'] = {'skipped': str(exc)}
+            continue
+
+        result = bench(codec, films, args.rounds)
+        if args.redis_url:
+            result['redis_mb_per_100k'] = asyncio.run(measure_redis(args.redis_url, codec, films))
+        results[f'{serializer}+{compression}'] = result
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = ['encode_per_second', 'decode_per_second', 'average_value_bytes', 'estimated_redis_mb_per_100k']
+    if args.redis_url:
+        columns.append('redis_mb_per_100k')
+    print(f'{"format":<16}' + ''.join(f'{column:>30}' for column in columns))
+    for name, result in results.items():
+        if 'skipped' in result:
+            print(f'{name:<16}  skipped: {result["skipped"]}')
+            continue
+        print(f'{name:<16}' + ''.join(f'{result[column]:>30}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+Нагрузочный тест ручек /api/v1: смешанная нагрузка с zipf-распределением ID и запросов.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/load_test.py --output results.json
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/load_test.py --baseline tests/benchmarks/baseline.json
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/load_test.py --url http://localhost:8000
+
+Без --url сервис поднимается в этом же процессе на сгенерированных данных: поисковый движок в памяти
+(SEARCH_ENGINE_BACKEND=memory) и Redis в памяти (stand_ins.MemoryRedis). С --url нагрузка идёт на запущенный
+сервис, а ID для запросов берутся из его же списочных ручек.
+
+Результат - JSON с пропускной способностью, p50/p95/p99 по всем запросам и по каждой ручке, долей попаданий
+в кеш и числом обращений к поисковому движку на запрос (по разнице /api/v1/stats до и после прогона;
+с --url нужен --stats-token, равный STATS_TOKEN сервиса).
+С --baseline результат сравнивается с сохранённым и при ухудшении больше --tolerance процесс завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from bisect import bisect
+from collections import defaultdict
+from itertools import accumulate
+
+import httpx
+
+API = '/api/v1'
+
+WORDS = ('star', 'war', 'night', 'city', 'love', 'dark', 'return', 'last', 'world', 'king', 'empire', 'dream',
+         'river', 'ghost', 'storm', 'secret', 'island', 'winter', 'shadow', 'machine')
+GENRES = ('Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', 'Fantasy',
+          'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Sci-Fi', 'Sport', 'Thriller', 'War', 'Western')
+FILM_SORTS = ('-rating', 'rating', 'title', '-creation_date', 'id')
+
+# Доля каждой ручки в нагрузке
+WORKLOAD = {
+    'films_list': 0.15,
+    'films_search': 0.10,
+    'films_facets': 0.10,
+    'film_detail': 0.22,
+    'persons_list': 0.04,
+    'persons_search': 0.04,
+    'person_detail': 0.10,
+    'person_films': 0.07,
+    'genres_list': 0.08,
+    'genre_detail': 0.10,
+}
+
+# Метрики для сравнения с базовым прогоном: True - больше значит лучше
+COMPARED_METRICS = {
+    'throughput_rps': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'cache_hit_ratio': True,
+    'search_engine_calls_per_request': False,
+}
+
+
+class Zipf:
+    """Выбор элемента с вероятностью 1 / rank^s: немногие горячие элементы и длинный хвост."""
+
+    def __init__(self, items, s: float, rng: random.Random):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(1 / rank ** s for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def sample(self):
+        return self.items[bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])]
+
+
+def seed_dataset(films: int, persons: int, rng: random.Random) -> dict[str, list[dict]]:
+    now = datetime.datetime(2024, 1, 1).isoformat()
+    people = [
+        {
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'full_name': f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son',
+            'gender': rng.choice(('male', 'female')),
+            'created': now,
+            'modified': now,
+        }
+        for _ in range(persons)
+    ]
+    person_picker = Zipf(people, 1.0, rng)
+
+    def cast(count: int) -> list[dict]:
+        chosen = {person['id']: person for person in (person_picker.sample() for _ in range(count))}
+        return [{'id': person['id'], 'name': person['full_name']} for person in chosen.values()]
+
+    movies = [
+        {
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'title': ' '.join(rng.choices(WORDS, k=rng.randint(1, 4))).title(),
+            'description': ' '.join(rng.choices(WORDS, k=30)),
+            'creation_date': (datetime.datetime(1960, 1, 1) + datetime.timedelta(days=rng.randint(0, 23000))).isoformat(),
+            'rating': round(rng.uniform(1, 10), 1),
+            'type': 'movie',
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'actors': cast(rng.randint(3, 15)),
+            'directors': cast(1),
+            'screenwriters': cast(rng.randint(1, 3)),
+        }
+        for _ in range(films)
+    ]
+    genres = [
+        {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'name': name, 'created': now, 'modified': now}
+        for name in GENRES
+    ]
+    return {'movies': movies, 'persons': people, 'genres': genres}
+
+
+def build_workload(requests: int, ids: dict[str, list[str]], rng: random.Random) -> list[tuple[str, str]]:
+    films = Zipf(ids['movies'], 1.1, rng)
+    persons = Zipf(ids['persons'], 1.1, rng)
+    genres = Zipf(ids['genres'], 1.1, rng)
+    words = Zipf(WORDS, 1.0, rng)
+    sorts = Zipf(FILM_SORTS, 1.0, rng)
+    pages = Zipf(range(1, 11), 1.5, rng)
+    # Фасеты запрашивают без фильтров (первый элемент) и с фильтром по одному из популярных жанров
+    facet_genres = Zipf(('',) + GENRES, 1.0, rng)
+
+    endpoints = {
+        'films_list': lambda: f'{API}/films?sort={sorts.sample()}&page_number={pages.sample()}',
+        'films_search': lambda: f'{API}/films/search?query={words.sample()}',
+        'films_facets': lambda: f'{API}/films/facets?genre={facet_genres.sample()}',
+        'film_detail': lambda: f'{API}/films/{films.sample()}',
+        'persons_list': lambda: f'{API}/persons?pageNumber={pages.sample()}',
+        'persons_search': lambda: f'{API}/persons/search?query={words.sample().title()}',
+        'person_detail': lambda: f'{API}/persons/{persons.sample()}',
+        'person_films': lambda: f'{API}/persons/{persons.sample()}/film',
+        'genres_list': lambda: f'{API}/genres',
+        'genre_detail': lambda: f'{API}/genres/{genres.sample()}',
+    }
+    names = rng.choices(list(WORKLOAD), weights=list(WORKLOAD.values()), k=requests)
+    return [(name, endpoints[name]()) for name in names]
+
+
+def percentiles(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {
+        'p50': rank(0.50),
+        'p95': rank(0.95),
+        'p99': rank(0.99),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+async def drive(client: httpx.AsyncClient, workload: list[tuple[str, str]], concurrency: int) -> list[tuple]:
+    results = []
+    queue = iter(workload)
+
+    async def worker():
+        for name, path in queue:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                status, cache = response.status_code, response.headers.get('x-cache')
+            except httpx.HTTPError:
+                status, cache = None, None
+            results.append((name, time.perf_counter() - started, status, cache))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results
+
+
+def cache_hit_ratio(before: dict, after: dict) -> float | None:
+    def delta(section: str, field: str) -> int:
+        return after.get(section, {}).get(field, 0) - before.get(section, {}).get(field, 0)
+
+    if 'cache.l1' in after:
+        lookups = delta('cache.l1', 'hits') + delta('cache.l1', 'misses')
+        hits = delta('cache.l1', 'hits') + delta('cache.redis', 'hits')
+    else:
+        lookups = delta('cache.redis', 'hits') + delta('cache.redis', 'misses')
+        hits = delta('cache.redis', 'hits')
+    return round(hits / lookups, 4) if lookups else None
+
+
+def summarize(results: list[tuple], duration: float, before: dict, after: dict) -> dict:
+    by_endpoint = defaultdict(list)
+    for result in results:
+        by_endpoint[result[0]].append(result)
+
+    def describe(items: list[tuple]) -> dict:
+        statuses = defaultdict(int)
+        for _, _, status, _ in items:
+            statuses[str(status)] += 1
+        return {
+            'requests': len(items),
+            'errors': sum(1 for _, _, status, _ in items if status is None or status >= 500),
+            'statuses': dict(statuses),
+            'latency_ms': percentiles([latency for _, latency, _, _ in items]),
+        }
+
+    cached = [cache for *_, cache in results if cache]
+    search_engine_calls = after.get('search_engine', {}).get('calls', 0) - before.get('search_engine', {}).get('calls', 0)
+    return {
+        **describe(results),
+        'duration_seconds': round(duration, 3),
+        'throughput_rps': round(len(results) / duration, 1),
+        'cache_hit_ratio': cache_hit_ratio(before, after),
+        'response_cache_hit_ratio': round(cached.count('HIT') / len(cached), 4) if cached else None,
+        'search_engine_calls_per_request': round(search_engine_calls / len(results), 4),
+        'endpoints': {name: describe(items) for name, items in sorted(by_endpoint.items())},
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    def lookup(data: dict, path: str):
+        for part in path.split('.'):
+            data = data.get(part) if isinstance(data, dict) else None
+        return data
+
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS.items():
+        current, expected = lookup(result, path), lookup(baseline, path)
+        if current is None or not expected:
+            continue
+        change = (current - expected) / expected
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f'{path}: {expected} -> {current} ({change:+.1%})')
+    return regressions
+
+
+async def run_against_url(args, rng: random.Random) -> tuple[dict, list[tuple], float]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        # ID берём из самого сервиса: первые страницы списков фильмов и персон и все жанры
+        ids = {'movies': [], 'persons': [], 'genres': []}
+        cursor = None
+        while len(ids['movies']) < args.films:
+            params = {'page_size': 100, 'sort': 'id', **({'cursor': cursor} if cursor else {})}
+            response = await client.get(f'{API}/films', params=params)
+            if response.status_code != 200:
+                break
+            ids['movies'].extend(film['id'] for film in response.json())
+            cursor = response.headers.get('x-next-cursor')
+            if not cursor:
+                break
+        ids['persons'] = [person['id'] for person in (await client.get(f'{API}/persons?pageSize={args.persons}')).json()]
+        ids['genres'] = [genre['id'] for genre in (await client.get(f'{API}/genres')).json()]
+        return await run_workload(client, ids, args, rng)
+
+
+async def run_in_process(args, rng: random.Random) -> tuple[dict, list[tuple], float]:
+    for name, value in {
+        'project_name': 'benchmark',
+        'redis_host': 'memory',
+        'redis_port': '0',
+        'elastic_host': 'memory',
+        'elastic_port': '0',
+        'search_engine_backend': 'memory',
+        'stats_token': 'benchmark',
+    }.items():
+        os.environ.setdefault(name, value)
+    args.stats_token = os.environ['stats_token']
+
+    import main
+    from db.implementation.search_engine import get_search_engine
+    from stand_ins import MemoryRedis
+
+    redis = MemoryRedis()
+    main.Redis = lambda **kwargs: redis
+
+    dataset = seed_dataset(args.films, args.persons, rng)
+    search_engine = get_search_engine()
+    for index, documents in dataset.items():
+        search_engine.search_engine.load(index, documents)
+
+    ids = {index: [document['id'] for document in documents] for index, documents in dataset.items()}
+    async with main.lifespan(main.app):
+        # Даём фоновым задачам (фильтры Блума, снимок жанров) загрузиться до замеров
+        await asyncio.sleep(0.5)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=30) as client:
+            return await run_workload(client, ids, args, rng)
+
+
+async def run_workload(client: httpx.AsyncClient, ids: dict, args, rng: random.Random):
+    if args.warmup:
+        await drive(client, build_workload(args.warmup, ids, rng), args.concurrency)
+
+    workload = build_workload(args.requests, ids, rng)
+    stats_headers = {'X-Stats-Token': args.stats_token or ''}
+    before = (await client.get(f'{API}/stats', headers=stats_headers)).json()
+    started = time.perf_counter()
+    results = await drive(client, workload, args.concurrency)
+    duration = time.perf_counter() - started
+    after = (await client.get(f'{API}/stats', headers=stats_headers)).json()
+    return summarize(results, duration, before, after), results, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='run against a running service instead of an in-process one')
+    parser.add_argument('--films', type=int, default=2000, help='films to seed (or to collect ids of with --url)')
+    parser.add_argument('--persons', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500, help='requests sent before measuring')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stats-token', default=os.environ.get('STATS_TOKEN'), help='X-Stats-Token for /api/v1/stats')
+    parser.add_argument('--output', help='write results json to this file')
+    parser.add_argument('--baseline', help='compare with results json from a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    # Логи запросов httpx и сервиса заглушили бы результат
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    runner = run_against_url if args.url else run_in_process
+    summary, _, _ = asyncio.run(runner(args, rng))
+    summary['config'] = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(summary, json.load(file), args.tolerance)
+        if regressions:
+            print('regressions against baseline:', *regressions, sep='\n  ', file=sys.stderr)
+            sys.exit(1)
+        print('no regressions against baseline', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Микробенчмарк сжатия ответов: CPU на сжатие и распаковку страницы /films против сэкономленных байт.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/response_compression.py
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/response_compression.py --page-sizes 10 50 --json
+
+Страницы рендерит сама ручка /api/v1/films на сгенерированных данных (load_test.seed_dataset), поэтому
+размер и повторяемость json совпадают с настоящими ответами. Для каждой кодировки и уровня выводится:
+средний размер ответа, доля от исходного, микросекунды на сжатие и распаковку страницы и сколько килобайт
+экономит одна миллисекунда CPU на сжатии. Строки с * - уровни, с которыми работает сервис (core.compression).
+Кодировки, для которых не установлен модуль (brotli), пропускаются.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import random
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from api.v1 import films
+from core import compression
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from load_test import seed_dataset
+from services.film import FilmService, get_film_service
+
+# Уровни для сравнения с текущими: от самого быстрого до заметно более медленного
+LEVELS = {
+    'gzip': (1, 6, 9),
+    'br': (1, 5, 9, 11),
+    'zstd': (1, 3, 9, 19),
+}
+SERVICE_LEVELS = {
+    'gzip': compression.GZIP_LEVEL,
+    'br': compression.BROTLI_QUALITY,
+    'zstd': compression.ZSTD_LEVEL,
+}
+SORTS = ('id', '-rating', 'title', '-creation_date')
+
+
+class NoCache:
+    async def get(self, key: str, **kwargs):
+        return None
+
+    async def set(self, key: str, value, expire: int, **kwargs):
+        pass
+
+    async def get_many(self, keys: list[str], **kwargs) -> list:
+        return [None] * len(keys)
+
+    async def set_many(self, values: dict, expire: int, **kwargs):
+        pass
+
+
+def codecs(encoding: str, level: int):
+    """Функции сжатия и распаковки; None, если модуль кодировки не установлен."""
+    if encoding == 'gzip':
+        return lambda body: gzip.compress(body, compresslevel=level, mtime=0), gzip.decompress
+    if encoding == 'br' and compression.brotli is not None:
+        brotli = compression.brotli
+        return lambda body: brotli.compress(body, quality=level), brotli.decompress
+    if encoding == 'zstd' and compression.zstandard is not None:
+        compressor = compression.zstandard.ZstdCompressor(level=level, write_content_size=True)
+        return compressor.compress, compression.zstandard.ZstdDecompressor().decompress
+    return None
+
+
+async def render_pages(dataset: dict, page_size: int, pages: int) -> list[bytes]:
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', dataset['movies'])
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: FilmService(NoCache(), search_engine)
+
+    bodies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for index in range(pages):
+            params = {'page_size': page_size, 'page_number': index // len(SORTS) + 1, 'sort': SORTS[index % len(SORTS)]}
+            response = await client.get('/api/v1/films', params=params)
+            response.raise_for_status()
+            bodies.append(response.content)
+    return bodies
+
+
+def bench(compress, decompress, bodies: list[bytes], rounds: int) -> dict:
+    compressed = [compress(body) for body in bodies]
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for body in bodies:
+            compress(body)
+    compress_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for data in compressed:
+            decompress(data)
+    decompress_seconds = time.perf_counter() - started
+
+    operations = rounds * len(bodies)
+    raw_bytes = sum(map(len, bodies)) / len(bodies)
+    compressed_bytes = sum(map(len, compressed)) / len(compressed)
+    compress_ms = compress_seconds * 1000 / operations
+    return {
+        'raw_bytes': round(raw_bytes),
+        'compressed_bytes': round(compressed_bytes),
+        'ratio': round(compressed_bytes / raw_bytes, 3),
+        'compress_us': round(compress_ms * 1000, 1),
+        'decompress_us': round(decompress_seconds * 1_000_000 / operations, 1),
+        'kb_saved_per_cpu_ms': round((raw_bytes - compressed_bytes) / 1024 / compress_ms, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=2000, help='films in the generated index')
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--pages', type=int, default=20, help='distinct pages per page size')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    dataset = seed_dataset(args.films, args.films // 2, random.Random(42))
+
+    results = {}
+    for page_size in args.page_sizes:
+        bodies = asyncio.run(render_pages(dataset, page_size, args.pages))
+        for encoding, levels in LEVELS.items():
+            for level in levels:
+                name = f'page_size={page_size} {encoding}:{level}'
+                functions = codecs(encoding, level)
+                if functions is None:
+                    results[name] = {'skipped': f'{encoding} module is not installed'}
+                    continue
+                results[name] = bench(*functions, bodies, args.rounds)
+                results[name]['service_level'] = SERVICE_LEVELS[encoding] == level
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = ['raw_bytes', 'compressed_bytes', 'ratio', 'compress_us', 'decompress_us', 'kb_saved_per_cpu_ms']
+    print(f'{"format":<24}' + ''.join(f'{column:>22}' for column in columns))
+    for name, result in results.items():
+        if 'skipped' in result:
+            print(f'{name:<24}  skipped: {result["skipped"]}')
+            continue
+        marker = '*' if result['service_level'] else ' '
+        print(f'{name + marker:<24}' + ''.join(f'{result[column]:>22}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
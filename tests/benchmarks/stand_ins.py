@@ -0,0 +1,182 @@
+"""
+Redis в памяти процесса для бенчмарков: подменяет redis.asyncio.Redis там, где нет настоящего сервера.
+
+Реализованы только команды, которыми пользуется сервис: строки с TTL, MGET, DEL, сортированные множества,
+pub/sub и пайплайны.
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+def _to_key(key) -> str:
+    return key.decode() if isinstance(key, bytes) else str(key)
+
+
+class MemoryPipeline:
+    def __init__(self, redis: 'MemoryRedis'):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class MemoryPubSub:
+    def __init__(self, redis: 'MemoryRedis'):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.channels = set()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self.redis.subscribers[channel].add(self.queue)
+
+    async def unsubscribe(self, *channels: str):
+        for channel in channels or tuple(self.channels):
+            self.channels.discard(channel)
+            self.redis.subscribers[channel].discard(self.queue)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        await self.unsubscribe()
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+        self.expires: dict[str, float] = {}
+        self.subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self.zsets: dict[str, dict[str, float]] = defaultdict(dict)
+
+    def _alive(self, key: str) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    async def ping(self):
+        return True
+
+    async def get(self, key):
+        key = _to_key(key)
+        return self.data[key] if self._alive(key) else None
+
+    async def mget(self, keys, *args):
+        keys = [keys, *args] if isinstance(keys, (str, bytes)) else [*keys, *args]
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, px=None, nx=False, xx=False, **kwargs):
+        key = _to_key(key)
+        exists = self._alive(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+
+        self.data[key] = _to_bytes(value)
+        if ex is not None:
+            self.expires[key] = time.monotonic() + ex
+        elif px is not None:
+            self.expires[key] = time.monotonic() + px / 1000
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    async def delete(self, *keys):
+        deleted = 0
+        for key in map(_to_key, keys):
+            if self._alive(key):
+                deleted += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+    async def zincrby(self, name, amount, value):
+        zset = self.zsets[_to_key(name)]
+        member = _to_key(value)
+        zset[member] = zset.get(member, 0.0) + amount
+        return zset[member]
+
+    def _ranked(self, name) -> list[str]:
+        zset = self.zsets.get(_to_key(name), {})
+        return sorted(zset, key=lambda member: (zset[member], member))
+
+    async def zrevrange(self, name, start, end):
+        ranked = self._ranked(name)[::-1]
+        return [member.encode() for member in ranked[start:len(ranked) if end == -1 else end + 1]]
+
+    async def zremrangebyrank(self, name, start, end):
+        ranked = self._ranked(name)
+        end = len(ranked) + end if end < 0 else end
+        start = len(ranked) + start if start < 0 else start
+        removed = ranked[max(start, 0):end + 1]
+        for member in removed:
+            del self.zsets[_to_key(name)][member]
+        return len(removed)
+
+    async def zremrangebyscore(self, name, min_score, max_score):
+        zset = self.zsets.get(_to_key(name), {})
+        exclusive = str(max_score).startswith('(')
+        limit = float(str(max_score).lstrip('('))
+        removed = [member for member, score in zset.items() if score < limit or (not exclusive and score == limit)]
+        for member in removed:
+            del zset[member]
+        return len(removed)
+
+    async def zunionstore(self, dest, keys, aggregate=None):
+        weights = keys if isinstance(keys, dict) else dict.fromkeys(keys, 1)
+        union = defaultdict(float)
+        for key, weight in weights.items():
+            for member, score in self.zsets.get(_to_key(key), {}).items():
+                union[member] += score * weight
+        self.zsets[_to_key(dest)] = dict(union)
+        return len(union)
+
+    async def publish(self, channel, message):
+        channel = _to_key(channel)
+        for queue in self.subscribers[channel]:
+            queue.put_nowait({'type': 'message', 'channel': channel.encode(), 'data': _to_bytes(message)})
+        return len(self.subscribers[channel])
+
+    def pubsub(self, **kwargs) -> MemoryPubSub:
+        return MemoryPubSub(self)
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    async def info(self, section=None) -> dict:
+        return {'used_memory': sum(len(key) + len(value) for key, value in self.data.items())}
+
+    async def flushdb(self):
+        self.data.clear()
+        self.expires.clear()
+        self.zsets.clear()
+
+    async def close(self):
+        pass
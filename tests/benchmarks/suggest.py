@@ -0,0 +1,100 @@
+"""
+Микробенчмарк подсказок /api/v1/suggest: сборка индекса префиксов, инкрементальное обновление и задержка поиска.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/suggest.py
+    PYTHONPATH=src:tests/benchmarks python tests/benchmarks/suggest.py --films 100000 --persons 50000 --json
+
+Данные генерирует load_test.seed_dataset. Запросы - начала названий и имён длиной от 1 до 8 символов, как их
+набирает пользователь по буквам, плюс префиксы, которых нет в индексе. Задержка меряется для SuggestService.suggest
+целиком, вместе со сборкой моделей ответа, без HTTP: её и сравниваем с целевыми 5 мс p99.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from db.implementation.suggest_index import SUGGEST_SOURCES, PrefixIndex, SuggestEntry, SuggestIndex
+from load_test import seed_dataset
+from services.suggest import SuggestService
+
+MAX_PREFIX_LENGTH = 8
+
+
+def build(dataset: dict) -> tuple[SuggestIndex, dict]:
+    index = SuggestIndex(search_engine=None, refresh_interval=0, full_reload_interval=0)
+    timings = {}
+    for name, source in SUGGEST_SOURCES.items():
+        entries = [source.entry(document) for document in dataset[source.index]]
+        started = time.perf_counter()
+        index.indexes[name] = PrefixIndex.build(entries)
+        timings[f'build_{name}_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        timings[f'{name}_keys'] = len(index.indexes[name].keys)
+    return index, timings
+
+
+def queries(dataset: dict, count: int, rng: random.Random) -> list[str]:
+    texts = [movie['title'] for movie in dataset['movies']] + [person['full_name'] for person in dataset['persons']]
+    result = []
+    for _ in range(count):
+        text = rng.choice(texts)
+        # Ввод может начинаться и со второго слова названия
+        words = text.split()
+        text = ' '.join(words[rng.randrange(len(words)):])
+        result.append(text[:rng.randint(1, MAX_PREFIX_LENGTH)])
+    # Префиксы, которых нет в индексе: поиск должен быстро вернуть пустой ответ
+    result += ['zzq' + text for text in result[:count // 20]]
+    rng.shuffle(result)
+    return result
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=20000)
+    parser.add_argument('--persons', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--changed', type=int, default=100, help='documents changed for the incremental update')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    dataset = seed_dataset(args.films, args.persons, rng)
+    index, results = build(dataset)
+    service = SuggestService(index)
+
+    films = index.indexes['films']
+    changed = [SuggestEntry(entry.id, entry.text + ' Returns', entry.score)
+               for entry in rng.sample(list(films.entries.values()), min(args.changed, len(films)))]
+    started = time.perf_counter()
+    films.updated(changed)
+    results['incremental_update_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    latencies = []
+    for query in queries(dataset, args.queries, rng):
+        started = time.perf_counter()
+        service.suggest(query, args.limit)
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    latencies.sort()
+    results.update({
+        'queries': len(latencies),
+        'p50_us': round(statistics.median(latencies), 1),
+        'p99_us': round(percentile(latencies, 0.99), 1),
+        'max_us': round(latencies[-1], 1),
+        'queries_per_cpu_second': round(len(latencies) / (sum(latencies) / 1_000_000)),
+    })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        print(f'{name:<28}{value:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -44,7 +44,10 @@ async def get_films_data():
         'description': 'New World',
         'rating': 8.5,
         'type': 'movie',
-        'directors': ['Ben', 'Howard'],
+        'directors': [
+            {'id': '555', 'name': 'Ben'},
+            {'id': '666', 'name': 'Howard'}
+        ],
         'actors': [
             {'id': '111', 'name': 'Ann'},
             {'id': '222', 'name': 'Bob'}
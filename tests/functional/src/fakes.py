@@ -0,0 +1,183 @@
+import asyncio
+from collections import defaultdict
+
+
+async def wait_for(condition, timeout: float = 1.0):
+    # Подписчики pub/sub работают в отдельных задачах: ждём, пока они обработают сообщение
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'condition not reached'
+        await asyncio.sleep(0.001)
+
+
+class DictCache:
+    """Кеш в словаре с интерфейсом AsyncCacheStorage: значения хранятся как есть, без кодека."""
+
+    def __init__(self):
+        self.data = {}
+        # Прочитанные ключи и вызовы хранилища по порядку: по ним тесты проверяют, сколько было обращений
+        self.reads = []
+        self.calls = []
+
+    async def get(self, key: str, **kwargs):
+        self.calls.append(('get', [key]))
+        self.reads.append(key)
+        return self.data.get(key)
+
+    async def set(self, key: str, value, expire: int, **kwargs):
+        self.calls.append(('set', [key]))
+        if kwargs.get('nx') and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, key: str, **kwargs):
+        self.calls.append(('delete', [key]))
+        self.data.pop(key, None)
+
+    async def get_many(self, keys: list[str], **kwargs) -> list:
+        self.calls.append(('get_many', list(keys)))
+        self.reads.extend(keys)
+        return [self.data.get(key) for key in keys]
+
+    async def set_many(self, values: dict, expire: int, **kwargs):
+        self.calls.append(('set_many', list(values)))
+        self.data.update(values)
+
+
+class FakeRedis:
+    """Команды redis.asyncio.Redis, которыми пользуются кеш, фильтр Блума и счётчики популярности."""
+
+    def __init__(self):
+        self.strings = {}
+        self.zsets = defaultdict(dict)
+        self.published = []
+        self.commands = []
+        self.subscribers = defaultdict(list)
+        # Сколько следующих подписок завершится ошибкой соединения
+        self.failing_subscribes = 0
+        self.subscribes = 0
+
+    async def get(self, key):
+        self.commands.append(('get', key))
+        return self.strings.get(key)
+
+    async def mget(self, keys):
+        self.commands.append(('mget', list(keys)))
+        return [self.strings.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, nx=False):
+        self.commands.append(('set', key))
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    async def delete(self, key):
+        self.commands.append(('delete', key))
+        return int(self.strings.pop(key, None) is not None)
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+        return self._deliver(channel, message)
+
+    def _deliver(self, channel, message) -> int:
+        queues = self.subscribers[channel]
+        for queue in queues:
+            queue.put_nowait({'type': 'message', 'channel': channel.encode(), 'data': message.encode()})
+        return len(queues)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub(self)
+
+    def disconnect(self):
+        # Обрыв соединения: все подписки теряются, ожидающие сообщений получают ошибку
+        for queues in self.subscribers.values():
+            for queue in queues:
+                queue.put_nowait(ConnectionError('Connection closed by server.'))
+        self.subscribers.clear()
+
+    async def zrevrange(self, key, start, end):
+        zset = self.zsets[key]
+        return [member.encode() for member in sorted(zset, key=lambda member: -zset[member])[start:end + 1]]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.queued = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.queued.append(('set', key))
+        self.redis.strings[key] = value
+
+    def delete(self, *keys):
+        self.queued.append(('delete', list(keys)))
+        for key in keys:
+            self.redis.strings.pop(key, None)
+
+    def publish(self, channel, message):
+        self.queued.append(('publish', channel))
+        self.redis.published.append((channel, message))
+        self.redis._deliver(channel, message)
+
+    def zincrby(self, key, amount, member):
+        self.redis.zsets[key][member] = self.redis.zsets[key].get(member, 0) + amount
+
+    def zremrangebyrank(self, key, start, end):
+        zset = self.redis.zsets[key]
+        for member in sorted(zset, key=zset.get)[start:len(zset) + end + 1]:
+            del zset[member]
+
+    def zunionstore(self, dest, weights):
+        (key, weight), = weights.items()
+        self.redis.zsets[dest] = {member: score * weight for member, score in self.redis.zsets[key].items()}
+
+    def zremrangebyscore(self, key, low, high):
+        limit = float(high.lstrip('('))
+        self.redis.zsets[key] = {member: score for member, score in self.redis.zsets[key].items() if score >= limit}
+
+    async def execute(self):
+        self.redis.commands.append(('pipeline', [key for command, key in self.queued if command == 'set']))
+        return [True] * len(self.queued)
+
+
+class FakePubSub:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.channels = set()
+
+    async def subscribe(self, *channels):
+        self.redis.subscribes += 1
+        if self.redis.failing_subscribes:
+            self.redis.failing_subscribes -= 1
+            raise ConnectionError('Connection refused.')
+        for channel in channels:
+            self.channels.add(channel)
+            self.redis.subscribers[channel].append(self.queue)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels or tuple(self.channels):
+            self.channels.discard(channel)
+            if self.queue in self.redis.subscribers.get(channel, ()):
+                self.redis.subscribers[channel].remove(self.queue)
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def close(self):
+        await self.unsubscribe()
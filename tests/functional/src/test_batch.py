@@ -0,0 +1,138 @@
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import films
+from db.implementation import cache as cache_module
+from db.implementation.cache import MemcachedRepository, TwoTierCacheRepository
+from db.implementation.codecs import CacheCodec
+from db.implementation.local_cache import BoundedTTLCache
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from models.film import Film
+from services.base import etag_key
+from services.film import FilmService, get_film_service
+from tests.functional.src.fakes import DictCache, FakeRedis
+
+
+class CountingSearchEngine(InMemorySearchEngine):
+    def __init__(self):
+        super().__init__()
+        self.mgets = []
+
+    async def mget(self, index: str, ids: list[str], **kwargs):
+        self.mgets.append(list(ids))
+        return await super().mget(index, ids, **kwargs)
+
+
+def film_id(index: int) -> str:
+    return str(uuid.UUID(int=index))
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': film_id(index),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def search_engine() -> CountingSearchEngine:
+    search_engine = CountingSearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 6)])
+    return search_engine
+
+
+@pytest.fixture
+def redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(cache_module, 'redis', redis, raising=False)
+    return redis
+
+
+@pytest.mark.asyncio
+async def test_get_many_loads_only_misses_in_request_order(search_engine):
+    cache = DictCache()
+    service = FilmService(cache, search_engine)
+    await service.get_by_id(film_id(2))
+    cache.calls.clear()
+
+    # Дубликаты, закешированный документ, промахи и несуществующий ID вперемешку
+    ids = [film_id(4), film_id(99), film_id(2), film_id(1), film_id(4)]
+    docs = await service.get_many(ids)
+
+    assert [doc and str(doc.id) for doc in docs] == [film_id(4), None, film_id(2), film_id(1), film_id(4)]
+    # Один MGET на уникальные ID, один mget только на промахи, одна запись пачкой
+    assert cache.calls[0] == ('get_many', [film_id(4), film_id(99), film_id(2), film_id(1)])
+    assert search_engine.mgets[-1] == [film_id(4), film_id(99), film_id(1)]
+    set_many = [keys for call, keys in cache.calls if call == 'set_many' and film_id(4) in keys]
+    assert set_many == [[film_id(4), etag_key(film_id(4)), film_id(1), etag_key(film_id(1))]]
+
+    # Повторная пачка целиком из кеша, в Elasticsearch уходит только отсутствующий документ
+    mgets = len(search_engine.mgets)
+    assert [doc and str(doc.id) for doc in await service.get_many(ids[:4])] == [film_id(4), None, film_id(2), film_id(1)]
+    assert search_engine.mgets[mgets:] == [[film_id(99)]]
+
+
+@pytest.mark.asyncio
+async def test_redis_get_many_and_set_many_are_single_round_trips(redis):
+    repository = MemcachedRepository(CacheCodec())
+    film = Film(**make_film(1))
+
+    await repository.set_many({film_id(1): film, 'plain': b'value'}, 60)
+    assert redis.commands == [('pipeline', [film_id(1), 'plain'])]
+
+    values = await repository.get_many([film_id(2), film_id(1), film_id(3)], model=Film)
+    assert values == [None, film, None]
+    assert redis.commands[-1] == ('mget', [film_id(2), film_id(1), film_id(3)])
+    assert repository.stats() == {'hits': 1, 'misses': 2}
+
+    # Пустая пачка не ходит в Redis
+    assert await repository.get_many([]) == []
+    await repository.set_many({}, 60)
+    assert len(redis.commands) == 2
+
+
+@pytest.mark.asyncio
+async def test_two_tier_get_many_reads_redis_only_for_l1_misses(redis):
+    codec = CacheCodec()
+    repository = TwoTierCacheRepository(MemcachedRepository(codec), BoundedTTLCache(100, 1 << 20, 60), codec)
+    first, second = Film(**make_film(1)), Film(**make_film(2))
+    await repository.set(film_id(1), first, 60)
+    redis.strings[film_id(2)] = codec.encode(second)
+    redis.commands.clear()
+
+    values = await repository.get_many([film_id(2), film_id(3), film_id(1)], model=Film)
+    assert values == [second, None, first]
+    # Документ из L1 в MGET не попал
+    assert redis.commands == [('mget', [film_id(2), film_id(3)])]
+
+    # Загруженный из Redis документ теперь в L1
+    redis.commands.clear()
+    assert await repository.get_many([film_id(1), film_id(2)], model=Film) == [first, second]
+    assert redis.commands == []
+
+
+@pytest.mark.asyncio
+async def test_batch_route_keeps_request_order(search_engine):
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: FilmService(DictCache(), search_engine)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        response = await client.post('/api/v1/films/batch', json={'ids': [film_id(3), 'missing', film_id(1)]})
+        empty = await client.post('/api/v1/films/batch', json={'ids': []})
+
+    assert [(item['id'], item['found']) for item in response.json()] == [
+        (film_id(3), True), ('missing', False), (film_id(1), True)]
+    assert response.json()[0]['item']['title'] == 'Film 3'
+    assert empty.status_code == 422
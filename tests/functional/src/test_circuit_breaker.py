@@ -0,0 +1,193 @@
+import uuid
+
+import httpx
+import pytest
+from elasticsearch import ConnectionError, NotFoundError
+from fastapi import FastAPI
+
+from api.v1 import films
+from core.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState, circuit_open_handler
+from core.response_cache import ResponseCacheMiddleware
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from db.implementation.search_engine import InstrumentedSearchEngine, is_search_engine_failure
+from services.film import FilmService, get_film_service
+from tests.functional.src.fakes import DictCache
+
+
+class FlakySearchEngine(InMemorySearchEngine):
+    """Поиск в памяти, который по флагу down отвечает ошибкой соединения, как недоступный Elasticsearch."""
+
+    down = False
+
+    async def get(self, index: str, id: str, **kwargs):
+        self._fail()
+        return await super().get(index, id, **kwargs)
+
+    async def search(self, index: str, body: dict, **kwargs):
+        self._fail()
+        return await super().search(index, body, **kwargs)
+
+    async def scan_pages(self, *args, **kwargs):
+        async for page in super().scan_pages(*args, **kwargs):
+            self._fail()
+            yield page
+
+    def _fail(self):
+        if self.down:
+            raise ConnectionError('N/A', 'connection refused', None)
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = {'window_size': 4, 'minimum_calls': 4, 'open_duration': 0.0, 'half_open_calls': 2}
+    return CircuitBreaker('test', is_failure=is_search_engine_failure, **{**options, **kwargs})
+
+
+def test_breaker_opens_on_failures_and_closes_after_probes():
+    breaker = make_breaker(open_duration=60.0)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_success(0.01)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_failure(ConnectionError('N/A', 'refused', None), 0.01)
+
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert 0 < error.value.retry_after <= 60
+
+    # open_duration прошёл: пропускаются только half_open_calls пробных запросов
+    breaker.open_duration = 0.0
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.state == CircuitState.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.on_success(0.01)
+    breaker.on_success(0.01)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_breaker_opens_on_slow_calls_but_not_on_not_found():
+    breaker = make_breaker(slow_call_duration=1.0, slow_call_rate_threshold=0.5)
+    for _ in range(4):
+        breaker.before_call()
+        breaker.on_failure(NotFoundError(404, 'not_found', {}), 0.01)
+    assert breaker.state == CircuitState.CLOSED
+
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_success(1.5)
+    assert breaker.state == CircuitState.OPEN
+
+    # Неудачный пробный запрос снова открывает breaker
+    breaker.before_call()
+    breaker.on_success(1.5)
+    assert breaker.state == CircuitState.OPEN
+
+
+@pytest.fixture
+def search_engine() -> FlakySearchEngine:
+    search_engine = FlakySearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 4)])
+    return search_engine
+
+
+@pytest.mark.asyncio
+async def test_film_served_from_last_known_good_while_open(search_engine):
+    cache = DictCache()
+    breaker = make_breaker(open_duration=60.0)
+    service = FilmService(cache, InstrumentedSearchEngine(search_engine, 'memory', breaker))
+    film_id = str(uuid.UUID(int=1))
+
+    assert (await service.get_by_id(film_id)).title == 'Film 1'
+    # Основной ключ истёк, осталась только последняя известная копия
+    del cache.data[film_id]
+
+    # Вместе с первым успешным запросом в окне 4 запроса, 3 из них - ошибки
+    search_engine.down = True
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            await service.get_by_id(str(uuid.UUID(int=2)))
+    assert breaker.state == CircuitState.OPEN
+
+    calls = sum(service.search_engine.calls.values())
+    assert (await service.get_by_id(film_id)).title == 'Film 1'
+    assert sum(service.search_engine.calls.values()) == calls
+
+    # Копии нет - не 404, а CircuitOpenError
+    with pytest.raises(CircuitOpenError):
+        await service.get_by_id(str(uuid.UUID(int=3)))
+    with pytest.raises(CircuitOpenError):
+        await service.get_many([film_id, str(uuid.UUID(int=3))])
+
+
+@pytest.mark.asyncio
+async def test_routes_serve_stale_list_or_503_while_open(search_engine):
+    cache = DictCache()
+    breaker = make_breaker(open_duration=60.0)
+    service = FilmService(cache, InstrumentedSearchEngine(search_engine, 'memory', breaker))
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: service
+    app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+    app.add_middleware(ResponseCacheMiddleware, cache=cache, routes={'/api/v1/films': 60}, stale_expire=3600)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                                 base_url='http://test') as client:
+        fresh = await client.get('/api/v1/films', params={'sort': '-rating'})
+        # Закешированный ответ истёк, последняя известная копия осталась
+        del cache.data['response:/api/v1/films?sort=-rating']
+
+        search_engine.down = True
+        for _ in range(4):
+            await client.get('/api/v1/films', params={'sort': 'title'})
+        assert breaker.state == CircuitState.OPEN
+
+        stale = await client.get('/api/v1/films', params={'sort': '-rating'})
+        unavailable = await client.get(f'/api/v1/films/{uuid.UUID(int=3)}')
+
+    assert stale.status_code == 200
+    assert stale.headers['x-cache'] == 'STALE'
+    assert stale.json() == fresh.json()
+
+    assert unavailable.status_code == 503
+    assert 1 <= int(unavailable.headers['retry-after']) <= 60
+
+
+@pytest.mark.asyncio
+async def test_scan_pages_go_through_breaker(search_engine):
+    breaker = make_breaker(open_duration=60.0)
+    instrumented = InstrumentedSearchEngine(search_engine, 'memory', breaker)
+
+    # Каждая страница и завершение обхода - отдельные запросы
+    hits = [hit async for hit in instrumented.scan_stream('movies', page_size=2)]
+    assert len(hits) == 3
+    assert instrumented.calls['scan'] == 3
+
+    # В окне 4 запроса, 2 из них - ошибки первой страницы
+    search_engine.down = True
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            [hit async for hit in instrumented.scan_stream('movies', page_size=2)]
+    assert breaker.state == CircuitState.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        [hit async for hit in instrumented.scan_stream('movies', page_size=2)]
@@ -0,0 +1,106 @@
+import uuid
+
+import pytest
+
+from db.abstract.cache import CacheEnvelope
+from db.implementation import codecs
+from db.implementation.codecs import (
+    COMPRESSIONS, ENVELOPE_FLAG, ENVELOPE_HEADER, LEGACY_ENVELOPE_SIGNATURE, SERIALIZERS, CacheCodec,
+)
+from models.film import Film
+
+# Модуль, без которого формат недоступен
+REQUIRED_MODULES = {'msgpack': 'msgpack', 'lz4': 'lz4', 'zstd': 'zstandard'}
+
+
+def make_film(description: str = 'description') -> Film:
+    return Film(
+        id=uuid.UUID(int=1),
+        title='Film',
+        description=description,
+        creation_date='2000-01-01T12:30:00',
+        rating=7.5,
+        type='movie',
+        genres=['Drama', 'Sci-Fi'],
+        actors=[{'id': str(uuid.UUID(int=2)), 'name': 'Actor'}],
+        directors=[],
+        screenwriters=[],
+    )
+
+
+def make_codec(serializer: str, compression: str, **kwargs) -> CacheCodec:
+    for name in (serializer, compression):
+        if name in REQUIRED_MODULES and getattr(codecs, REQUIRED_MODULES[name]) is None:
+            pytest.skip(f'{REQUIRED_MODULES[name]} is not installed')
+    return CacheCodec(serializer, compression, **kwargs)
+
+
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+@pytest.mark.parametrize('serializer', list(SERIALIZERS))
+def test_round_trip(serializer, compression):
+    codec = make_codec(serializer, compression, compression_threshold=500)
+    small, large = make_film(), make_film('long description ' * 100)
+
+    data = codec.encode(large)
+    assert data[0] == SERIALIZERS[serializer] | COMPRESSIONS[compression] << codecs.COMPRESSION_SHIFT
+    assert codec.decode(data, Film) == large
+    if compression != 'none':
+        assert len(data) < len(large.json())
+
+    # Значение меньше порога не сжимается
+    data = codec.encode(small)
+    assert data[0] == SERIALIZERS[serializer]
+    assert codec.decode(data, Film) == small
+
+    envelope = CacheEnvelope(large, 1_700_000_000.5, 0.25)
+    data = codec.encode(envelope)
+    assert data[0] & ENVELOPE_FLAG
+    assert codec.decode(data, Film) == envelope
+
+
+def test_any_codec_reads_every_format():
+    # Формат записи можно сменить в настройках без сброса кеша: заголовок говорит, чем читать значение
+    writers = [CacheCodec(), make_codec('msgpack', 'zstd', compression_threshold=0)]
+    reader = CacheCodec()
+    film = make_film()
+    for writer in writers:
+        assert reader.decode(writer.encode(film), Film) == film
+        assert reader.decode(writer.encode(CacheEnvelope(film, 10.0, 1.0)), Film) == CacheEnvelope(film, 10.0, 1.0)
+
+
+def test_legacy_json_and_swr1_envelope_are_decoded():
+    codec = CacheCodec()
+    film = make_film()
+
+    # Значения, записанные до появления кодеков
+    assert codec.decode(film.json(), Film) == film
+    assert codec.decode(film.json().encode(), Film) == film
+
+    legacy = LEGACY_ENVELOPE_SIGNATURE + ENVELOPE_HEADER.pack(123.5, 0.75) + film.json().encode()
+    assert codec.decode(legacy, Film) == CacheEnvelope(film, 123.5, 0.75)
+
+
+def test_non_models_are_stored_as_is():
+    codec = CacheCodec(compression_threshold=0)
+    assert codec.encode(b'{"raw": true}') == b'{"raw": true}'
+    assert codec.encode('etag') == 'etag'
+
+
+def test_unknown_formats_are_rejected():
+    with pytest.raises(ValueError):
+        CacheCodec(serializer='pickle')
+    with pytest.raises(ValueError):
+        CacheCodec(compression='brotli')
+    with pytest.raises(ValueError):
+        CacheCodec().decode(bytes([0x0F]) + b'payload', Film)
+    with pytest.raises(ValueError):
+        CacheCodec().decode(bytes([SERIALIZERS['orjson'] | 3 << codecs.COMPRESSION_SHIFT]) + b'payload', Film)
+
+
+def test_missing_optional_dependency_fails_at_construction(monkeypatch):
+    monkeypatch.setattr(codecs, 'msgpack', None)
+    monkeypatch.setattr(codecs, 'zstandard', None)
+    with pytest.raises(ImportError):
+        CacheCodec(serializer='msgpack')
+    with pytest.raises(ImportError):
+        CacheCodec(compression='zstd')
@@ -0,0 +1,123 @@
+import gzip
+
+import httpx
+import orjson
+import pytest
+import zstandard
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from core import response_cache
+from core.compression import CompressionMiddleware, negotiate_encoding
+from core.response_cache import ResponseCacheMiddleware
+from tests.functional.src.fakes import DictCache
+
+FILMS = [{'id': index, 'title': f'Film {index}', 'description': 'long description ' * 10} for index in range(50)]
+
+
+@pytest.fixture
+def cache() -> DictCache:
+    return DictCache()
+
+
+@pytest.fixture
+def client(cache) -> httpx.AsyncClient:
+    app = FastAPI()
+
+    @app.get('/films')
+    async def films():
+        return FILMS
+
+    @app.get('/catalog')
+    async def catalog():
+        return FILMS
+
+    @app.get('/stream')
+    async def stream():
+        async def lines():
+            for film in FILMS:
+                yield orjson.dumps(film) + b'\n'
+
+        return StreamingResponse(lines(), media_type='text/plain')
+
+    @app.get('/films/{index}')
+    async def film(index: int):
+        return FILMS[index]
+
+    app.add_middleware(ResponseCacheMiddleware, cache=cache, routes={'/films': 60},
+                       encodings=('zstd', 'gzip'), minimum_size=1024)
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, encodings=('zstd', 'gzip'))
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+def test_negotiate_encoding():
+    encodings = ('zstd', 'br', 'gzip')
+    assert negotiate_encoding(None, encodings) is None
+    assert negotiate_encoding('identity', encodings) is None
+    assert negotiate_encoding('gzip, deflate, br', encodings) == 'br'
+    assert negotiate_encoding('gzip, zstd;q=0.5', encodings) == 'gzip'
+    assert negotiate_encoding('*;q=0.1, gzip;q=0', encodings) == 'zstd'
+    assert negotiate_encoding('zstd;q=0', ('zstd',)) is None
+
+
+async def raw_get(client: httpx.AsyncClient, url: str, accept_encoding: str) -> tuple[httpx.Response, bytes]:
+    async with client.stream('GET', url, headers={'Accept-Encoding': accept_encoding}) as response:
+        return response, b''.join([chunk async for chunk in response.aiter_raw()])
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_serves_stored_compressed_variant(client, cache, monkeypatch):
+    async with client:
+        miss, miss_body = await raw_get(client, '/films', 'gzip')
+        assert miss.headers['x-cache'] == 'MISS'
+        assert sorted(cache.data) == [
+            'response:/films?', 'response:/films?#etag', 'response:/films?#gzip', 'response:/films?#zstd',
+        ]
+
+        # Попадание в кеш отдаёт готовые байты и ничего не сжимает
+        def fail(body, encoding):
+            raise AssertionError('cache hit must not compress')
+
+        monkeypatch.setattr(response_cache, 'compress', fail)
+        hit, hit_body = await raw_get(client, '/films', 'gzip')
+        zstd, zstd_body = await raw_get(client, '/films', 'zstd, gzip')
+        plain = await client.get('/films', headers={'Accept-Encoding': 'identity'})
+
+    assert hit.headers['x-cache'] == 'HIT'
+    assert hit.headers['content-encoding'] == 'gzip'
+    assert hit_body == miss_body
+    assert orjson.loads(gzip.decompress(hit_body)) == FILMS
+
+    assert zstd.headers['content-encoding'] == 'zstd'
+    assert orjson.loads(zstandard.ZstdDecompressor().decompress(zstd_body)) == FILMS
+
+    assert 'content-encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['vary']
+    assert plain.json() == FILMS
+
+
+@pytest.mark.asyncio
+async def test_uncached_responses_are_compressed_from_minimum_size(client):
+    async with client:
+        small, small_body = await raw_get(client, '/films/1', 'gzip')
+        large, large_body = await raw_get(client, '/catalog', 'gzip')
+
+    assert 'content-encoding' not in small.headers
+    assert small.headers['vary'] == 'Accept-Encoding'
+    assert orjson.loads(small_body) == FILMS[1]
+
+    assert 'x-cache' not in large.headers
+    assert large.headers['content-encoding'] == 'gzip'
+    assert int(large.headers['content-length']) == len(large_body)
+    assert orjson.loads(gzip.decompress(large_body)) == FILMS
+
+
+@pytest.mark.asyncio
+async def test_stream_without_content_length_is_compressed_in_chunks(client):
+    async with client:
+        response, body = await raw_get(client, '/stream', 'zstd')
+
+    assert response.headers['content-encoding'] == 'zstd'
+    assert 'content-length' not in response.headers
+    lines = zstandard.ZstdDecompressor().decompressobj().decompress(body).splitlines()
+    assert [orjson.loads(line) for line in lines] == FILMS
@@ -0,0 +1,132 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from elasticsearch import NotFoundError
+from fastapi import FastAPI
+
+from api.v1 import films
+from core.cursor import InvalidCursorError, decode_cursor, encode_cursor
+from db.implementation import memory_search_engine
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from services.film import FilmService, get_film_service
+from tests.functional.src.fakes import DictCache
+
+
+class CountingSearchEngine(InMemorySearchEngine):
+    def __init__(self):
+        super().__init__()
+        self.searches = 0
+        self.opened = 0
+
+    async def search(self, index: str, body: dict, **kwargs):
+        self.searches += 1
+        return await super().search(index, body, **kwargs)
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> str:
+        self.opened += 1
+        return await super().open_point_in_time(index, keep_alive, **kwargs)
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        # Много одинаковых рейтингов: порядок внутри них задаёт id
+        'rating': float(index % 3),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def search_engine() -> CountingSearchEngine:
+    search_engine = CountingSearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 24)])
+    return search_engine
+
+
+@pytest.fixture
+def film_service(search_engine) -> FilmService:
+    return FilmService(DictCache(), search_engine)
+
+
+@pytest.mark.asyncio
+async def test_first_page_without_point_in_time(film_service, search_engine):
+    # 1. Первая страница - один запрос без point in time, курсор тоже без него
+    page = await film_service.get_all(page_size=5, sort='-rating')
+    assert search_engine.searches == 1
+    assert search_engine.opened == 0
+    assert 'pit' not in decode_cursor(page.cursor)
+
+    # 2. Point in time открывается, только когда клиент идёт по курсору, и закрывается на последней странице
+    ids = [str(film.id) for film in page.films]
+    while page is not None and page.cursor:
+        page = await film_service.get_all(page_size=5, cursor=page.cursor)
+        if page is not None:
+            ids.extend(str(film.id) for film in page.films)
+
+    assert search_engine.opened == 1
+    assert search_engine._pits == {}
+    expected = sorted((make_film(index) for index in range(1, 24)), key=lambda film: (-film['rating'], film['id']))
+    assert ids == [film['id'] for film in expected]
+
+
+@pytest.mark.asyncio
+async def test_expired_point_in_time_continues_on_live_index(film_service, search_engine):
+    page = await film_service.get_all(page_size=5, sort='rating')
+    page = await film_service.get_all(page_size=5, cursor=page.cursor)
+    state = decode_cursor(page.cursor)
+    assert state['pit'] and len(state['after']) == 3
+
+    # Point in time истёк между страницами: следующая страница приходит без него
+    await search_engine.close_point_in_time(state['pit'])
+    next_page = await film_service.get_all(page_size=5, cursor=page.cursor)
+    assert [film.rating for film in next_page.films] == [1.0] * 5
+    assert decode_cursor(next_page.cursor)['pit'] is None
+
+
+@pytest.mark.asyncio
+async def test_tampered_cursor_is_client_error(film_service, search_engine):
+    page = await film_service.get_all(page_size=5, sort='-rating')
+    state = decode_cursor(page.cursor)
+
+    # Неверная длина search_after отсекается до похода в Elasticsearch
+    searches = search_engine.searches
+    with pytest.raises(InvalidCursorError):
+        await film_service.get_all(page_size=5, cursor=encode_cursor({**state, 'after': state['after'] + [1]}))
+    assert search_engine.searches == searches
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: film_service
+
+    # Значения не того типа Elasticsearch отвергает ошибкой запроса - это 400, а не 500
+    tampered = encode_cursor({**state, 'after': ['high', 'abc']})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        response = await client.get('/api/v1/films', params={'cursor': tampered})
+
+    assert response.status_code == 400
+    # Открытый ради этого курсора point in time закрыт
+    assert search_engine._pits == {}
+
+
+@pytest.mark.asyncio
+async def test_point_in_time_expires_and_is_bounded(monkeypatch):
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(1)])
+
+    pit_id = await search_engine.open_point_in_time('movies', keep_alive='10ms')
+    await asyncio.sleep(0.02)
+    with pytest.raises(NotFoundError):
+        await search_engine.search('movies', {'pit': {'id': pit_id}})
+
+    monkeypatch.setattr(memory_search_engine, 'MAX_OPEN_PITS', 3)
+    pit_ids = [await search_engine.open_point_in_time('movies', keep_alive='5m') for _ in range(5)]
+    assert list(search_engine._pits) == pit_ids[2:]
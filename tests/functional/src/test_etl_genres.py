@@ -0,0 +1,153 @@
+import json
+
+import pytest
+from elasticsearch.serializer import JSONSerializer
+
+from db.implementation.existence import ADD_MESSAGE_PREFIX
+from etl import genres as etl_genres
+from etl.existence import ExistenceNotifier
+from etl.state import JsonFileStorage
+from tests.functional.src.fakes import FakeRedis
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeIndices:
+    def __init__(self, client):
+        self.client = client
+
+    async def exists(self, index: str, **kwargs):
+        return index in self.client.indexes
+
+    async def create(self, index: str, body: dict, **kwargs):
+        self.client.indexes.setdefault(index, {})
+
+
+class FakeElasticsearch:
+    """Elasticsearch в памяти: point in time, search_after по id и bulk update с upsert."""
+
+    def __init__(self, movies: list[dict], fail_after_searches: int | None = None):
+        self.indexes = {'movies': {movie['id']: movie for movie in movies}}
+        self.indices = FakeIndices(self)
+        self.transport = FakeTransport()
+        self.fail_after_searches = fail_after_searches
+        self.scanned = 0
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs):
+        return {'id': f'pit-{index}'}
+
+    async def close_point_in_time(self, body: dict, **kwargs):
+        return {'succeeded': True}
+
+    async def search(self, body: dict, **kwargs):
+        if self.fail_after_searches is not None:
+            if self.fail_after_searches == 0:
+                raise ConnectionError('elasticsearch went away')
+            self.fail_after_searches -= 1
+
+        docs = sorted(self.indexes['movies'].values(), key=lambda doc: doc['id'])
+        if body.get('search_after'):
+            docs = [doc for doc in docs if doc['id'] > body['search_after'][0]]
+        docs = docs[:body['size']]
+        self.scanned += len(docs)
+        return {
+            'pit_id': body['pit']['id'],
+            'hits': {'hits': [{'_source': {'genres': doc['genres']}, 'sort': [doc['id']]} for doc in docs]},
+        }
+
+    async def bulk(self, body: str, **kwargs):
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            meta = action['update']
+            index = self.indexes.setdefault(meta['_index'], {})
+            if meta['_id'] in index:
+                index[meta['_id']].update(source['doc'])
+            else:
+                index[meta['_id']] = source['upsert']
+            items.append({'update': {'_id': meta['_id'], 'status': 200}})
+        return {'errors': False, 'items': items}
+
+
+def make_movies(count: int) -> list[dict]:
+    return [
+        {'id': f'{i:05}', 'genres': ['Action', 'Drama'] if i % 2 else ['Action']}
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_genres_are_counted_across_all_films(tmp_path):
+    # 1. Строим индекс жанров по 1000 фильмам небольшими страницами
+    client = FakeElasticsearch(make_movies(1000))
+    storage = JsonFileStorage(str(tmp_path / 'state.json'))
+    report = await etl_genres.run(client, storage, page_size=64, chunk_size=1, concurrency=2)
+
+    # 2. Проверяем счётчики фильмов и то, что файл состояния удалён
+    genres = {doc['name']: doc['film_count'] for doc in client.indexes['genres'].values()}
+    assert genres == {'Action': 1000, 'Drama': 500}
+    assert report.scanned == 1000
+    assert report.written == 2
+    assert storage.load() == {}
+
+
+@pytest.mark.asyncio
+async def test_interrupted_run_resumes_from_checkpoint(tmp_path):
+    # 1. Обрываем первый запуск после трёх страниц
+    movies = make_movies(1000)
+    storage = JsonFileStorage(str(tmp_path / 'state.json'))
+    with pytest.raises(ConnectionError):
+        await etl_genres.run(FakeElasticsearch(movies, fail_after_searches=3), storage, page_size=100)
+    assert storage.load()['scanned'] == 300
+
+    # 2. Повторный запуск дочитывает только оставшиеся фильмы
+    client = FakeElasticsearch(movies)
+    report = await etl_genres.run(client, storage, page_size=100)
+
+    assert report.resumed
+    assert client.scanned == 700
+    genres = {doc['name']: doc['film_count'] for doc in client.indexes['genres'].values()}
+    assert genres == {'Action': 1000, 'Drama': 500}
+
+
+@pytest.mark.asyncio
+async def test_genre_spellings_are_counted_as_one_genre(tmp_path):
+    movies = [
+        {'id': '00001', 'genres': ['Sci-Fi', 'Drama']},
+        {'id': '00002', 'genres': ['sci-fi']},
+        {'id': '00003', 'genres': [' SCI-FI ', '  ']},
+    ]
+    client = FakeElasticsearch(movies)
+    report = await etl_genres.run(client, JsonFileStorage(str(tmp_path / 'state.json')), page_size=2)
+
+    # Один документ на жанр: название - первое встреченное написание, счётчик - по всем написаниям
+    assert report.written == 2
+    assert client.indexes['genres'][etl_genres.genre_id('Sci-Fi')]['name'] == 'Sci-Fi'
+    genres = {doc['name']: doc['film_count'] for doc in client.indexes['genres'].values()}
+    assert genres == {'Sci-Fi': 3, 'Drama': 1}
+
+
+@pytest.mark.asyncio
+async def test_written_genres_are_announced_to_existence_filters(tmp_path):
+    redis = FakeRedis()
+    storage = JsonFileStorage(str(tmp_path / 'state.json'))
+    notify = ExistenceNotifier(redis, etl_genres.GENRES_INDEX)
+
+    # Если рассылка не удалась, состояние остаётся, и повторный запуск разошлёт жанры снова
+    async def failing_notify(ids: list[str]):
+        raise ConnectionError('redis is down')
+
+    with pytest.raises(ConnectionError):
+        await etl_genres.run(FakeElasticsearch(make_movies(10)), storage, notify=failing_notify)
+    assert storage.load()['phase'] == etl_genres.PHASE_WRITE
+
+    client = FakeElasticsearch(make_movies(10))
+    await etl_genres.run(client, storage, notify=notify)
+
+    # Фильтр Блума воркеров API узнаёт о жанрах сразу, а не после перестроения
+    assert {channel for channel, _ in redis.published} == {'bloom:genres'}
+    announced = {message.split(':', 1)[1] for _, message in redis.published}
+    assert announced == {f'{ADD_MESSAGE_PREFIX}{doc_id}' for doc_id in client.indexes['genres']}
+    assert storage.load() == {}
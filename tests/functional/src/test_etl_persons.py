@@ -0,0 +1,151 @@
+import datetime
+import json
+import operator
+import re
+import uuid
+
+import pytest
+from elasticsearch.serializer import JSONSerializer
+
+from etl import persons as etl_persons
+from etl.state import JsonFileStorage
+from tests.functional.src.fakes import FakeRedis
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeIndices:
+    async def exists(self, index: str, **kwargs):
+        return True
+
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.docs = {}
+        self.indices = FakeIndices()
+        self.transport = FakeTransport()
+
+    async def bulk(self, body: str, **kwargs):
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        for action, source in zip(lines[::2], lines[1::2]):
+            self.docs[action['index']['_id']] = source
+        return {'errors': False, 'items': [{'index': {'status': 201}} for _ in lines[::2]]}
+
+
+# Сравнения с отметкой в выборках CHANGED_PERSONS_QUERY до постраничного обхода по паре (changed_at, id)
+CHANGED_FILTERS = re.findall(r'WHERE (?:modified|created) (>=?) \$1', etl_persons.CHANGED_PERSONS_QUERY)
+OPERATORS = {'>': operator.gt, '>=': operator.ge}
+
+
+class FakeSource:
+    """Таблица персон: changed_since повторяет постраничную выборку CHANGED_PERSONS_QUERY."""
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = 0
+
+    def upsert(self, person_id: uuid.UUID, full_name: str, changed_at: datetime.datetime, roles: list[tuple]):
+        self.rows[person_id] = {
+            'id': person_id,
+            'full_name': full_name,
+            'gender': 'male',
+            'created': changed_at,
+            'modified': changed_at,
+            'changed_at': changed_at,
+            'film_ids': [film_id for film_id, _ in roles],
+            'roles': [role for _, role in roles],
+        }
+
+    async def changed_since(self, changed_at: datetime.datetime, person_id: uuid.UUID, limit: int):
+        self.queries += 1
+        changed = OPERATORS[CHANGED_FILTERS[0]]
+        rows = sorted(self.rows.values(), key=lambda row: (row['changed_at'], row['id']))
+        rows = [row for row in rows if changed(row['changed_at'], changed_at)]
+        return [row for row in rows if (row['changed_at'], row['id']) > (changed_at, person_id)][:limit]
+
+
+class FakeInvalidator:
+    def __init__(self):
+        self.ids = []
+
+    async def __call__(self, ids: list[str]):
+        self.ids.extend(ids)
+
+
+def timestamp(minutes: int) -> datetime.datetime:
+    return datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=minutes)
+
+
+@pytest.mark.asyncio
+async def test_only_changed_persons_are_reloaded(tmp_path):
+    # 1. Первый запуск загружает всех персон пачками и сохраняет отметку
+    source = FakeSource()
+    person_ids = [uuid.uuid4() for _ in range(25)]
+    for minute, person_id in enumerate(person_ids):
+        source.upsert(person_id, f'Person {minute}', timestamp(minute), [('f1', 'actor'), ('f1', 'director')])
+
+    client = FakeElasticsearch()
+    storage = JsonFileStorage(str(tmp_path / 'state.json'))
+    report = await etl_persons.run(source, client, storage, FakeInvalidator(), batch_size=10)
+
+    assert report.written == 25
+    assert report.batches == 3
+    assert client.docs[str(person_ids[0])]['films'] == [{'id': 'f1', 'roles': ['actor', 'director']}]
+    assert storage.load()['persons']['id'] == str(person_ids[-1])
+
+    # 2. Без изменений повторный запуск ничего не пишет
+    report = await etl_persons.run(source, client, storage, FakeInvalidator(), batch_size=10)
+    assert report.written == 0
+
+    # 3. Изменённая персона перезаписывается и удаляется из кеша
+    source.upsert(person_ids[3], 'Renamed', timestamp(100), [('f2', 'writer')])
+    invalidator = FakeInvalidator()
+    report = await etl_persons.run(source, client, storage, invalidator, batch_size=10)
+
+    assert report.written == 1
+    assert invalidator.ids == [str(person_ids[3])]
+    assert client.docs[str(person_ids[3])]['full_name'] == 'Renamed'
+    assert client.docs[str(person_ids[3])]['films'] == [{'id': 'f2', 'roles': ['writer']}]
+
+
+@pytest.mark.asyncio
+async def test_persons_sharing_timestamp_across_batch_boundary(tmp_path):
+    assert CHANGED_FILTERS == ['>=', '>=']
+
+    # Вторая и третья персоны изменены в одну и ту же минуту, а граница пачки проходит между ними
+    source = FakeSource()
+    first, second, third = (uuid.UUID(int=index) for index in range(1, 4))
+    source.upsert(first, 'First', timestamp(0), [])
+    source.upsert(second, 'Second', timestamp(1), [])
+    source.upsert(third, 'Third', timestamp(1), [])
+
+    client = FakeElasticsearch()
+    storage = JsonFileStorage(str(tmp_path / 'state.json'))
+    report = await etl_persons.run(source, client, storage, FakeInvalidator(), batch_size=2)
+
+    assert report.written == 3
+    assert set(client.docs) == {str(first), str(second), str(third)}
+    assert storage.load()['persons'] == {'changed_at': timestamp(1).isoformat(), 'id': str(third)}
+
+    # Персона с той же отметкой, но ID меньше последнего, уже загружена и не перечитывается
+    report = await etl_persons.run(source, client, storage, FakeInvalidator(), batch_size=2)
+    assert report.written == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidator_drops_document_etag_and_last_known_good():
+    redis = FakeRedis()
+    person_id = str(uuid.UUID(int=1))
+    for key in (person_id, f'etag:{person_id}', f'lkg:{person_id}', 'other'):
+        redis.strings[key] = b'old'
+
+    invalidator = etl_persons.CacheInvalidator(redis)
+    await invalidator([person_id])
+
+    assert set(redis.strings) == {'other'}
+    (_, message), (existence_channel, _) = redis.published
+    # L1 кеши воркеров сбрасывают и документ, и его ETag
+    assert message.split(':', 1)[1].split('\n') == [person_id, f'etag:{person_id}', f'lkg:{person_id}']
+    assert existence_channel == 'bloom:persons'
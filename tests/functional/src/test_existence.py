@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core.bloom import BloomFilter
+from db.implementation import cache as cache_module
+from db.implementation import existence as existence_module
+from db.implementation.existence import ExistenceIndex, get_existence_index
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from tests.functional.src.fakes import FakeRedis, wait_for
+
+
+@pytest.fixture
+def redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(cache_module, 'redis', redis, raising=False)
+    monkeypatch.setattr(cache_module, 'PUBSUB_RECONNECT_MIN_DELAY', 0.001)
+    return redis
+
+
+@pytest.fixture
+def search_engine() -> InMemorySearchEngine:
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [{'id': f'film-{index}'} for index in range(100)])
+    return search_engine
+
+
+def make_index(search_engine) -> ExistenceIndex:
+    return ExistenceIndex('movies', search_engine, false_positive_rate=0.01, rebuild_interval=3600)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    for index in range(1000):
+        bloom.add(f'id-{index}')
+    # Повторное добавление счётчик не меняет
+    bloom.add('id-0')
+
+    assert bloom.count == 1000
+    assert all(f'id-{index}' in bloom for index in range(1000))
+    false_positives = sum(f'other-{index}' in bloom for index in range(10000))
+    assert false_positives < 300
+    assert bloom.false_positive_rate == pytest.approx(0.01, rel=0.5)
+
+
+def test_bloom_filter_snapshot_round_trip():
+    bloom = BloomFilter.for_capacity(100, 0.01)
+    for index in range(50):
+        bloom.add(f'id-{index}')
+
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert (restored.size_in_bits, restored.hash_count, restored.count) == (bloom.size_in_bits, bloom.hash_count, 50)
+    assert restored.bits == bloom.bits
+    assert 'id-7' in restored
+
+
+@pytest.mark.asyncio
+async def test_rebuild_shares_snapshot_and_additions(redis, search_engine):
+    builder, other = make_index(search_engine), make_index(search_engine)
+    # Пока фильтра нет, ничего не отсекается
+    assert not other.definitely_absent('missing')
+
+    tasks = [asyncio.create_task(builder.run())]
+    try:
+        await wait_for(lambda: builder.ready)
+        tasks.append(asyncio.create_task(other.run()))
+        await wait_for(lambda: other.ready and len(redis.subscribers[other.channel]) == 2)
+        # Строил один воркер под арендой, второй загрузил его снимок
+        assert (builder.rebuilds, other.rebuilds) == (1, 0)
+        assert not other.definitely_absent('film-42')
+        assert other.definitely_absent('missing')
+
+        # Документ, добавленный через API одного воркера, сразу виден остальным
+        await builder.add('film-new')
+        await wait_for(lambda: not other.definitely_absent('film-new'))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_recent_ids_survive_older_snapshot_and_are_trimmed_by_rebuild(redis, search_engine, monkeypatch):
+    monkeypatch.setattr(existence_module, 'EXISTENCE_RECENT_GRACE', 0)
+    builder, other = make_index(search_engine), make_index(search_engine)
+    await builder.rebuild()
+    await other._load_snapshot()
+
+    # Документ записан в индекс в обход API, снимок со временем начала обхода раньше него его не знает
+    search_engine.load('movies', [{'id': 'film-etl'}])
+    await other._handle(f'etl:{existence_module.ADD_MESSAGE_PREFIX}film-etl')
+    await other._load_snapshot()
+    assert not other.definitely_absent('film-etl')
+    assert other.stats()['recent'] == 1
+
+    # Обход, начатый после добавления, уже содержит этот ID: список недавних очищается
+    await asyncio.sleep(0.001)
+    await builder.rebuild()
+    await other._load_snapshot()
+    assert not other.definitely_absent('film-etl')
+    assert other.stats()['recent'] == 0
+
+
+@pytest.mark.asyncio
+async def test_listener_resubscribes_and_waits_for_next_snapshot(redis, search_engine):
+    builder, other = make_index(search_engine), make_index(search_engine)
+    await builder.rebuild()
+    listener = asyncio.create_task(other.run())
+    try:
+        await wait_for(lambda: other.ready)
+
+        # Сообщения, отправленные без подписки, потеряны: фильтр перестаёт отсекать до следующего перестроения
+        redis.disconnect()
+        search_engine.load('movies', [{'id': 'film-lost'}])
+        await builder.add('film-lost')
+        await wait_for(lambda: redis.subscribers[other.channel])
+        assert not other.ready
+        assert not other.definitely_absent('film-lost')
+
+        await builder.rebuild()
+        await wait_for(lambda: other.ready)
+        assert not other.definitely_absent('film-lost')
+        assert other.definitely_absent('missing')
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+
+def test_filter_only_for_indexes_with_write_notifications(monkeypatch):
+    settings = SimpleNamespace(
+        bloom_enabled=True, bloom_indexes=['persons', 'genres'], bloom_false_positive_rate=0.01, bloom_rebuild_interval=60)
+    monkeypatch.setattr(existence_module, 'get_settings', lambda: settings)
+    monkeypatch.setattr(existence_module, 'get_search_engine', InMemorySearchEngine)
+    get_existence_index.cache_clear()
+    try:
+        # О новых фильмах никто не сообщает: фильтр по movies дал бы ложный 404 до перестроения
+        assert get_existence_index('movies') is None
+        assert get_existence_index('persons') is not None
+    finally:
+        get_existence_index.cache_clear()
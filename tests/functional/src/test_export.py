@@ -0,0 +1,103 @@
+import datetime
+import gzip
+import uuid
+
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import films, persons
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from services.film import FilmService, get_film_service
+from services.person import PersonService, get_person_service
+from tests.functional.src.fakes import DictCache
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description ' * 20,
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index % 10),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [{'id': '111', 'name': 'Ann'}],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+def make_person(index: int) -> dict:
+    modified = datetime.datetime(2024, 1, 1) + datetime.timedelta(days=index)
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'full_name': f'Person {index}',
+        'gender': 'female',
+        'created': '2024-01-01T00:00:00',
+        'modified': modified.isoformat(),
+    }
+
+
+@pytest.fixture
+def client() -> httpx.AsyncClient:
+    search_engine = InMemorySearchEngine()
+    # Больше одной страницы point in time и больше одного куска ответа
+    search_engine.load('movies', [make_film(index) for index in range(1, 2501)])
+    search_engine.load('persons', [make_person(index) for index in range(1, 11)])
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.include_router(persons.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: FilmService(DictCache(), search_engine)
+    app.dependency_overrides[get_person_service] = lambda: PersonService(DictCache(), search_engine)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+@pytest.mark.asyncio
+async def test_films_export_streams_every_document_once(client):
+    async with client:
+        plain = await client.get('/api/v1/films/export', headers={'Accept-Encoding': 'identity'})
+        async with client.stream('GET', '/api/v1/films/export', headers={'Accept-Encoding': 'gzip'}) as compressed:
+            raw = b''.join([chunk async for chunk in compressed.aiter_raw()])
+
+    assert plain.headers['content-type'] == 'application/x-ndjson'
+    lines = plain.content.splitlines()
+    assert len(lines) == 2500
+    assert len({orjson.loads(line)['id'] for line in lines}) == 2500
+
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert len(raw) < len(plain.content)
+    assert gzip.decompress(raw) == plain.content
+
+
+@pytest.mark.asyncio
+async def test_export_respects_gzip_quality(client):
+    async with client:
+        refused = await client.get('/api/v1/persons/export', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        wildcard = await client.get('/api/v1/persons/export', headers={'Accept-Encoding': '*'})
+
+    # q=0 - клиент сжатие не принимает
+    assert 'content-encoding' not in refused.headers
+    assert len(refused.content.splitlines()) == 10
+    assert wildcard.headers['content-encoding'] == 'gzip'
+
+
+@pytest.mark.asyncio
+async def test_films_export_has_no_modified_filter(client):
+    async with client:
+        response = await client.get('/api/v1/films/export', params={'modified_since': '2024-01-09T00:00:00'},
+                                    headers={'Accept-Encoding': 'identity'})
+
+    # У фильмов нет поля modified: выгрузка изменений не отдала бы ничего, поэтому параметр не поддерживается
+    assert len(response.content.splitlines()) == 2500
+
+
+@pytest.mark.asyncio
+async def test_persons_export_filters_by_modified(client):
+    async with client:
+        response = await client.get('/api/v1/persons/export', params={'modified_since': '2024-01-09T00:00:00'})
+
+    people = [orjson.loads(line) for line in response.content.splitlines()]
+    assert sorted(person['full_name'] for person in people) == ['Person 10', 'Person 8', 'Person 9']
@@ -0,0 +1,99 @@
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import films
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from services.film import FilmFilters, FilmService, get_film_service
+from tests.functional.src.fakes import DictCache
+
+
+class CountingSearchEngine(InMemorySearchEngine):
+    def __init__(self):
+        super().__init__()
+        self.searches = []
+
+    async def search(self, index: str, body: dict, **kwargs):
+        self.searches.append(body)
+        return await super().search(index, body, **kwargs)
+
+
+def make_film(index: int, genres: list[str], rating: float, year: int, type: str = 'movie') -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': f'{year}-06-01T00:00:00',
+        'rating': rating,
+        'type': type,
+        'genres': genres,
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def search_engine() -> CountingSearchEngine:
+    search_engine = CountingSearchEngine()
+    search_engine.load('movies', [
+        make_film(1, ['Action', 'Sci-Fi'], 8.6, 1977),
+        make_film(2, ['Action'], 7.2, 1980),
+        make_film(3, ['Drama'], 7.9, 1980, type='tv_show'),
+        make_film(4, ['Drama', 'Sci-Fi'], 5.1, 1999),
+    ])
+    return search_engine
+
+
+@pytest.mark.asyncio
+async def test_facets_single_aggregation_request_cached_by_filters(search_engine):
+    cache = DictCache()
+    service = FilmService(cache, search_engine)
+
+    facets = await service.get_facets()
+    assert facets.total == 4
+    assert [(facet.value, facet.count) for facet in facets.genres] == [('Action', 2), ('Drama', 2), ('Sci-Fi', 2)]
+    assert [(facet.value, facet.count) for facet in facets.types] == [('movie', 3), ('tv_show', 1)]
+    assert [(facet.rating, facet.count) for facet in facets.ratings] == [(5.0, 1), (7.0, 2), (8.0, 1)]
+    assert [(facet.year, facet.count) for facet in facets.years] == [(1977, 1), (1980, 2), (1999, 1)]
+    # Один запрос без документов
+    assert len(search_engine.searches) == 1
+    assert search_engine.searches[0]['size'] == 0
+
+    filters = FilmFilters(genres=('Sci-Fi', 'Drama'), rating_min=5.5)
+    filtered = await service.get_facets(filters=filters)
+    assert filtered.total == 2
+    assert [(facet.value, facet.count) for facet in filtered.genres] == [('Action', 1), ('Drama', 1), ('Sci-Fi', 1)]
+
+    # Тот же набор фильтров в другом порядке - из кеша, без Elasticsearch
+    assert await service.get_facets(filters=FilmFilters(genres=('Drama', 'Sci-Fi'), rating_min=5.5)) == filtered
+    assert await service.get_facets() == facets
+    assert len(search_engine.searches) == 2
+
+
+@pytest.mark.asyncio
+async def test_list_and_facets_routes_share_filters(search_engine):
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: FilmService(DictCache(), search_engine)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        params = {'genre': ['Action', 'Drama'], 'rating_min': 7}
+        listed = await client.get('/api/v1/films', params={**params, 'sort': '-rating', 'page_size': 2})
+        next_page = await client.get('/api/v1/films', params={'cursor': listed.headers[films.NEXT_CURSOR_HEADER],
+                                                              'page_size': 2})
+        facets = await client.get('/api/v1/films/facets', params={**params, 'type': 'movie'})
+        invalid = await client.get('/api/v1/films/facets', params={'rating_min': 8, 'rating_max': 7})
+
+    assert [film['rating'] for film in listed.json()] == [8.6, 7.9]
+    # Курсор продолжает обход с теми же фильтрами
+    assert [film['rating'] for film in next_page.json()] == [7.2]
+
+    assert facets.status_code == 200
+    assert facets.headers['cache-control'] == films.FILM_FACETS_CACHE_CONTROL
+    assert facets.json()['total'] == 2
+    assert facets.json()['types'] == [{'value': 'movie', 'count': 2}]
+
+    assert invalid.status_code == 400
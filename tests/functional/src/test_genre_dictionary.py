@@ -0,0 +1,65 @@
+import datetime
+import uuid
+
+import pytest
+
+from db.implementation.genre_dictionary import GenreDictionary
+from services.genre import GenreService
+
+
+class FakeSearchEngine:
+    def __init__(self, genres: list[dict]):
+        self.genres = genres
+        self.loads = 0
+
+    async def search(self, index: str, body: dict, **kwargs):
+        if body.get('size') == 0:
+            last_modified = max(genre['modified'] for genre in self.genres)
+            return {
+                'hits': {'total': {'value': len(self.genres)}, 'hits': []},
+                'aggregations': {'last_modified': {'value': last_modified}},
+            }
+
+        self.loads += 1
+        return {'hits': {'hits': [{'_source': genre} for genre in self.genres]}}
+
+    async def get(self, index: str, id: str, **kwargs):
+        raise AssertionError('genre lookups must not reach the search engine')
+
+
+def make_genre(name: str, modified: int = 0) -> dict:
+    return {
+        'id': str(uuid.uuid4()),
+        'name': name,
+        'created': datetime.datetime(2024, 1, 1).isoformat(),
+        'modified': modified,
+    }
+
+
+@pytest.mark.asyncio
+async def test_refresh_is_skipped_while_index_is_unchanged():
+    search_engine = FakeSearchEngine([make_genre('Action'), make_genre('Drama')])
+    dictionary = GenreDictionary(search_engine, refresh_interval=60)
+
+    assert await dictionary.refresh()
+    assert not await dictionary.refresh()
+    assert search_engine.loads == 1
+
+    # Новый жанр меняет число документов и версию индекса
+    search_engine.genres.append(make_genre('Sci-Fi', modified=1))
+    assert await dictionary.refresh()
+    assert len(dictionary.snapshot.genres) == 3
+
+
+@pytest.mark.asyncio
+async def test_genres_are_served_from_snapshot():
+    action = make_genre('Action')
+    search_engine = FakeSearchEngine([action, make_genre('Science  Fiction')])
+    dictionary = GenreDictionary(search_engine, refresh_interval=60)
+    await dictionary.refresh()
+
+    genre_service = GenreService(None, search_engine, dictionary=dictionary)
+
+    assert str((await genre_service.get_by_id(action['id'])).id) == action['id']
+    assert (await genre_service.get_by_name('science fiction')).name == 'Science  Fiction'
+    assert [genre.name for genre in await genre_service.get_all_genres()] == ['Action', 'Science  Fiction']
@@ -0,0 +1,158 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import films
+from core.http_cache import encoded_etag, etag_matches, make_etag
+from core.response_cache import ResponseCacheMiddleware
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from core.circuit_breaker import last_known_good_key
+from db.abstract.cache import CacheEnvelope
+from db.implementation.popularity import PopularityTracker
+from services.base import etag_key
+from services.film import FilmService, get_film_service
+from tests.functional.src.fakes import DictCache
+
+FILM_ID = str(uuid.UUID(int=1))
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def cache() -> DictCache:
+    return DictCache()
+
+
+@pytest.fixture
+def client(cache) -> httpx.AsyncClient:
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 4)])
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: FilmService(cache, search_engine)
+    app.add_middleware(ResponseCacheMiddleware, cache=cache, routes={'/api/v1/films': 60})
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+def test_etag_matches():
+    etag = make_etag(b'body')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches(encoded_etag(etag, 'gzip'), etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(make_etag(b'other body'), etag)
+    assert not etag_matches(None, etag)
+
+
+@pytest.mark.asyncio
+async def test_film_details_not_modified_without_loading_document(client, cache):
+    async with client:
+        full = await client.get(f'/api/v1/films/{FILM_ID}')
+        cache.reads.clear()
+        cached = await client.get(f'/api/v1/films/{FILM_ID}', headers={'If-None-Match': full.headers['etag']})
+        reads = list(cache.reads)
+        projection = await client.get(f'/api/v1/films/{FILM_ID}?fields=title',
+                                      headers={'If-None-Match': full.headers['etag']})
+
+    assert full.status_code == 200
+    assert full.headers['cache-control'] == films.FILM_DETAILS_CACHE_CONTROL
+
+    assert cached.status_code == 304
+    assert cached.content == b''
+    assert cached.headers['etag'] == full.headers['etag']
+    assert cached.headers['cache-control'] == films.FILM_DETAILS_CACHE_CONTROL
+    # Проверка прошла по ключу с ETag и закешированному документу, без Elasticsearch
+    assert reads == [f'etag:{FILM_ID}', FILM_ID]
+
+    # У проекции другое тело и другой ETag
+    assert projection.status_code == 200
+    assert projection.headers['etag'] != full.headers['etag']
+
+
+@pytest.mark.asyncio
+async def test_not_modified_refreshes_stale_document_and_counts_hit(cache):
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(1)])
+    tracker = PopularityTracker(flush_interval=1, half_life=60, max_members=100)
+    service = FilmService(cache, search_engine, popularity=tracker)
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: service
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        full = await client.get(f'/api/v1/films/{FILM_ID}')
+        # Мягкий срок истёк, а ETag тот же: клиент получает 304, а документ обновляется в фоне
+        cache.data[FILM_ID] = cache.data[FILM_ID]._replace(fresh_until=0.0)
+        search_engine.load('movies', [{**make_film(1), 'title': 'New title'}])
+        cached = await client.get(f'/api/v1/films/{FILM_ID}', headers={'If-None-Match': full.headers['etag']})
+        await asyncio.gather(*service._refresh_tasks)
+
+    assert cached.status_code == 304
+    assert isinstance(cache.data[FILM_ID], CacheEnvelope)
+    assert cache.data[FILM_ID].value.title == 'New title'
+    assert service.swr.refreshes == 1
+    assert tracker.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_list_not_modified_by_validator_key(client, cache):
+    async with client:
+        full = await client.get('/api/v1/films')
+        cache.reads.clear()
+        cached = await client.get('/api/v1/films', headers={'If-None-Match': full.headers['etag']})
+        reads = list(cache.reads)
+        changed = await client.get('/api/v1/films', headers={'If-None-Match': '"stale"'})
+
+    assert full.headers['x-cache'] == 'MISS'
+    assert full.headers['etag'] == make_etag(full.content)
+    assert full.headers['cache-control'] == films.FILMS_LIST_CACHE_CONTROL
+
+    assert cached.status_code == 304
+    assert cached.headers['cache-control'] == films.FILMS_LIST_CACHE_CONTROL
+    # Прочитан только ключ с ETag, тело ответа из кеша не загружалось
+    assert reads == ['response:/api/v1/films?#etag']
+
+    assert changed.status_code == 200
+    assert changed.headers['x-cache'] == 'HIT'
+    assert changed.json() == full.json()
+
+
+@pytest.mark.asyncio
+async def test_film_details_reuse_stored_etag(client, cache):
+    async with client:
+        first = await client.get(f'/api/v1/films/{FILM_ID}')
+        # ETag полного ответа берётся из кеша рядом с документом, а не считается заново по модели
+        cache.data[etag_key(FILM_ID)] = '"stored"'
+        second = await client.get(f'/api/v1/films/{FILM_ID}')
+
+    assert first.headers['etag'] != '"stored"'
+    assert second.headers['etag'] == '"stored"'
+
+
+@pytest.mark.asyncio
+async def test_refresh_of_deleted_document_drops_all_its_keys(cache):
+    service = FilmService(cache, InMemorySearchEngine())
+    for key in (FILM_ID, etag_key(FILM_ID), last_known_good_key(FILM_ID)):
+        cache.data[key] = b'old'
+
+    # Фоновое обновление не нашло документ в Elasticsearch
+    await service._refresh(FILM_ID)
+
+    assert cache.data == {}
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from db.implementation import cache as cache_module
+from db.implementation import local_cache
+from db.implementation.cache import CACHE_INVALIDATION_CHANNEL, MemcachedRepository, TwoTierCacheRepository
+from db.implementation.codecs import CacheCodec
+from db.implementation.local_cache import BoundedTTLCache
+from tests.functional.src.fakes import FakeRedis, wait_for
+
+
+@pytest.fixture
+def redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(cache_module, 'redis', redis, raising=False)
+    monkeypatch.setattr(cache_module, 'PUBSUB_RECONNECT_MIN_DELAY', 0.001)
+    return redis
+
+
+def make_two_tier() -> TwoTierCacheRepository:
+    codec = CacheCodec()
+    return TwoTierCacheRepository(MemcachedRepository(codec), BoundedTTLCache(100, 1 << 20, 60), codec)
+
+
+def test_evicts_least_recently_used_by_entries_and_bytes():
+    cache = BoundedTTLCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.set('a', 'A', size=3)
+    cache.set('b', 'B', size=3)
+    # Чтение делает ключ последним в очереди на вытеснение
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C', size=3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == ('A', 'C')
+
+    # Суммарный размер тоже ограничен: большая запись вытесняет старые
+    cache.set('d', 'D', size=8)
+    assert cache.get('a') is None and cache.get('c') is None
+    assert cache.stats()['bytes'] == 8
+    assert cache.evictions == 3
+
+
+def test_oversized_value_replaces_nothing():
+    cache = BoundedTTLCache(max_entries=10, max_bytes=10, ttl=60)
+    cache.set('a', 'A', size=5)
+    cache.set('b', 'B', size=5)
+
+    # Значение больше всего кеша не кладётся и не вытесняет остальные, но старую версию ключа удаляет
+    cache.set('a', 'huge', size=11)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'B'
+    assert cache.stats()['bytes'] == 5
+
+
+def test_entries_expire_no_later_than_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(local_cache.time, 'monotonic', lambda: now[0])
+    cache = BoundedTTLCache(max_entries=10, max_bytes=100, ttl=30)
+    cache.set('short', 1, size=1, ttl=5)
+    # Время жизни ключа в Redis дольше, чем в L1: берётся меньшее
+    cache.set('long', 2, size=1, ttl=3600)
+
+    now[0] += 10
+    assert cache.get('short') is None
+    assert cache.get('long') == 2
+
+    now[0] += 30
+    assert cache.get('long') is None
+    assert cache.expirations == 2
+    assert cache.stats()['bytes'] == 0
+
+
+def test_delete_and_clear():
+    cache = BoundedTTLCache(max_entries=10, max_bytes=100, ttl=60)
+    cache.set('a', 'A', size=4)
+    cache.set('b', 'B', size=4)
+
+    assert cache.delete('a')
+    assert not cache.delete('a')
+    assert cache.invalidations == 1
+
+    cache.clear()
+    assert cache.get('b') is None
+    assert cache.stats()['entries'] == cache.stats()['bytes'] == 0
+
+
+@pytest.mark.asyncio
+async def test_two_tier_serves_l1_and_publishes_only_overwrites(redis):
+    repository = make_two_tier()
+
+    # Заполнение после промаха и запись ответов не рассылаются: значение в Redis то же самое
+    await repository.set('doc', b'value', 60)
+    await repository.set_many({'response:/api/v1/films?': b'page', 'etag:doc': b'"1"'}, 60)
+    assert redis.published == []
+
+    redis.commands.clear()
+    assert await repository.get('doc') == b'value'
+    assert redis.commands == []
+
+    # Обновление документа и удаление сбрасывают L1 остальных воркеров
+    await repository.set_many({'doc': b'new', 'etag:doc': b'"2"'}, 60, overwrite=True)
+    await repository.delete('gone')
+    assert [message.partition(':')[2] for _, message in redis.published] == ['doc\netag:doc', 'gone']
+    assert {channel for channel, _ in redis.published} == {CACHE_INVALIDATION_CHANNEL}
+    # overwrite до Redis не доходит
+    assert redis.strings['doc'] == b'new'
+
+
+@pytest.mark.asyncio
+async def test_listener_drops_keys_changed_by_other_workers(redis):
+    repository, other = make_two_tier(), make_two_tier()
+    listener = asyncio.create_task(repository.listen_invalidations())
+    try:
+        await wait_for(lambda: redis.subscribers[CACHE_INVALIDATION_CHANNEL])
+        await repository.set('doc', b'old', 60)
+        await repository.set('other', b'value', 60)
+
+        # Собственное сообщение воркер пропускает
+        await repository.set('doc', b'mine', 60, overwrite=True)
+        await asyncio.sleep(0.01)
+        assert repository.local.get('doc') == b'mine'
+
+        await other.set('doc', b'theirs', 60, overwrite=True)
+        await wait_for(lambda: repository.local.get('doc') is None)
+        assert repository.local.get('other') == b'value'
+        assert await repository.get('doc') == b'theirs'
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+    assert redis.subscribers[CACHE_INVALIDATION_CHANNEL] == []
+
+
+@pytest.mark.asyncio
+async def test_listener_resubscribes_and_clears_l1_after_disconnect(redis):
+    repository, other = make_two_tier(), make_two_tier()
+    listener = asyncio.create_task(repository.listen_invalidations())
+    try:
+        await wait_for(lambda: redis.subscribers[CACHE_INVALIDATION_CHANNEL])
+        await repository.set('doc', b'old', 60)
+
+        # Пока соединения нет, инвалидация теряется, и повторная подписка тоже сначала не удаётся
+        redis.failing_subscribes = 2
+        redis.disconnect()
+        await other.set('doc', b'new', 60, overwrite=True)
+
+        await wait_for(lambda: redis.subscribers[CACHE_INVALIDATION_CHANNEL])
+        assert redis.subscribes == 4
+        # L1 сброшен целиком, поэтому потерянное сообщение не оставило устаревшую копию
+        assert repository.local.get('doc') is None
+        assert await repository.get('doc') == b'new'
+
+        # После переподключения сообщения снова доходят
+        await other.delete('doc')
+        await wait_for(lambda: repository.local.get('doc') is None)
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
@@ -0,0 +1,77 @@
+import datetime
+import uuid
+
+import pytest
+
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from services.film import FilmService
+from tests.functional.src.fakes import DictCache
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Star Wars {index}' if index % 3 == 0 else f'Night City {index}',
+        'description': 'New World',
+        'creation_date': (datetime.datetime(2000, 1, 1) + datetime.timedelta(days=index)).isoformat(),
+        'rating': float(index % 10),
+        'type': 'movie',
+        'genres': ['Action'],
+        'actors': [{'id': '111', 'name': 'Ann'}] if index % 2 else [],
+        'directors': [{'id': '333', 'name': 'Ben'}],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def film_service() -> FilmService:
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 51)])
+    return FilmService(DictCache(), search_engine)
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_follow_sort_order(film_service):
+    # 1. Проходим все фильмы по курсору, сортируя по рейтингу
+    page = await film_service.get_all(page_size=7, sort='-rating')
+    films = list(page.films)
+    while page.cursor:
+        page = await film_service.get_all(page_size=7, cursor=page.cursor)
+        if page is None:
+            break
+        films.extend(page.films)
+
+    # 2. Каждый фильм встретился один раз, порядок - как у sorted по (-rating, id)
+    assert len(films) == 50
+    assert [film.id for film in films] == [
+        film.id for film in sorted(films, key=lambda film: (-film.rating, str(film.id)))]
+
+
+@pytest.mark.asyncio
+async def test_search_lookup_and_person_films(film_service):
+    page = await film_service.get_all(page_size=100, query='star')
+    assert len(page.films) == 16
+    assert all('Star' in film.title for film in page.films)
+
+    film = await film_service.get_by_id(str(uuid.UUID(int=7)))
+    assert film.title == 'Night City 7'
+    assert await film_service.get_by_id(str(uuid.UUID(int=999))) is None
+
+    films = await film_service.get_by_person('111', page_size=100, roles=['actor'])
+    assert len(films) == 25
+
+
+@pytest.mark.asyncio
+async def test_bulk_count_and_scan_stream():
+    search_engine = InMemorySearchEngine()
+    success, errors = await search_engine.bulk([
+        {'_index': 'genres', '_id': '1', '_source': {'id': '1', 'name': 'Action'}},
+        {'_index': 'genres', '_id': '2', '_source': {'id': '2', 'name': 'Drama'}},
+        {'_op_type': 'update', '_index': 'genres', '_id': '2', 'doc': {'name': 'Comedy'}},
+        {'_op_type': 'update', '_index': 'genres', '_id': '3', 'doc': {'name': 'Noir'}},
+    ])
+    assert (success, len(errors)) == (3, 1)
+
+    assert await search_engine.count('genres', {'term': {'name.raw': 'Comedy'}}) == 1
+    hits = [hit async for hit in search_engine.scan_stream('genres', source=['name'], page_size=1)]
+    assert [hit['_source'] for hit in hits] == [{'name': 'Action'}, {'name': 'Comedy'}]
@@ -0,0 +1,95 @@
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+
+prometheus_client = pytest.importorskip('prometheus_client')
+
+from core.metrics import (MetricsMiddleware, UNMATCHED_ROUTE, clear_multiprocess_dir, observe_backend,  # noqa: E402
+                          render_metrics)
+from core.response_cache import ResponseCacheMiddleware  # noqa: E402
+from tests.functional.src.fakes import DictCache  # noqa: E402
+
+
+def sample(name: str, **labels) -> float:
+    return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture
+def app() -> FastAPI:
+    router = APIRouter()
+
+    @router.get('/films/{film_id}')
+    async def film_details(film_id: str):
+        return {'id': film_id}
+
+    app = FastAPI()
+    app.include_router(router, prefix='/api/v1')
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_request_latency_is_labelled_by_route_template(app):
+    route = '/api/v1/films/{film_id}'
+    before = sample('http_request_duration_seconds_count', method='GET', route=route, status='200')
+    unmatched = sample('http_request_duration_seconds_count', method='GET', route=UNMATCHED_ROUTE, status='404')
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        for film_id in ('1', '2', '3'):
+            assert (await client.get(f'/api/v1/films/{film_id}')).status_code == 200
+        assert (await client.get('/api/v1/unknown/path')).status_code == 404
+
+    # Разные ID попадают в один временной ряд, неизвестные пути - в общий
+    assert sample('http_request_duration_seconds_count', method='GET', route=route, status='200') == before + 3
+    assert sample(
+        'http_request_duration_seconds_count', method='GET', route=UNMATCHED_ROUTE, status='404') == unmatched + 1
+    assert sample('http_requests_in_flight') == 0
+
+
+@pytest.mark.asyncio
+async def test_responses_from_response_cache_keep_route_template():
+    app = FastAPI()
+
+    @app.get('/api/v1/films')
+    async def films():
+        return [{'id': '1'}]
+
+    app.add_middleware(ResponseCacheMiddleware, cache=DictCache(), routes={'/api/v1/films': 60})
+    app.add_middleware(MetricsMiddleware)
+
+    def count(status: str, route: str = '/api/v1/films') -> float:
+        return sample('http_request_duration_seconds_count', method='GET', route=route, status=status)
+
+    before, not_modified, unmatched = count('200'), count('304'), count('200', UNMATCHED_ROUTE)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        miss = await client.get('/api/v1/films')
+        hits = [await client.get('/api/v1/films') for _ in range(2)]
+        revalidated = await client.get('/api/v1/films', headers={'If-None-Match': miss.headers['etag']})
+
+    assert [response.headers['x-cache'] for response in hits] == ['HIT', 'HIT']
+    assert revalidated.status_code == 304
+    # Ответы из кеша ответов до роутера не доходят, но считаются под шаблоном своей ручки
+    assert count('200') == before + 3
+    assert count('304') == not_modified + 1
+    assert count('200', UNMATCHED_ROUTE) == unmatched
+
+
+def test_backend_errors_are_counted_by_type():
+    labels = {'backend': 'redis', 'operation': 'get', 'index': 'document'}
+    before = sample('backend_errors_total', error='TimeoutError', **labels)
+
+    observe_backend('redis', 'get', 'document', 0.0, TimeoutError())
+
+    assert sample('backend_errors_total', error='TimeoutError', **labels) == before + 1
+    assert b'backend_request_duration_seconds_bucket' in render_metrics()
+
+
+def test_multiprocess_dir_is_cleared_before_workers_start(tmp_path, monkeypatch):
+    # Файлы метрик воркеров прошлого запуска удаляются, остальное в каталоге не трогаем
+    (tmp_path / 'counter_101.db').write_bytes(b'')
+    (tmp_path / 'gauge_livesum_101.db').write_bytes(b'')
+    (tmp_path / 'README').write_text('')
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+
+    clear_multiprocess_dir()
+    assert [path.name for path in tmp_path.iterdir()] == ['README']
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from redis.asyncio import Redis
+
+from db.implementation.pools import (ELASTICSEARCH_POOL_STATS, InstrumentedConnectionPool, PooledAIOHttpConnection,
+                                     redis_pool_stats, warm_up_redis)
+
+
+async def fake_redis(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Минимальный RESP: на PING отвечает PONG, на остальные команды - nil
+    while line := await reader.readline():
+        if not line.startswith(b'*'):
+            continue
+        parts = []
+        for _ in range(int(line[1:])):
+            await reader.readline()
+            parts.append((await reader.readline()).strip())
+        await asyncio.sleep(0.01)
+        writer.write(b'+PONG\r\n' if parts[0].upper() == b'PING' else b'$-1\r\n')
+        await writer.drain()
+    writer.close()
+
+
+async def fake_elasticsearch(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Минимальный HTTP/1.1 с keep-alive: на любой запрос без тела отвечает {}
+    while True:
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            break
+        await asyncio.sleep(0.01)
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}')
+        await writer.drain()
+    writer.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_waits_for_free_connection_and_reports_stats():
+    server = await asyncio.start_server(fake_redis, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    redis = Redis(connection_pool=InstrumentedConnectionPool(host='127.0.0.1', port=port, max_connections=4))
+
+    try:
+        await warm_up_redis(redis, 4)
+        assert redis_pool_stats(redis) | {'acquire_ms_avg': 0, 'acquire_ms_max': 0} == {
+            'in_use': 0, 'idle': 4, 'max_connections': 4, 'created': 4, 'acquires': 4,
+            'acquire_ms_avg': 0, 'acquire_ms_max': 0,
+        }
+
+        # Запросов больше, чем соединений: лишние ждут свободное соединение, а не получают ошибку
+        assert await asyncio.gather(*(redis.get(f'key{index}') for index in range(12))) == [None] * 12
+        stats = redis_pool_stats(redis)
+        assert stats['created'] == 4
+        assert stats['acquires'] == 16
+        assert stats['in_use'] == 0
+        assert stats['acquire_ms_max'] > 0
+    finally:
+        await redis.close()
+        await redis.connection_pool.disconnect()
+        server.close()
+
+
+@pytest.mark.asyncio
+async def test_elasticsearch_pool_usage_from_trace_events():
+    server = await asyncio.start_server(fake_elasticsearch, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    connection = PooledAIOHttpConnection(host='127.0.0.1', port=port, maxsize=2, keepalive_timeout=60)
+    created = ELASTICSEARCH_POOL_STATS.created
+
+    try:
+        # Запросов больше, чем соединений: третий ждёт и получает уже открытое
+        results = await asyncio.gather(*(connection.perform_request('GET', '/') for _ in range(3)))
+        assert [status for status, _, _ in results] == [200] * 3
+        assert connection.pool_usage() == (0, 2)
+        assert ELASTICSEARCH_POOL_STATS.created - created == 2
+
+        # Соединения, простоявшие дольше keep-alive, aiohttp закрывает - свободными они уже не считаются
+        connection.usage.keepalive_timeout = 0
+        assert connection.pool_usage() == (0, 0)
+    finally:
+        await connection.close()
+        server.close()
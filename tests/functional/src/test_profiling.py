@@ -0,0 +1,53 @@
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from core.profiling import ProfiledORJSONResponse, ProfilingMiddleware, current_profile, record_timing
+
+
+@pytest.fixture
+def app(tmp_path) -> FastAPI:
+    app = FastAPI(default_response_class=ProfiledORJSONResponse)
+
+    @app.get('/films')
+    async def films():
+        started = time.perf_counter()
+        time.sleep(0.01)
+        record_timing('search_engine', started)
+        return {'profiled': current_profile() is not None}
+
+    app.add_middleware(ProfilingMiddleware, token='secret', sample_rate=0.0, interval=0.001, output_dir=str(tmp_path))
+    return app
+
+
+@pytest.mark.asyncio
+async def test_only_requests_with_admin_token_are_profiled(app, tmp_path):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        plain = await client.get('/films', headers={'X-Profile': 'guess'})
+        profiled = await client.get('/films', headers={'X-Profile': 'secret'})
+
+    assert plain.json() == {'profiled': False}
+    assert 'server-timing' not in plain.headers
+
+    assert profiled.json() == {'profiled': True}
+    assert profiled.headers['server-timing'].startswith('search_engine;dur=')
+    assert 'serialization;dur=' in profiled.headers['server-timing']
+
+    # Рядом лежат разбивка времени и профиль speedscope со стеком обработчика
+    profile_id = profiled.headers['x-profile-id']
+    summary = json.loads((tmp_path / f'{profile_id}.json').read_text())
+    assert summary['path'] == '/films'
+    assert summary['status'] == 200
+    assert summary['timings_ms']['search_engine'] >= 10
+
+    speedscope = json.loads((tmp_path / f'{profile_id}.speedscope.json').read_text())
+    assert speedscope['profiles'][0]['samples']
+    assert any(frame['name'].endswith('.films') for frame in speedscope['shared']['frames'])
+
+
+def test_record_timing_outside_profiled_request_is_noop():
+    record_timing('cache', time.perf_counter())
+    assert current_profile() is None
@@ -0,0 +1,75 @@
+import uuid
+
+import pytest
+from starlette.datastructures import QueryParams
+
+from core.response_cache import build_cache_key
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from models.film import Film
+from models.projection import parse_fields, project
+from services.film import FilmService
+
+
+class SearchSpy(InMemorySearchEngine):
+    def __init__(self):
+        super().__init__()
+        self.bodies = []
+
+    async def search(self, index: str, body: dict, **kwargs):
+        self.bodies.append(body)
+        return await super().search(index, body, **kwargs)
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'long description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [{'id': '111', 'name': 'Ann'}],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+def test_parse_fields():
+    assert parse_fields(None, Film) is None
+    assert parse_fields(' rating, title ,title', Film) == ('id', 'rating', 'title')
+    with pytest.raises(ValueError, match='unsupported fields: secret'):
+        parse_fields('title,secret', Film)
+
+
+@pytest.mark.asyncio
+async def test_film_list_requests_only_projected_source():
+    search_engine = SearchSpy()
+    search_engine.load('movies', [make_film(index) for index in range(1, 6)])
+    service = FilmService(None, search_engine)
+
+    fields = parse_fields('title,rating', Film)
+    page = await service.get_all(page_size=2, sort='-rating', fields=fields)
+
+    assert search_engine.bodies[0]['_source'] == ['id', 'rating', 'title']
+    assert [film.dict() for film in page.films] == [
+        {'id': uuid.UUID(int=5), 'rating': 5.0, 'title': 'Film 5'},
+        {'id': uuid.UUID(int=4), 'rating': 4.0, 'title': 'Film 4'},
+    ]
+
+    # Следующая страница по курсору сохраняет проекцию
+    next_page = await service.get_all(page_size=2, cursor=page.cursor, fields=fields)
+    assert [film.title for film in next_page.films] == ['Film 3', 'Film 2']
+    assert search_engine.bodies[-1]['_source'] == ['id', 'rating', 'title']
+
+
+def test_project_loaded_document():
+    film = Film(**make_film(1))
+    assert project(film, None) is film
+    assert project(film, ('id', 'title')).dict() == {'id': uuid.UUID(int=1), 'title': 'Film 1'}
+
+
+def test_fields_are_part_of_response_cache_key():
+    key = build_cache_key('/api/v1/films', QueryParams('fields=title,rating'))
+    assert key == build_cache_key('/api/v1/films', QueryParams('fields=rating, title'))
+    assert key != build_cache_key('/api/v1/films', QueryParams(''))
@@ -0,0 +1,67 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from starlette.datastructures import QueryParams
+
+from api.v1 import films, persons
+from core.response_cache import CachedRoute, ResponseCacheMiddleware, build_cache_key, normalize_query_params
+from tests.functional.src.fakes import DictCache
+
+
+def films_key(query: str) -> str:
+    return build_cache_key('/api/v1/films', QueryParams(query), films.FILMS_LIST_CACHED_ROUTE)
+
+
+def test_defaults_are_per_route():
+    assert films_key('') == 'response:/api/v1/films?'
+    assert films_key('page_number=01&page_size=10&sort=id') == films_key('')
+    assert films_key('page_size=20&sort=-rating') == films_key('sort=-rating&page_size=020')
+
+    # У персон свои имена параметров и свой размер страницы
+    route = persons.PERSONS_LIST_CACHED_ROUTE
+    assert build_cache_key('/api/v1/persons', QueryParams('pageSize=5&pageNumber=1'), route) == 'response:/api/v1/persons?'
+    assert normalize_query_params(QueryParams('pageSize=10'), route) == [('pageSize', '10')]
+    # page_size=10 - умолчание только для фильмов
+    assert normalize_query_params(QueryParams('pageSize=10'), films.FILMS_LIST_CACHED_ROUTE) == [('pageSize', '10')]
+
+
+def test_values_are_quoted():
+    injected = films_key('sort=x%26page_number%3D2')
+    assert injected == 'response:/api/v1/films?sort=x%26page_number%3D2'
+    assert injected != films_key('sort=x&page_number=2')
+    assert films_key('fields=title,id') == films_key('fields=id,title') == 'response:/api/v1/films?fields=id%2Ctitle'
+
+
+def test_text_is_folded_only_on_case_insensitive_routes():
+    search = films.FILMS_SEARCH_CACHED_ROUTE
+    assert normalize_query_params(QueryParams('query=%20Star%20%20Wars'), search) == [('query', 'star wars')]
+
+    route = persons.PERSONS_SEARCH_CACHED_ROUTE
+    assert normalize_query_params(QueryParams('query=Star'), route) == [('query', 'Star')]
+    assert normalize_query_params(QueryParams('query=Star%20'), route) == [('query', 'Star ')]
+    assert normalize_query_params(QueryParams('query='), route) == []
+
+
+@pytest.mark.asyncio
+async def test_case_sensitive_search_is_not_served_another_case():
+    app = FastAPI()
+
+    @app.get('/search')
+    async def search(query: str = ''):
+        return {'matches': ['Star Wars'] if query in 'Star Wars' else []}
+
+    cache = DictCache()
+    app.add_middleware(ResponseCacheMiddleware, cache=cache, routes={
+        '/search': CachedRoute(60, defaults={'query': ''}, text_params=('query',)),
+    })
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        upper = await client.get('/search', params={'query': 'Star'})
+        lower = await client.get('/search', params={'query': 'star'})
+        again = await client.get('/search', params={'query': 'Star'})
+
+    assert upper.json() == {'matches': ['Star Wars']}
+    assert lower.headers['x-cache'] == 'MISS'
+    assert lower.json() == {'matches': []}
+    assert again.headers['x-cache'] == 'HIT'
+    assert again.json() == upper.json()
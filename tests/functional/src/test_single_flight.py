@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+import uuid
+
+import pytest
+
+from core.single_flight import SingleFlight
+from services.film import FilmService
+from tests.functional.src.fakes import DictCache
+
+
+class SlowSearchEngine:
+    def __init__(self, doc: dict):
+        self.doc = doc
+        self.calls = 0
+
+    async def get(self, index: str, id: str, **kwargs):
+        self.calls += 1
+        # Держим запрос «в полёте», чтобы все конкурентные промахи успели прийти
+        await asyncio.sleep(0.05)
+        return {'_source': self.doc}
+
+
+def make_film() -> dict:
+    return {
+        'id': str(uuid.uuid4()),
+        'title': 'The Star',
+        'description': 'New World',
+        'creation_date': datetime.datetime.now().isoformat(),
+        'rating': 8.5,
+        'type': 'movie',
+        'genres': ['Action', 'Sci-Fi'],
+        'actors': [{'id': '111', 'name': 'Ann'}, {'id': '222', 'name': 'Bob'}],
+        'directors': [{'id': '333', 'name': 'Ben'}],
+        'screenwriters': [{'id': '444', 'name': 'Howard'}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_backend_call():
+    # 1. Готовим сервис с пустым кешем и медленным Elasticsearch
+    film = make_film()
+    search_engine = SlowSearchEngine(film)
+    film_service = FilmService(DictCache(), search_engine, SingleFlight('movies'))
+
+    # 2. Одновременно запрашиваем один и тот же фильм
+    results = await asyncio.gather(*[film_service.get_by_id(film['id']) for _ in range(1000)])
+
+    # 3. Проверяем, что в Elasticsearch сходил только лидер
+    assert search_engine.calls == 1
+    assert all(str(result.id) == film['id'] for result in results)
+    assert film_service.single_flight.leaders == 1
+    assert film_service.single_flight.coalesced == 999
+
+
+@pytest.mark.asyncio
+async def test_leader_error_is_shared_and_key_released():
+    single_flight = SingleFlight('movies')
+
+    async def failing_load():
+        await asyncio.sleep(0.01)
+        raise ConnectionError('elasticsearch is down')
+
+    # 1. Все ожидающие получают ошибку лидера
+    results = await asyncio.gather(*[single_flight.do('key', failing_load) for _ in range(10)], return_exceptions=True)
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+    # 2. После ошибки ключ освобождается и следующая загрузка выполняется заново
+    async def load():
+        return 'value'
+
+    assert await single_flight.do('key', load) == 'value'
+    assert single_flight.leaders == 2
+
+
+@pytest.mark.asyncio
+async def test_leader_cancellation_does_not_cancel_waiters():
+    single_flight = SingleFlight('movies')
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    # 1. Лидер запускает загрузку, остальные присоединяются к ней
+    leader = asyncio.create_task(single_flight.do('key', load))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(single_flight.do('key', load)) for _ in range(10)]
+    await asyncio.sleep(0)
+
+    # 2. Клиент лидера отключился: отменяется только его запрос
+    leader.cancel()
+    results = await asyncio.gather(leader, *waiters, return_exceptions=True)
+
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ['value'] * 10
+    assert loads == 1
+    assert single_flight.stats()['in_flight'] == 0
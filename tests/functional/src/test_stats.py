@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import stats
+
+
+@pytest.mark.asyncio
+async def test_stats_require_token(monkeypatch):
+    app = FastAPI()
+    app.include_router(stats.router, prefix='/api/v1')
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        monkeypatch.setattr(stats, 'get_settings', lambda: SimpleNamespace(stats_token=None))
+        disabled = await client.get('/api/v1/stats', headers={stats.STATS_TOKEN_HEADER: ''})
+
+        monkeypatch.setattr(stats, 'get_settings', lambda: SimpleNamespace(stats_token='secret'))
+        missing = await client.get('/api/v1/stats')
+        wrong = await client.get('/api/v1/stats', headers={stats.STATS_TOKEN_HEADER: 'guess'})
+        allowed = await client.get('/api/v1/stats', headers={stats.STATS_TOKEN_HEADER: 'secret'})
+
+    assert disabled.status_code == missing.status_code == wrong.status_code == 403
+    assert allowed.status_code == 200
+    assert isinstance(allowed.json(), dict)
@@ -0,0 +1,152 @@
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import suggest
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from db.implementation.suggest_index import PrefixIndex, SuggestEntry, SuggestIndex
+from services.suggest import SuggestService, get_suggest_service
+
+
+class CountingSearchEngine(InMemorySearchEngine):
+    def __init__(self):
+        super().__init__()
+        self.scans = []
+
+    def scan_stream(self, index: str, query: dict | None = None, *args, **kwargs):
+        self.scans.append((index, query))
+        return super().scan_stream(index, query, *args, **kwargs)
+
+
+def make_film(index: int, title: str, rating: float) -> dict:
+    # Документ индекса movies как есть: поля modified у фильмов нет
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': title,
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': rating,
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+def make_person(index: int, full_name: str, films: int, modified: str = '2024-01-01T00:00:00') -> dict:
+    return {
+        'id': str(uuid.UUID(int=1000 + index)),
+        'full_name': full_name,
+        'films': [{'id': str(uuid.UUID(int=film)), 'roles': ['actor']} for film in range(films)],
+        'modified': modified,
+    }
+
+
+def titles(entries: list[SuggestEntry]) -> list[str]:
+    return [entry.text for entry in entries]
+
+
+def test_prefix_index_matches_word_starts_by_score():
+    index = PrefixIndex.build([
+        SuggestEntry('1', 'The Godfather', 9.2),
+        SuggestEntry('2', 'The Godfather: Part II', 9.0),
+        SuggestEntry('3', 'Amélie', 8.3),
+        SuggestEntry('4', 'Godzilla', 6.4),
+        SuggestEntry('5', 'The Dark Knight', 9.0),
+    ])
+
+    assert titles(index.search('godf', 10)) == ['The Godfather', 'The Godfather: Part II']
+    assert titles(index.search('the godfather p', 10)) == ['The Godfather: Part II']
+    # Префикс из одной буквы отвечает заранее посчитанным списком, тот же порядок по убыванию рейтинга
+    assert titles(index.search('g', 3)) == ['The Godfather', 'The Godfather: Part II', 'Godzilla']
+    assert titles(index.search('ame', 10)) == ['Amélie']
+    assert index.search('zz', 10) == []
+
+    # Переименованный фильм больше не находится по старому названию
+    updated = index.updated([SuggestEntry('4', 'Mothra', 6.4)])
+    assert titles(updated.search('godz', 10)) == []
+    assert titles(updated.search('moth', 10)) == ['Mothra']
+    assert updated.keys == sorted(updated.keys)
+    assert titles(index.search('godz', 10)) == ['Godzilla']
+
+
+@pytest.mark.asyncio
+async def test_suggest_index_loads_changed_documents_incrementally():
+    search_engine = CountingSearchEngine()
+    search_engine.load('movies', [make_film(1, 'Star Wars', 8.6), make_film(2, 'Stardust', 7.6)])
+    search_engine.load('persons', [make_person(1, 'Mark Hamill', 3), make_person(2, 'Mark Ruffalo', 5)])
+    index = SuggestIndex(search_engine, refresh_interval=60, full_reload_interval=600)
+
+    await index.refresh()
+    assert index.ready
+    found = index.suggest('Star', 10)
+    assert titles(found['films']) == ['Star Wars', 'Stardust']
+    assert titles(index.suggest('mark', 10)['persons']) == ['Mark Ruffalo', 'Mark Hamill']
+
+    # Ничего не менялось - индекс не перечитывается
+    await index.refresh()
+    assert len(search_engine.scans) == 2
+
+    # Новая персона: подгружаются только изменённые после прошлой загрузки документы
+    search_engine.load('persons', [make_person(3, 'Mark Strong', 1, modified='2024-02-01T00:00:00')])
+    await index.refresh()
+    assert search_engine.scans[-1] == ('persons', {'range': {'modified': {'gt': '2024-01-01T00:00:00'}}})
+    assert titles(index.suggest('mark', 10)['persons']) == ['Mark Ruffalo', 'Mark Hamill', 'Mark Strong']
+    assert index.incremental_updates == 1
+
+    # Новый фильм меняет число документов: индекс фильмов загружается заново целиком
+    search_engine.load('movies', [make_film(3, 'Starship Troopers', 7.3)])
+    await index.refresh()
+    assert search_engine.scans[-1] == ('movies', None)
+    assert titles(index.suggest('star', 10)['films']) == ['Star Wars', 'Stardust', 'Starship Troopers']
+
+
+@pytest.mark.asyncio
+async def test_films_without_modified_are_reloaded_periodically():
+    search_engine = CountingSearchEngine()
+    search_engine.load('movies', [make_film(1, 'Star Wars', 8.6)])
+    search_engine.load('persons', [make_person(1, 'Mark Hamill', 3)])
+    index = SuggestIndex(search_engine, refresh_interval=60, full_reload_interval=600)
+    await index.refresh()
+
+    # Фильм переименован, число документов то же: до полной перезагрузки изменение не видно
+    search_engine.load('movies', [make_film(1, 'Star Wars: A New Hope', 8.6)])
+    await index.refresh()
+    assert titles(index.suggest('star', 10)['films']) == ['Star Wars']
+
+    # Прошёл full_reload_interval с последней полной загрузки
+    index.loaded_at['films'] -= 600
+    await index.refresh()
+    assert titles(index.suggest('star', 10)['films']) == ['Star Wars: A New Hope']
+    # Персоны с modified не перечитываются
+    assert [scan for scan in search_engine.scans if scan[0] == 'persons'] == [('persons', None)]
+
+
+@pytest.mark.asyncio
+async def test_suggest_route():
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(1, 'Star Wars', 8.6)])
+    search_engine.load('persons', [make_person(1, 'Harrison Ford', 4)])
+    index = SuggestIndex(search_engine, refresh_interval=60, full_reload_interval=600)
+
+    app = FastAPI()
+    app.include_router(suggest.router, prefix='/api/v1')
+    app.dependency_overrides[get_suggest_service] = lambda: SuggestService(index)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        loading = await client.get('/api/v1/suggest', params={'q': 'st'})
+        await index.refresh()
+        response = await client.get('/api/v1/suggest', params={'q': 'St', 'limit': 5})
+
+    assert loading.status_code == 503
+    assert loading.headers['retry-after'] == '1'
+
+    assert response.status_code == 200
+    assert response.headers['cache-control'] == suggest.SUGGEST_CACHE_CONTROL
+    assert response.json() == {
+        'films': [{'id': str(uuid.UUID(int=1)), 'text': 'Star Wars', 'score': 8.6}],
+        'persons': [],
+    }
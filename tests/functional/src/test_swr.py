@@ -0,0 +1,120 @@
+import asyncio
+import math
+import random
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from core import swr
+from core.swr import Freshness, StaleWhileRevalidate
+from db.abstract.cache import CacheEnvelope
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from models.film import Film
+from services.base import document_cache_keys
+from services.film import FilmService
+from tests.functional.src.fakes import DictCache
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(swr, 'time', SimpleNamespace(time=lambda: NOW))
+
+
+def make_film(index: int, title: str = 'Film') -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': title,
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': 5.0,
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+def test_wrap_sets_soft_and_hard_expiry_with_jitter(frozen_time):
+    policy = StaleWhileRevalidate(fresh_ttl=100, stale_ttl=50, jitter=0.1)
+    for _ in range(100):
+        envelope, expire = policy.wrap('value', delta=0.2)
+        assert envelope.value == 'value' and envelope.delta == 0.2
+        assert NOW + 90 <= envelope.fresh_until <= NOW + 110
+        # Ключ живёт в Redis дольше мягкого срока на stale_ttl с разбросом
+        assert envelope.fresh_until - NOW + 45 <= expire <= envelope.fresh_until - NOW + 55 + 1
+
+    exact = StaleWhileRevalidate(fresh_ttl=100, stale_ttl=50, jitter=0)
+    envelope, expire = exact.wrap('value', delta=0)
+    assert (envelope.fresh_until, expire) == (NOW + 100, 150)
+
+
+def test_check_fresh_stale_and_cost_free_values(frozen_time, monkeypatch):
+    policy = StaleWhileRevalidate(fresh_ttl=100, stale_ttl=50)
+    # Худший для раннего обновления случай: 1 - random() почти 0, логарифм почти -21
+    monkeypatch.setattr(swr.random, 'random', lambda: 1 - 1e-9)
+
+    assert policy.check(CacheEnvelope('value', NOW, 1.0)) == Freshness.STALE
+    assert policy.check(CacheEnvelope('value', NOW - 10, 0.0)) == Freshness.STALE
+    # Значение, расчёт которого ничего не стоит, заранее не обновляется
+    assert policy.check(CacheEnvelope('value', NOW + 0.001, 0.0)) == Freshness.FRESH
+    assert policy.stats() == {
+        'fresh_served': 1, 'stale_served': 2, 'early_refreshes': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+
+def test_xfetch_refreshes_early_depending_on_cost_and_time_left(frozen_time, monkeypatch):
+    policy = StaleWhileRevalidate(fresh_ttl=100, stale_ttl=50, beta=1.0)
+
+    # -delta * beta * log(1 - random()) сравнивается с остатком мягкого срока
+    monkeypatch.setattr(swr.random, 'random', lambda: 1 - math.exp(-2))
+    assert policy.check(CacheEnvelope('value', NOW + 1.9, 1.0)) == Freshness.EARLY
+    assert policy.check(CacheEnvelope('value', NOW + 2.1, 1.0)) == Freshness.FRESH
+    # Дорогой расчёт начинает обновляться раньше
+    assert policy.check(CacheEnvelope('value', NOW + 3.9, 2.0)) == Freshness.EARLY
+    # beta > 1 делает обновление ещё более ранним
+    assert StaleWhileRevalidate(100, 50, beta=2.0).check(CacheEnvelope('value', NOW + 3.9, 1.0)) == Freshness.EARLY
+
+    # random() == 0 - логарифм 0, значение до мягкого срока всегда свежее
+    monkeypatch.setattr(swr.random, 'random', lambda: 0.0)
+    assert policy.check(CacheEnvelope('value', NOW + 0.001, 100.0)) == Freshness.FRESH
+    assert policy.early_refreshes == 2
+
+
+def test_xfetch_early_refresh_probability(frozen_time, monkeypatch):
+    # Вероятность раннего обновления за remaining секунд до мягкого срока - exp(-remaining / (delta * beta))
+    monkeypatch.setattr(swr, 'random', random.Random(7))
+    policy = StaleWhileRevalidate(fresh_ttl=100, stale_ttl=50)
+    checks = 20000
+    for remaining, delta in ((1.0, 1.0), (5.0, 1.0), (1.0, 0.1)):
+        early = sum(
+            policy.check(CacheEnvelope('value', NOW + remaining, delta)) == Freshness.EARLY for _ in range(checks))
+        assert early / checks == pytest.approx(math.exp(-remaining / delta), abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_service_serves_stale_value_and_refreshes_in_background():
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(1, 'New title')])
+    cache = DictCache()
+    service = FilmService(cache, search_engine)
+    film_id = str(uuid.UUID(int=1))
+
+    # В кеше устаревшая копия: её отдаём сразу, не дожидаясь Elasticsearch
+    cache.data[film_id] = CacheEnvelope(Film(**make_film(1, 'Old title')), 0.0, 0.1)
+    film = await service.get_by_id(film_id)
+    assert film.title == 'Old title'
+
+    await asyncio.gather(*service._refresh_tasks)
+    assert cache.data[film_id].value.title == 'New title'
+    assert service.swr.stats()['stale_served'] == 1
+    assert service.swr.refreshes == 1
+
+    # Документ удалили из индекса: после обновления устаревшая копия, её ETag и последняя известная копия удалены
+    cache.data[film_id] = cache.data[film_id]._replace(fresh_until=0.0)
+    search_engine.indexes['movies'].docs.pop(film_id)
+    await service.get_by_id(film_id)
+    await asyncio.gather(*service._refresh_tasks)
+    assert not set(document_cache_keys(film_id)) & set(cache.data)
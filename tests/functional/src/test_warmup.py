@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import films
+from core.response_cache import ResponseCacheMiddleware, build_cache_key
+from db.implementation import cache as cache_module
+from db.implementation.memory_search_engine import InMemorySearchEngine
+from db.implementation.popularity import POPULARITY_PAGES, PopularityTracker, popularity_key
+from services.film import FilmService, get_film_service
+from services.warmup import CacheWarmer, asgi_page_renderer
+from starlette.datastructures import QueryParams
+from tests.functional.src.fakes import DictCache, FakeRedis
+
+
+class SlowSearchEngine(InMemorySearchEngine):
+    async def mget(self, index: str, ids: list[str], **kwargs):
+        await asyncio.sleep(1)
+        return await super().mget(index, ids, **kwargs)
+
+
+def make_film(index: int) -> dict:
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'title': f'Film {index}',
+        'description': 'description',
+        'creation_date': '2000-01-01T00:00:00',
+        'rating': float(index),
+        'type': 'movie',
+        'genres': ['Drama'],
+        'actors': [],
+        'directors': [],
+        'screenwriters': [],
+    }
+
+
+@pytest.fixture
+def redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(cache_module, 'redis', redis, raising=False)
+    return redis
+
+
+@pytest.mark.asyncio
+async def test_popularity_flushes_counts_trims_and_decays(redis):
+    tracker = PopularityTracker(flush_interval=1, half_life=60, max_members=2)
+    for member, hits in (('a', 1), ('b', 5), ('c', 3)):
+        for _ in range(hits):
+            tracker.hit('movies', member)
+
+    await tracker.flush()
+    assert await tracker.top('movies', 10) == ['b', 'c']
+    assert redis.zsets[popularity_key('movies')] == {'b': 5, 'c': 3}
+
+    # Затухание одно на half_life, сколько бы воркеров его ни пробовали
+    assert await tracker.decay()
+    assert not await tracker.decay()
+    assert redis.zsets[popularity_key('movies')] == {'b': 2.5, 'c': 1.5}
+    assert tracker.stats()['pending'] == 0
+
+
+@pytest.mark.asyncio
+async def test_warmer_preloads_popular_documents_and_pages(redis):
+    search_engine = InMemorySearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 6)])
+    cache = DictCache()
+    tracker = PopularityTracker(flush_interval=1, half_life=60, max_members=100)
+    service = FilmService(cache, search_engine, popularity=tracker)
+
+    app = FastAPI()
+    app.include_router(films.router, prefix='/api/v1')
+    app.dependency_overrides[get_film_service] = lambda: service
+    app.add_middleware(ResponseCacheMiddleware, cache=cache, routes={'/api/v1/films': 60}, popularity=tracker)
+    render_page = asgi_page_renderer(app)
+
+    popular = [str(uuid.UUID(int=index)) for index in (3, 1)]
+    for film_id in popular + popular[:1]:
+        await service.get_by_id(film_id)
+    assert await render_page('/api/v1/films?sort=-rating')
+    # Несуществующие фильмы не считаются
+    assert await service.get_by_id(str(uuid.UUID(int=99))) is None
+    await tracker.flush()
+    hits = tracker.hits
+
+    # Кеш остыл после перезапуска
+    cache.data.clear()
+    warmer = CacheWarmer(tracker, [service], cache, render_page=render_page, batch_size=1)
+    report = await warmer.warm()
+
+    assert report.keys == {'movies': 2, POPULARITY_PAGES: 0}
+    assert set(popular) <= set(cache.data)
+    assert not report.timed_out and report.failed == 0
+
+    # Страница попала в счётчики через ResponseCacheMiddleware только обычным запросом, не запросом прогрева
+    assert tracker.hits == hits
+    tracker.hit(POPULARITY_PAGES, build_cache_key('/api/v1/films', QueryParams('sort=-rating')))
+    await tracker.flush()
+    report = await warmer.warm()
+    assert report.keys == {'movies': 2, POPULARITY_PAGES: 1}
+    assert build_cache_key('/api/v1/films', QueryParams('sort=-rating')) in cache.data
+
+
+@pytest.mark.asyncio
+async def test_warmer_stops_at_time_budget(redis):
+    search_engine = SlowSearchEngine()
+    search_engine.load('movies', [make_film(index) for index in range(1, 5)])
+    tracker = PopularityTracker(flush_interval=1, half_life=60, max_members=100)
+    service = FilmService(DictCache(), search_engine, popularity=tracker)
+    for index in range(1, 5):
+        tracker.hit('movies', str(uuid.UUID(int=index)))
+    await tracker.flush()
+
+    warmer = CacheWarmer(tracker, [service], service.cache, concurrency=2, batch_size=1, time_budget=0.05)
+    report = await warmer.warm()
+
+    assert report.timed_out
+    assert report.keys['movies'] == 0
+    assert report.duration < 0.5